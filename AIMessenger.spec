@@ -11,14 +11,17 @@ a = Analysis(
     pathex=['/Users/keston/Github/xerolith/src'],
     binaries=[],
     datas=datas,
-    hiddenimports=[
-        'aiosqlite', 'anyio', 'certifi', 'h11', 'httpcore',
-        'httpx', 'idna', 'ollama', 'pytypedstream',
-        'sniffio', 'typing_extensions'
-    ],
+    # imported inside functions to keep them off the startup path, the rest
+    # of the dependency tree is found by analysis
+    hiddenimports=['aiosqlite', 'diagnostics', 'model_router', 'ollama', 'typedstream'],
     hookspath=[],
     runtime_hooks=[],
-    excludes=[],
+    # pulled in by optional imports somewhere in the tree, never used
+    excludes=[
+        'tkinter', 'unittest', 'pydoc', 'doctest', 'lib2to3', 'test', 'xmlrpc',
+        'curses', 'pytest', 'IPython', 'numpy', 'trio', 'h2', 'socksio',
+        'brotli', 'brotlicffi', 'rich', 'pygments', 'setuptools', 'pip',
+    ],
     noarchive=False,
     optimize=0,
 )
@@ -33,10 +36,10 @@ exe = EXE(
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
-    upx=True,
+    upx=False,  # decompressing at every launch costs more than the space saved
     console=False,  # Set to False if it's a GUI app
     disable_windowed_traceback=False,
-    argv_emulation=True,
+    argv_emulation=False,  # no files are opened with the app, don't wait for Apple events
     target_arch=None,
     codesign_identity=None,
     entitlements_file=None,
@@ -49,7 +52,7 @@ app = BUNDLE(
     a.zipfiles,
     a.datas,
     strip=False,
-    upx=True,
+    upx=False,
     upx_exclude=[],
     name='AIMessenger.app'  # Output as a .app bundle for macOS
 )
@@ -0,0 +1,93 @@
+"""
+Per-query latency of DatabaseManager's persistent read-only connection
+against the old connect-per-query path, on a synthetic chat.db.
+
+    python benchmarks/db_query_bench.py --messages 200000 --queries 500
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiosqlite
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "tests"))
+
+from chat_db_factory import build_chat_db  # type: ignore
+from db_manager import DatabaseManager  # type: ignore
+
+
+async def connect_per_query(db_path, query, params):
+    """the pre-persistent-connection path"""
+    async with aiosqlite.connect(db_path) as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(query, params)
+            return await cursor.fetchall()
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(
+        f"{name:<22} mean {statistics.mean(samples) * 1000:7.3f} ms"
+        f"  p50 {statistics.median(samples) * 1000:7.3f} ms"
+        f"  p95 {p95 * 1000:7.3f} ms"
+    )
+
+
+async def run(messages, queries):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "chat.db")
+        # held open for the whole run, like Messages keeps chat.db open
+        writer = build_chat_db(db_path, messages)
+        query = """
+        SELECT handle.id, message.text, message.attributedBody, message.date, message.is_from_me
+        FROM message
+        JOIN handle ON message.handle_id = handle.ROWID
+        WHERE handle.id = ?
+        ORDER BY message.date DESC
+        LIMIT ?;
+        """
+
+        per_query = []
+        for i in range(queries):
+            start = time.perf_counter()
+            await connect_per_query(
+                db_path, query, (writer.handles[i % len(writer.handles)], 10)
+            )
+            per_query.append(time.perf_counter() - start)
+
+        db_manager = DatabaseManager(tmp)
+        persistent = []
+        try:
+            for i in range(queries):
+                start = time.perf_counter()
+                await db_manager.get_latest_messages_for_chat(
+                    10, writer.handles[i % len(writer.handles)]
+                )
+                persistent.append(time.perf_counter() - start)
+        finally:
+            await db_manager.close()
+            writer.close()
+
+        print(f"{messages} messages, {queries} queries")
+        report("connect per query", per_query)
+        report("persistent connection", persistent)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=300)
+    args = parser.parse_args()
+    asyncio.run(run(args.messages, args.queries))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+attributedBody decode cost: the full typedstream decoder, the NSString fast
+path, and a warm DecodeCache.
+
+    python benchmarks/decode_bench.py --blobs 5000
+"""
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "tests"))
+
+from typedstream import unarchive_from_data  # type: ignore
+
+from attributed_body import DecodeCache, decode_many, fast_extract_text  # type: ignore
+from chat_db_factory import make_attributed_body  # type: ignore
+
+
+def timed(name, blobs, decode):
+    start = time.perf_counter()
+    for i, blob in enumerate(blobs):
+        decode(i, blob)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<16} {elapsed / len(blobs) * 1e6:8.2f} us/blob")
+
+
+def cached(cache):
+    """the DatabaseManager.decode path for one row: lookup, decode on a miss, store"""
+
+    def decode(rowid, blob):
+        hit, text = cache.lookup(rowid)
+        if not hit:
+            (text, _), = decode_many([blob])
+            cache.store(rowid, text)
+        return text
+
+    return decode
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--blobs", type=int, default=5000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    words = ["hey", "@a", "dinner", "tonight?", "sounds", "good", "👍", "lol", "ok"]
+    blobs = [
+        make_attributed_body(" ".join(rng.choices(words, k=rng.randint(1, 60))))
+        for _ in range(args.blobs)
+    ]
+
+    timed("typedstream", blobs, lambda i, b: unarchive_from_data(b).contents[0].value.value)
+    timed("fast path", blobs, lambda i, b: fast_extract_text(b))
+    cache = DecodeCache(max_size=len(blobs))
+    timed("cache (cold)", blobs, cached(cache))
+    timed("cache (warm)", blobs, cached(cache))
+
+
+if __name__ == "__main__":
+    main()
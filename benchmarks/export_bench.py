@@ -0,0 +1,107 @@
+"""
+Exporting a multi-million message synthetic chat.db with history_export,
+against materializing every row with one fetchall() and decoding in
+process, the way _process_messages handles a query. Each run is its own
+process so peak RSS belongs to that run alone.
+
+    python benchmarks/export_bench.py --messages 2000000 --workers 1 4 8
+    python benchmarks/export_bench.py --db /tmp/chat.db   # reuse a built one
+"""
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "tests"))
+
+from chat_db_factory import build_chat_db  # type: ignore
+from db_manager import _MESSAGE_SELECT  # type: ignore
+from history_export import export_batch, export_history, peak_rss_mb  # type: ignore
+
+
+def materialized(db_path, out_path):
+    """every row in memory at once, decoded and serialized on one core, then written"""
+    import sqlite3
+
+    start = time.perf_counter()
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(_MESSAGE_SELECT).fetchall()
+    data, _ = export_batch(rows, "jsonl")
+    with open(out_path, "wb") as f:
+        f.write(data)
+    seconds = time.perf_counter() - start
+    own, _ = peak_rss_mb()
+    return {
+        "messages": len(rows),
+        "seconds": seconds,
+        "messages_per_second": len(rows) / seconds,
+        "peak_rss_mb": own,
+        "worker_peak_rss_mb": 0.0,
+    }
+
+
+def child(args):
+    """one measured run, stats as JSON on stdout"""
+    logging.disable(logging.INFO)
+    if args.child == "materialized":
+        stats = materialized(args.db, args.out)
+    else:
+        stats = export_history(
+            args.db, args.out, fmt=args.format, batch_size=args.batch_size, workers=int(args.child)
+        )
+    print(json.dumps(stats))
+
+
+def measure(name, db_path, out_path, args):
+    command = [
+        sys.executable, __file__, "--child", name, "--db", db_path, "--out", out_path,
+        "--batch-size", str(args.batch_size), "--format", args.format,
+    ]
+    stats = json.loads(subprocess.run(command, check=True, capture_output=True, text=True).stdout)
+    label = "fetchall" if name == "materialized" else f"{name} worker(s)"
+    print(
+        f"{label:<14} {stats['messages']:9d} msgs  {stats['seconds']:7.1f} s"
+        f"  {stats['messages_per_second']:9.0f} msg/s  peak RSS {stats['peak_rss_mb']:7.1f} MB"
+        f"  workers {stats['worker_peak_rss_mb']:6.1f} MB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000000)
+    parser.add_argument("--db", default=None, help="an existing chat.db instead of building one")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--format", choices=("jsonl", "parquet"), default="jsonl")
+    parser.add_argument("--skip-fetchall", action="store_true", help="leave out the materialized run")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--out", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = args.db
+        if db_path is None:
+            db_path = os.path.join(tmp, "chat.db")
+            start = time.perf_counter()
+            build_chat_db(db_path, args.messages).close()
+            print(f"built {args.messages} messages in {time.perf_counter() - start:.0f} s")
+        print(f"{os.cpu_count()} cores, batches of {args.batch_size}")
+        runs = ([] if args.skip_fetchall else ["materialized"]) + [str(w) for w in dict.fromkeys(args.workers)]
+        for name in runs:
+            out_path = os.path.join(tmp, f"export-{name}.{args.format}")
+            measure(name, db_path, out_path, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Building the history index from a synthetic chat.db, then top-k retrieval
+from it against the LIKE scan over chat.db it replaces.
+
+    python benchmarks/history_index_bench.py --messages 200000 --queries 300
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiosqlite
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "tests"))
+
+from chat_db_factory import WORDS, build_chat_db  # type: ignore
+from db_manager import DatabaseManager  # type: ignore
+from history_index import HistoryIndex  # type: ignore
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    p95 = samples[max(0, int(len(samples) * 0.95) - 1)]
+    print(
+        f"{name:<22} mean {statistics.mean(samples) * 1000:7.3f} ms"
+        f"  p50 {statistics.median(samples) * 1000:7.3f} ms"
+        f"  p95 {p95 * 1000:7.3f} ms"
+    )
+
+
+async def like_scan(conn, chat_id, word, k):
+    """the chat.db query a search would otherwise be, text only, no blobs"""
+    return await conn.execute_fetchall(
+        """SELECT message.ROWID, message.text FROM message
+        JOIN chat_message_join ON chat_message_join.message_id = message.ROWID
+        WHERE chat_message_join.chat_id = ? AND message.text LIKE ?
+        ORDER BY message.date DESC LIMIT ?;""",
+        (chat_id, f"%{word}%", k),
+    )
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        writer = build_chat_db(os.path.join(tmp, "chat.db"), args.messages)
+        db_manager = DatabaseManager(tmp)
+        index = HistoryIndex(os.path.join(tmp, "state", "history.db"))
+        rng = random.Random(0)
+        try:
+            start = time.perf_counter()
+            indexed = await index.build(db_manager, args.batch_size)
+            elapsed = time.perf_counter() - start
+            print(
+                f"built {indexed} messages in {elapsed:.1f}s ({indexed / elapsed:,.0f} rows/s), "
+                f"{os.path.getsize(os.path.join(tmp, 'state', 'history.db')) / 1e6:.1f} MB"
+            )
+
+            queries = [
+                (rng.choice(writer.chats)[0], " ".join(rng.choices(WORDS, k=4)))
+                for _ in range(args.queries)
+            ]
+            searched = []
+            for chat_id, text in queries:
+                start = time.perf_counter()
+                await index.search(chat_id, text, args.k)
+                searched.append(time.perf_counter() - start)
+
+            scanned = []
+            async with aiosqlite.connect(os.path.join(tmp, "chat.db")) as conn:
+                for chat_id, text in queries:
+                    start = time.perf_counter()
+                    await like_scan(conn, chat_id, text.split()[0], args.k)
+                    scanned.append(time.perf_counter() - start)
+        finally:
+            await index.close()
+            await db_manager.close()
+            writer.close()
+
+        print(f"{args.messages} messages, {args.queries} queries, top {args.k}")
+        report("fts5 search", searched)
+        report("LIKE scan (one word)", scanned)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("-k", type=int, default=3)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Per-message cost of reading chat.db rows: the old per-row dict with its
+datetime(..., 'localtime') column against Message records with the date
+converted in Python. Reports query time, build time and the memory held by
+the records.
+
+    python benchmarks/message_record_bench.py --messages 200000
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "tests"))
+
+from chat_db_factory import build_chat_db  # type: ignore
+from db_manager import _MESSAGE_SELECT  # type: ignore
+from message import APPLE_EPOCH, Message  # type: ignore
+
+# the query and record as they were before Message
+LEGACY_SELECT = """
+        SELECT message.ROWID, chat.ROWID, chat.guid, handle.id, message.text,
+            message.attributedBody,
+            datetime(message.date/1000000000 + strftime("%s", "2001-01-01"),
+            "unixepoch", "localtime") as timestamp, message.is_from_me, message.date
+        FROM message
+        JOIN chat_message_join ON chat_message_join.message_id = message.ROWID
+        JOIN chat ON chat.ROWID = chat_message_join.chat_id
+        LEFT JOIN handle ON message.handle_id = handle.ROWID
+"""
+
+
+def legacy_record(row):
+    rowid, chat_id, chat_guid, handle_id, text, _, timestamp, is_from_me, date = row
+    return {
+        "rowid": rowid,
+        "chat_id": chat_id,
+        "chat_guid": chat_guid,
+        "handle_id": handle_id,
+        "text": text,
+        "timestamp": timestamp,
+        "is_from_me": is_from_me,
+        "unix_time": date / 1e9 + APPLE_EPOCH if date else None,
+    }
+
+
+def measure(name, conn, query, build, count):
+    start = time.perf_counter()
+    rows = conn.execute(f"{query} ORDER BY message.ROWID;").fetchall()
+    queried = time.perf_counter() - start
+
+    start = time.perf_counter()
+    records = [build(row) for row in rows]
+    built = time.perf_counter() - start
+    del records
+
+    # a second pass for memory, tracemalloc slows allocation down
+    tracemalloc.start()
+    records = [build(row) for row in rows]
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(records) == count
+    print(
+        f"{name:<8} query {queried / count * 1e6:6.2f} us/row"
+        f"  build {built / count * 1e6:6.2f} us/row"
+        f"  held {held / count:6.0f} B/row"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "chat.db")
+        # plain text rows, so decoding doesn't drown out the record cost
+        build_chat_db(db_path, args.messages, attributed_fraction=0.0).close()
+        conn = sqlite3.connect(db_path)
+        try:
+            print(f"{args.messages} messages")
+            measure("dict", conn, LEGACY_SELECT, legacy_record, args.messages)
+            measure("Message", conn, _MESSAGE_SELECT, Message.from_row, args.messages)
+        finally:
+            conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+OllamaClient.get_msg under load against the fake Ollama server: several
+conversations taking turns at once, with a scripted time to first token,
+generation speed and prompt evaluation cost. Reports reply latency, queueing
+at the server and how much of each prompt the KV cache covered. With
+--backends above 1 the requests go through the model router to that many
+servers.
+
+    python benchmarks/model_load_bench.py --conversations 8 --turns 10 --server-concurrency 2
+    python benchmarks/model_load_bench.py --conversations 8 --backends 3
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "tests"))
+
+from config import config  # type: ignore
+from context_cache import ConversationContextCache  # type: ignore
+from fake_ollama import FakeOllama  # type: ignore
+from message import Message  # type: ignore
+from model_client import OllamaClient  # type: ignore
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    p95 = samples[max(0, int(len(samples) * 0.95) - 1)]
+    print(
+        f"{name:<16} mean {statistics.mean(samples) * 1000:8.1f} ms"
+        f"  p50 {statistics.median(samples) * 1000:8.1f} ms"
+        f"  p95 {p95 * 1000:8.1f} ms"
+    )
+
+
+async def conversation(client, cache, key, turns, think_time, rng, latencies):
+    words = "dinner tonight maybe tacos or pizza what time works for everyone".split()
+    cache.load(key, [])
+    for turn in range(turns):
+        text = f"{config['mention']} " + " ".join(rng.choices(words, k=rng.randint(4, 20)))
+        cache.append(key, Message(turn + 1, None, 1, key, None, text, 0))
+        start = time.perf_counter()
+        reply = await client.get_msg(cache.get(key))
+        latencies.append(time.perf_counter() - start)
+        cache.add_reply(key, reply)
+        await asyncio.sleep(rng.uniform(0, think_time))
+
+
+async def run(args):
+    servers = [
+        FakeOllama(
+            reply="sure thing, see you there at seven then",
+            ttft=args.ttft,
+            tokens_per_second=args.tokens_per_second,
+            prompt_seconds_per_token=args.prompt_seconds_per_token,
+            max_concurrency=args.server_concurrency,
+        )
+        for _ in range(args.backends)
+    ]
+    urls = [await server.start() for server in servers]
+    if args.backends > 1:
+        backends = [{"host": url, "max_connections": args.server_concurrency} for url in urls]
+        client = OllamaClient(dict(config, backends=backends))
+    else:
+        client = OllamaClient(dict(config, ollama_host=urls[0]))
+    cache = ConversationContextCache(
+        config["max_chat_items"], config["mention"], config["context_token_budget"]
+    )
+    rng = random.Random(0)
+    latencies = []
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(
+            *(
+                conversation(client, cache, f"chat{i}", args.turns, args.think_time, rng, latencies)
+                for i in range(args.conversations)
+            )
+        )
+    finally:
+        await client.close()
+        for server in servers:
+            await server.close()
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{args.conversations} conversations x {args.turns} turns in {elapsed:.1f}s, "
+        f"{args.backends} backend(s), server concurrency {args.server_concurrency}"
+    )
+    report("reply latency", latencies)
+    report("server queueing", [r["queued_seconds"] for s in servers for r in s.requests])
+    for server in servers:
+        stats = server.stats()
+        print(
+            f"{server.url}  chats {stats['chats']}, prompt tokens {stats['prompt_tokens']}, "
+            f"evaluated {stats['evaluated_tokens']}, cache hit rate {stats['cache_hit_rate']:.0%}, "
+            f"max in flight {stats['max_in_flight']}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--conversations", type=int, default=4)
+    parser.add_argument("--turns", type=int, default=8)
+    parser.add_argument("--backends", type=int, default=1, help="fake servers behind the router")
+    parser.add_argument("--server-concurrency", type=int, default=1)
+    parser.add_argument("--ttft", type=float, default=0.1)
+    parser.add_argument("--tokens-per-second", type=float, default=60.0)
+    parser.add_argument("--prompt-seconds-per-token", type=float, default=0.0005)
+    parser.add_argument("--think-time", type=float, default=0.2, help="max seconds between turns")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
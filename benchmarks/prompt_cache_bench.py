@@ -0,0 +1,116 @@
+"""
+Prompt evaluation per request over a long conversation, old layout (history
+folded into the system message, sliding window of 10) against PromptBuilder.
+
+The stand-in model keeps the previous request's tokens, like Ollama's KV
+cache, and only "evaluates" what follows the shared prefix, reporting it
+as prompt_eval_count / prompt_eval_duration the way Ollama does.
+
+    python benchmarks/prompt_cache_bench.py --turns 60
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import statistics
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from config import config  # type: ignore
+from context_cache import ConversationContextCache  # type: ignore
+from message import Message  # type: ignore
+from model_client import OllamaClient  # type: ignore
+
+
+class KVCacheStandIn:
+    """AsyncClient stand-in that charges only for tokens past the cached prefix"""
+
+    def __init__(self, seconds_per_token=0.0002):
+        self._seconds_per_token = seconds_per_token
+        self._cached = []
+        self.prompt_eval_durations = []
+
+    async def chat(self, model, messages, **kwargs):
+        tokens = []
+        for message in messages:
+            tokens.append(f"<{message['role']}>")
+            tokens.extend(message["content"].split())
+        shared = 0
+        for cached, token in zip(self._cached, tokens):
+            if cached != token:
+                break
+            shared += 1
+        self._cached = tokens
+        evaluated = len(tokens) - shared
+        duration = evaluated * self._seconds_per_token
+        await asyncio.sleep(duration)
+        self.prompt_eval_durations.append(duration)
+        return {
+            "message": {"role": "assistant", "content": "sounds good to me"},
+            "prompt_eval_count": evaluated,
+            "prompt_eval_duration": int(duration * 1e9),
+        }
+
+
+def legacy_messages(system_msg, history):
+    """the pre-PromptBuilder layout: alternating roles, history in the system message"""
+    window = list(reversed(history[-10:]))
+    formatted = [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": text}
+        for i, text in enumerate(window)
+    ]
+    formatted.reverse()
+    lines = []
+    for entry in formatted[:-1]:
+        if entry["content"] not in lines:
+            lines.append(entry["content"])
+    return [
+        {"role": "system", "content": system_msg + "## Conversation History:\n" + "\n".join(lines)},
+        formatted[-1],
+    ]
+
+
+async def run(turns):
+    rng = random.Random(0)
+    words = "dinner tonight maybe tacos or pizza what time works for everyone".split()
+    texts = [" ".join(rng.choices(words, k=rng.randint(4, 20))) for _ in range(turns)]
+
+    legacy = KVCacheStandIn()
+    client = OllamaClient(config)
+    history = []
+    for text in texts:
+        history.append(text)
+        reply = await legacy.chat(config["model"], legacy_messages(client._system_msg, history))
+        history.append(reply["message"]["content"])
+
+    builder = KVCacheStandIn()
+    client._client = builder
+    cache = ConversationContextCache(
+        config["max_chat_items"], config["mention"], config["context_token_budget"]
+    )
+    cache.load("chat", [])
+    for rowid, text in enumerate(texts, start=1):
+        cache.append("chat", Message(rowid, None, 1, "chat", None, text, 0))
+        cache.add_reply("chat", await client.get_msg(cache.get("chat")))
+
+    for name, stand_in in (("legacy layout", legacy), ("PromptBuilder", builder)):
+        durations = stand_in.prompt_eval_durations
+        print(
+            f"{name:<14} prompt eval mean {statistics.mean(durations) * 1000:6.2f} ms"
+            f"  last 10 turns {statistics.mean(durations[-10:]) * 1000:6.2f} ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=60)
+    args = parser.parse_args()
+    asyncio.run(run(args.turns))
+
+
+if __name__ == "__main__":
+    logging.disable(logging.INFO)
+    main()
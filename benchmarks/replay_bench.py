@@ -0,0 +1,225 @@
+"""
+Replays scripted traffic against MessageProcessor on a synthetic chat.db and
+reports what the agent costs: per-poll latency and rows read, mention to
+reply latency percentiles, and memory. The model is the fake Ollama server
+with a fixed latency and sends go through the stub helper, so it runs
+anywhere and the numbers are the agent's own overhead.
+
+    python benchmarks/replay_bench.py --history 1000000 --events 400 --rate 20
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "tests"))
+
+from chat_db_factory import build_chat_db  # type: ignore
+from fake_ollama import FakeOllama  # type: ignore
+from config import config  # type: ignore
+from db_manager import DatabaseManager  # type: ignore
+from message_processor import MessageProcessor  # type: ignore
+from metrics import metrics  # type: ignore
+from model_client import OllamaClient  # type: ignore
+
+STUB_HELPER = str(ROOT / "tests" / "stub_send_helper.py")
+
+
+def percentiles(samples):
+    """p50 / p95 / p99 / max of samples, in milliseconds"""
+    if not samples:
+        return "n/a"
+    samples = sorted(samples)
+
+    def pick(q):
+        return samples[min(len(samples) - 1, int(len(samples) * q))] * 1000
+
+    return (
+        f"p50 {pick(0.50):8.2f} ms  p95 {pick(0.95):8.2f} ms"
+        f"  p99 {pick(0.99):8.2f} ms  max {samples[-1] * 1000:8.2f} ms"
+    )
+
+
+def timeline(writer, events, rate, mention_fraction, burst_fraction, seed):
+    """
+    (offset seconds, chat, sender, text) with Poisson arrivals over every
+    chat; burst_fraction of messages are followed by a few quick follow-ups
+    from the same sender, the way people actually text
+    """
+    rng = random.Random(seed)
+    offset = 0.0
+    script = []
+    while len(script) < events:
+        offset += rng.expovariate(rate)
+        chat = rng.choice(writer.chats)
+        sender = rng.choice(chat[2])
+        text = writer.random_text(1, 12)
+        if rng.random() < mention_fraction:
+            text = f"{config['mention']} {text}"
+        script.append((offset, chat, sender, text))
+        if rng.random() < burst_fraction:
+            follow_up = offset
+            for _ in range(rng.randint(1, 3)):
+                follow_up += rng.uniform(0.1, 0.4)
+                script.append((follow_up, chat, sender, writer.random_text(1, 6)))
+    script.sort(key=lambda event: event[0])
+    return script[:events]
+
+
+async def replay(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        build_start = time.perf_counter()
+        writer = build_chat_db(os.path.join(tmp, "chat.db"), args.history, seed=args.seed)
+        print(
+            f"built chat.db: {args.history} messages in "
+            f"{time.perf_counter() - build_start:.1f}s, "
+            f"{os.path.getsize(os.path.join(tmp, 'chat.db')) / 1e6:.0f} MB"
+        )
+        script = timeline(
+            writer, args.events, args.rate, args.mentions, args.bursts, args.seed
+        )
+        chat_by_guid = {chat[1]: chat for chat in writer.chats}
+
+        if args.tracemalloc:
+            tracemalloc.start()
+        model_server = FakeOllama(
+            ttft=args.model_latency, max_concurrency=config["max_concurrency"]
+        )
+        run_config = dict(
+            config,
+            ollama_host=await model_server.start(),
+            send_helper=[sys.executable, STUB_HELPER, "--delay", str(args.send_latency)],
+            keep_warm_seconds=0,
+            debounce_seconds=args.debounce,
+        )
+        db_manager = DatabaseManager(
+            tmp,
+            state_path=os.path.join(tmp, "state"),
+            mention=None if args.eager_decode else run_config["mention"],
+        )
+        client = OllamaClient(run_config)
+        processor = MessageProcessor(db_manager, client, run_config)
+        # start at the tip, like a first launch
+        _, high_water = await db_manager.get_new_messages()
+        await db_manager.advance_cursor(high_water)
+
+        polls = []
+        get_new_messages = db_manager.get_new_messages
+
+        async def timed_get_new_messages():
+            start = time.perf_counter()
+            messages, high_water = await get_new_messages()
+            polls.append((time.perf_counter() - start, len(messages)))
+            return messages, high_water
+
+        db_manager.get_new_messages = timed_get_new_messages
+
+        # mentions waiting on a reply, per chat GUID
+        pending = {}
+        latencies = []
+        send = processor._as_utils.send_message_via_applescript
+
+        async def recorded_send(recipient, message):
+            sent = await send(recipient, message)
+            if sent:
+                now = time.perf_counter()
+                latencies.extend(now - t for t in pending.pop(recipient, []))
+                # Messages writes our own reply back into chat.db
+                await asyncio.to_thread(
+                    writer.send, chat_by_guid[recipient], sent, 1, None, False
+                )
+            return sent
+
+        processor._as_utils.send_message_via_applescript = recorded_send
+
+        task = asyncio.create_task(processor.run())
+        start = time.perf_counter()
+        try:
+            for offset, chat, sender, text in script:
+                await asyncio.sleep(max(0.0, start + offset - time.perf_counter()))
+                if text.startswith(config["mention"]):
+                    pending.setdefault(chat[1], []).append(time.perf_counter())
+                await asyncio.to_thread(writer.send, chat, text, 0, sender)
+            # let the last replies land
+            deadline = time.perf_counter() + args.drain
+            while any(pending.values()) and time.perf_counter() < deadline:
+                await asyncio.sleep(0.05)
+            elapsed = time.perf_counter() - start
+        finally:
+            task.cancel()
+            await processor.close()
+            await db_manager.close()
+            await model_server.close()
+            writer.close()
+
+        poll_times = [t for t, _ in polls]
+        rows = [n for _, n in polls]
+        mentions = sum(text.startswith(config["mention"]) for *_, text in script)
+        print(
+            f"replayed {len(script)} messages ({mentions} mentions) in {elapsed:.1f}s, "
+            f"model {args.model_latency * 1000:.0f} ms, send {args.send_latency * 1000:.0f} ms"
+        )
+        print(f"polls            {len(polls)}, {sum(rows)} rows, "
+              f"{statistics.mean(rows) if rows else 0:.2f} rows/poll")
+        print(f"poll cost        {percentiles(poll_times)}")
+        print(f"mention->reply   {percentiles(latencies)}")
+        print(f"unanswered       {sum(len(v) for v in pending.values())}")
+        print(f"decode cache     {db_manager.decode_cache_stats()}")
+        print(
+            f"bodies           {metrics.counters.get('bodies_decoded_total', 0)} decoded, "
+            f"{metrics.counters.get('bodies_skipped_total', 0)} skipped"
+        )
+        print(f"model server     {model_server.stats()}")
+        print(
+            f"scheduler        {processor._scheduler.stats()['coalesced']} coalesced, "
+            f"{metrics.counters.get('generations_superseded_total', 0)} superseded"
+        )
+        print("stages (bucket upper bounds)")
+        for name, histogram in sorted(metrics.histograms.items()):
+            summary = histogram.summary()
+            print(
+                f"  {name:<30} n {summary['count']:5d}  p50 {summary['p50'] * 1000:7.1f} ms"
+                f"  p95 {summary['p95'] * 1000:7.1f} ms"
+            )
+        # ru_maxrss is KB on Linux, bytes on macOS
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        max_rss /= 1024 * 1024 if sys.platform == "darwin" else 1024
+        print(f"max RSS          {max_rss:.1f} MB")
+        if args.tracemalloc:
+            current, peak = tracemalloc.get_traced_memory()
+            print(f"python heap      {current / 1e6:.1f} MB now, {peak / 1e6:.1f} MB peak")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--history", type=int, default=100000, help="messages already in chat.db")
+    parser.add_argument("--events", type=int, default=200, help="messages to replay")
+    parser.add_argument("--rate", type=float, default=10.0, help="messages per second")
+    parser.add_argument("--mentions", type=float, default=0.3, help="fraction mentioning the agent")
+    parser.add_argument("--bursts", type=float, default=0.3, help="fraction followed by quick follow-ups")
+    parser.add_argument("--debounce", type=float, default=config["debounce_seconds"])
+    parser.add_argument("--model-latency", type=float, default=0.2, help="seconds per reply")
+    parser.add_argument("--send-latency", type=float, default=0.02, help="seconds per send")
+    parser.add_argument("--drain", type=float, default=30.0, help="seconds to wait for the last replies")
+    parser.add_argument("--eager-decode", action="store_true", help="decode every body, no SQL mention filter")
+    parser.add_argument("--tracemalloc", action="store_true", help="track python heap, slows things down")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    # the per message logging would dominate the timings
+    logging.disable(logging.INFO)
+    asyncio.run(replay(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Send throughput of AppleScriptMessenger's persistent helper against starting
+a process per message (what the old subprocess.run path did), using the stub
+helper so it runs anywhere.
+
+    python benchmarks/send_bench.py --messages 200 --recipients 5
+"""
+
+import argparse
+import asyncio
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from apple_script_messenger import AppleScriptMessenger  # type: ignore
+
+STUB_HELPER = str(Path(__file__).resolve().parent.parent / "tests" / "stub_send_helper.py")
+
+
+def process_per_message(messages, recipients):
+    """one blocking process per send"""
+    for i in range(messages):
+        subprocess.run(
+            [sys.executable, STUB_HELPER, "--once"],
+            input=f'{{"recipient": "r{i % recipients}", "message": "m{i}"}}\n',
+            check=True,
+            text=True,
+            capture_output=True,
+        )
+
+
+async def persistent_helper(messages, recipients):
+    messenger = AppleScriptMessenger([sys.executable, STUB_HELPER])
+    try:
+        await asyncio.gather(
+            *(
+                messenger.send_message_via_applescript(f"r{i % recipients}", f"m{i}")
+                for i in range(messages)
+            )
+        )
+    finally:
+        await messenger.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--recipients", type=int, default=5)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    process_per_message(args.messages, args.recipients)
+    per_message = time.perf_counter() - start
+
+    start = time.perf_counter()
+    asyncio.run(persistent_helper(args.messages, args.recipients))
+    persistent = time.perf_counter() - start
+
+    print(f"{args.messages} sends to {args.recipients} recipients")
+    print(f"process per message  {args.messages / per_message:8.1f} msgs/s")
+    print(f"persistent helper    {args.messages / persistent:8.1f} msgs/s")
+
+
+if __name__ == "__main__":
+    main()
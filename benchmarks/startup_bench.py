@@ -0,0 +1,113 @@
+"""
+Launch to ready: runs the agent as a fresh process against a synthetic
+chat.db and the fake Ollama server, timing from spawn until it logs that the
+first poll is done. --eager imports ollama up front like the agent used to,
+--profile prints the agent's own import breakdown from the last run.
+
+    python benchmarks/startup_bench.py --runs 10
+    python benchmarks/startup_bench.py --runs 10 --eager
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "tests"))
+
+from chat_db_factory import build_chat_db  # type: ignore
+from fake_ollama import FakeOllama  # type: ignore
+
+# what `python src/main.py` does, with config pointed at the test fixtures
+DRIVER = """
+import sys
+if sys.argv[3] == "eager":
+    import ollama
+sys.path.insert(0, sys.argv[1])
+import asyncio, json, logging
+import main
+main.config.update(json.loads(sys.argv[2]))
+logging.basicConfig(level=logging.INFO)
+asyncio.run(main.main())
+"""
+
+
+async def launch(overrides, eager, profile):
+    env = dict(os.environ, AIM_STARTUP_PROFILE="1" if profile else "0")
+    start = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-c", DRIVER, str(ROOT / "src"), json.dumps(overrides),
+        "eager" if eager else "lazy",
+        stderr=asyncio.subprocess.PIPE,
+        env=env,
+    )
+    log = []
+    try:
+        while True:
+            line = (await asyncio.wait_for(process.stderr.readline(), 30)).decode()
+            if not line:
+                raise RuntimeError("agent exited before it was ready:\n" + "".join(log))
+            log.append(line)
+            if "Ready in" in line:
+                ready = time.perf_counter() - start
+            if profile and "Startup imports" in line:
+                # the breakdown follows on the next lines
+                for _ in range(10):
+                    log.append((await process.stderr.readline()).decode())
+                break
+            if not profile and "Ready in" in line:
+                break
+    finally:
+        process.terminate()
+        await process.wait()
+    return ready, log
+
+
+async def run(args):
+    server = FakeOllama()
+    with tempfile.TemporaryDirectory() as tmp:
+        writer = build_chat_db(os.path.join(tmp, "chat.db"), args.messages)
+        overrides = {
+            "db_path": tmp,
+            "state_path": os.path.join(tmp, "state"),
+            "ollama_host": await server.start(),
+        }
+        try:
+            samples = []
+            for _ in range(args.runs):
+                ready, log = await launch(overrides, args.eager, False)
+                samples.append(ready)
+            if args.profile:
+                _, log = await launch(overrides, args.eager, True)
+        finally:
+            writer.close()
+            await server.close()
+
+    samples.sort()
+    print(
+        f"{'eager' if args.eager else 'lazy'} imports, {args.runs} launches: "
+        f"min {samples[0] * 1000:.0f} ms  p50 {statistics.median(samples) * 1000:.0f} ms"
+        f"  max {samples[-1] * 1000:.0f} ms"
+    )
+    if args.profile:
+        print("".join(line for line in log if "Startup" in line or line.startswith("  ")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--eager", action="store_true", help="import ollama before the agent starts")
+    parser.add_argument("--profile", action="store_true", help="show the import breakdown")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
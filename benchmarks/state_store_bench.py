@@ -0,0 +1,98 @@
+"""
+Write amplification of the state store: a replayed stream of polls (each
+advancing the cursor), decoded bodies and replies, written through one
+transaction per change as the cursor file used to be, against batched
+flushes. Reports transactions, rows, bytes appended to the WAL per logical
+write and the time spent writing.
+
+    python benchmarks/state_store_bench.py --polls 20000 --rate 20 --interval 1
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from state_store import StateStore  # type: ignore
+
+
+def traffic(polls, rate, reply_fraction, attributed_fraction, seed):
+    """(seconds offset, rowid, decoded, reply) per poll, one new row each"""
+    rng = random.Random(seed)
+    now = 0.0
+    for rowid in range(1, polls + 1):
+        now += rng.expovariate(rate)
+        yield now, rowid, rng.random() < attributed_fraction, rng.random() < reply_fraction
+
+
+async def replay(path, args, interval):
+    """interval None writes every change through, otherwise flushes on that clock"""
+    store = await StateStore(path).open()
+    # keep every frame in the WAL so its size is what was written
+    await store._conn.execute("PRAGMA wal_autocheckpoint = 0;")
+    wal_path = f"{path}-wal"
+    wal_start = os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+    busy = 0.0
+    last_flush = 0.0
+    for now, rowid, decoded, reply in traffic(
+        args.polls, args.rate, args.replies, args.attributed, args.seed
+    ):
+        if decoded:
+            store.add_decoded(rowid, f"decoded body of message {rowid}")
+        if reply:
+            store.record_reply(1, "iMessage;-;+15550001", f"reply to {rowid}", rowid)
+            store.claim_echo(1, f"reply to {rowid}", f"MSG-{rowid}-echo", rowid)
+        store.set("cursor", rowid)
+        # a reply is flushed straight away, as run() does
+        if interval is None or reply or now - last_flush >= interval:
+            start = time.perf_counter()
+            await store.flush()
+            busy += time.perf_counter() - start
+            last_flush = now
+    start = time.perf_counter()
+    await store.flush()
+    busy += time.perf_counter() - start
+    wal_bytes = os.path.getsize(wal_path) - wal_start
+    stats = store.stats()
+    await store.close()
+    return stats, wal_bytes, busy
+
+
+async def run(args):
+    print(
+        f"{args.polls} polls at {args.rate}/s, {args.replies:.0%} replies, "
+        f"{args.attributed:.0%} decoded bodies"
+    )
+    modes = [("write through", None)] + [(f"batched {i:g}s", i) for i in args.interval]
+    for name, interval in modes:
+        with tempfile.TemporaryDirectory() as tmp:
+            stats, wal_bytes, busy = await replay(os.path.join(tmp, "state.db"), args, interval)
+        print(
+            f"{name:<14} {stats['writes']:7d} writes  {stats['flushes']:6d} commits"
+            f"  {stats['rows_written']:7d} rows  {wal_bytes / 1e6:8.2f} MB WAL"
+            f"  {wal_bytes / stats['writes']:8.0f} B/write  {busy * 1000:8.0f} ms writing"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--polls", type=int, default=20000)
+    parser.add_argument("--rate", type=float, default=20.0, help="polls per simulated second")
+    parser.add_argument("--replies", type=float, default=0.02, help="fraction of polls that send a reply")
+    parser.add_argument("--attributed", type=float, default=0.5, help="fraction with a decoded body")
+    parser.add_argument("--interval", type=float, nargs="+", default=[0.25, 1.0, 5.0])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
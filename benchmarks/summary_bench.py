@@ -0,0 +1,125 @@
+"""
+Prompt size per reply over a long conversation: a context window big enough
+to hold the whole thing, against a short window plus the rolling summary
+ConversationSummarizer keeps, refreshed between bursts of messages as it
+would be in a quiet spell.
+
+The stand-in model keeps the previous request's tokens like Ollama's KV
+cache, so it reports both the prompt's size and the part that had to be
+evaluated. Summaries cost requests of their own, counted separately.
+
+    python benchmarks/summary_bench.py --turns 400 --window 400 --short-window 20
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import statistics
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from config import config  # type: ignore
+from context_cache import ConversationContextCache  # type: ignore
+from message import Message  # type: ignore
+from model_client import OllamaClient  # type: ignore
+from summarizer import ConversationSummarizer  # type: ignore
+
+
+class StandInModel:
+    """AsyncClient stand-in counting prompt tokens, a summary is capped at num_predict words"""
+
+    def __init__(self):
+        self._cached = []
+        self.replies = []
+        self.summaries = []
+
+    async def chat(self, model, messages, options=None, **kwargs):
+        tokens = []
+        for message in messages:
+            tokens.append(f"<{message['role']}>")
+            tokens.extend(message["content"].split())
+        if "num_predict" in (options or {}):
+            # summaries don't share the reply prompt's prefix
+            self.summaries.append(len(tokens))
+            words = messages[-1]["content"].split()
+            content = " ".join(words[-options["num_predict"]:])
+            return {"message": {"role": "assistant", "content": content}, "prompt_eval_count": len(tokens)}
+        shared = 0
+        for cached, token in zip(self._cached, tokens):
+            if cached != token:
+                break
+            shared += 1
+        self._cached = tokens
+        self.replies.append((len(tokens), len(tokens) - shared))
+        return {
+            "message": {"role": "assistant", "content": "sounds good to me"},
+            "prompt_eval_count": len(tokens) - shared,
+        }
+
+
+async def replay(texts, window, summarize, burst):
+    # only the window limits the context
+    settings = dict(config, max_chat_items=window, context_token_budget=10**9)
+    model = StandInModel()
+    client = OllamaClient(settings)
+    client._client = model
+    context = ConversationContextCache(window, "@a", keep_trimmed=summarize)
+    context.load(1, [])
+    summarizer = ConversationSummarizer(client, context, settings) if summarize else None
+    for rowid, text in enumerate(texts, 1):
+        message = Message(rowid, f"MSG-{rowid}", 1, "iMessage;-;+15550001", "+15550001", text, 0)
+        context.append(1, message)
+        if rowid % burst:
+            continue
+        await client.get_msg(context.get(1), summary=context.summary(1))
+        context.add_reply(1, "sounds good to me")
+        if summarizer is not None and context.needs_summary():
+            # the quiet spell after a reply
+            await summarizer.summarize(1)
+    return model
+
+
+def report(name, model, turns):
+    sizes = [size for size, _ in model.replies]
+    evaluated = [count for _, count in model.replies]
+    quarter = max(1, len(sizes) // 4)
+    print(
+        f"{name:<26} prompt tokens/reply first {statistics.mean(sizes[:quarter]):6.0f}"
+        f"  last {statistics.mean(sizes[-quarter:]):6.0f}  max {max(sizes):6d}"
+        f"  evaluated/reply {statistics.mean(evaluated):6.0f}"
+        f"  summaries {len(model.summaries):3d} ({sum(model.summaries) / turns:5.1f} tokens/msg)"
+    )
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    words = "dinner tonight maybe tacos or pizza what time works for everyone friday lisbon flights".split()
+    texts = [" ".join(rng.choices(words, k=rng.randint(4, 20))) for _ in range(args.turns)]
+    # every burst ends on a question for the agent
+    texts = [f"@a {t}" if (i + 1) % args.burst == 0 else t for i, t in enumerate(texts)]
+    print(f"{args.turns} messages, a reply every {args.burst}")
+    report(f"window {args.window}", await replay(texts, args.window, False, args.burst), args.turns)
+    report(
+        f"window {args.short_window} + summary",
+        await replay(texts, args.short_window, True, args.burst),
+        args.turns,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=400)
+    parser.add_argument("--window", type=int, default=400, help="max_chat_items without a summary")
+    parser.add_argument("--short-window", type=int, default=20, help="max_chat_items with one")
+    parser.add_argument("--burst", type=int, default=4, help="messages per reply")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
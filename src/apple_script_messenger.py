@@ -2,57 +2,174 @@
 AppleScriptMessenger
 """
 
+import asyncio
+import json
 import logging
-import subprocess
+from functools import partial
+
+from conversation_scheduler import ConversationScheduler
+from metrics import metrics
 
 
 class AppleScriptMessenger:
-    """AppleScriptMessenger"""
+    """
+    AppleScriptMessenger
+
+    Sends go to a long-lived helper process that reads one JSON request per
+    line on stdin and answers with one JSON line on stdout. The default helper
+    is a JXA script run by osascript, compiled once when the helper starts;
+    helper_command swaps in anything speaking the same protocol, e.g. a stub
+    for benchmarking off macOS. Recipients are chat GUIDs (chat.guid), which
+    covers group chats, or a buddy's handle.
+    """
 
-    def __init__(self) -> None:
-        pass
+    def __init__(self, helper_command=None, retries=2, timeout=30) -> None:
+        self._helper_command = helper_command or [
+            "osascript",
+            "-l",
+            "JavaScript",
+            "-e",
+            self._get_helper_script(),
+        ]
+        self._retries = retries
+        self._timeout = timeout
+        self._process = None
+        # one helper, one send at a time, in order per recipient
+        self._queue = ConversationScheduler(max_concurrency=1)
 
     @staticmethod
-    def _get_template():
-        """Script template"""
+    def _get_helper_script():
+        """Helper script, JSON lines in and out"""
         script = """
-        on run {mymessage, myid}
-            tell application "Messages"
-                set targetService to 1st service whose service type is iMessage
-                set targetBuddy to buddy myid of targetService
-                send mymessage to targetBuddy
-            end tell
-        end run
+        ObjC.import("Foundation");
+
+        function run() {
+            const stdin = $.NSFileHandle.fileHandleWithStandardInput;
+            const stdout = $.NSFileHandle.fileHandleWithStandardOutput;
+            const messages = Application("Messages");
+            let pending = "";
+            for (;;) {
+                const data = stdin.availableData;
+                if (data.length === 0) {
+                    return;
+                }
+                pending += $.NSString.alloc.initWithDataEncoding(data, $.NSUTF8StringEncoding).js;
+                let newline;
+                while ((newline = pending.indexOf("\\n")) >= 0) {
+                    const line = pending.slice(0, newline);
+                    pending = pending.slice(newline + 1);
+                    let reply;
+                    try {
+                        const request = JSON.parse(line);
+                        let to;
+                        if (request.recipient.includes(";")) {
+                            // a chat GUID, e.g. iMessage;+;chat123 for a group
+                            to = messages.chats.byId(request.recipient);
+                        } else {
+                            const service = messages.services.whose({ serviceType: "iMessage" })[0];
+                            to = service.buddies.byName(request.recipient);
+                        }
+                        messages.send(request.message, { to: to });
+                        reply = { ok: true };
+                    } catch (e) {
+                        reply = { ok: false, error: String(e) };
+                    }
+                    const out = $.NSString.alloc.initWithUTF8String(JSON.stringify(reply) + "\\n");
+                    stdout.writeData(out.dataUsingEncoding($.NSUTF8StringEncoding));
+                }
+            }
+        }
         """
         return script
 
-    async def send_message_via_applescript(self, recipient, message):
-        """Send"""
+    async def _get_helper(self):
+        """the running helper, started on first use or after it died"""
+        if self._process is None or self._process.returncode is not None:
+            self._process = await asyncio.create_subprocess_exec(
+                *self._helper_command,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+            )
+        return self._process
 
-        def strip_leading_dashes(s):
-            """osascript can't have messages starting with -"""
-            if s.startswith("-"):
-                return strip_leading_dashes(s[1:])
-            return s
+    async def _stop_helper(self):
+        """stop the helper, the next send starts a fresh one"""
+        process, self._process = self._process, None
+        if process is not None and process.returncode is None:
+            process.kill()
+            await process.wait()
 
-        escaped_recipient = recipient.strip('"').strip()
-        escaped_message = strip_leading_dashes(message.strip('"').strip())
+    async def _write(self, recipient, message):
+        """hand one request to the helper, returns the helper it went to"""
+        process = await self._get_helper()
+        # ascii only JSON, so a line can't be split mid character on the way in
+        line = json.dumps({"recipient": recipient, "message": message}) + "\n"
+        process.stdin.write(line.encode("ascii"))
+        await process.stdin.drain()
+        return process
 
-        script = self._get_template()
+    async def _read_reply(self, process):
+        """wait for the helper's answer to the request just written"""
+        reply = await asyncio.wait_for(process.stdout.readline(), self._timeout)
+        if not reply:
+            raise ConnectionError("send helper exited")
+        reply = json.loads(reply)
+        if not reply.get("ok"):
+            raise RuntimeError(reply.get("error"))
 
-        try:
-            result = subprocess.run(
-                ["osascript", "-e", script, escaped_message, escaped_recipient],
-                check=True,
-                text=True,
-                capture_output=True,
-            )
-            logging.info(result.stdout)
-        except subprocess.CalledProcessError as e:
-            logging.info(f"An error occurred: {e.stderr}")
+    async def _send(self, recipient, message, future):
+        """
+        send, retrying only while the request hasn't reached the helper. Once
+        it has, Messages may have sent it (or part of it) whatever the helper
+        says next, and sending again could deliver it twice
+        """
+        result = None
+        for attempt in range(self._retries + 1):
+            if attempt:
+                metrics.inc("send_retries_total")
+                await asyncio.sleep(0.1 * 2 ** (attempt - 1))
+            try:
+                with metrics.span("send"):
+                    try:
+                        process = await self._write(recipient, message)
+                    except OSError as e:
+                        logging.info(f"Send helper failed: {e!r} (attempt {attempt + 1})")
+                        await self._stop_helper()
+                        continue
+                    await self._read_reply(process)
+                result = message
+            except RuntimeError as e:
+                # the helper is fine, Messages refused the send
+                logging.info(f"An error occurred: {e}")
+            except (OSError, ValueError) as e:
+                # stalled, died or garbled, the send may or may not have happened
+                logging.info(f"Send helper failed after the request was written: {e!r}")
+                await self._stop_helper()
+            break
+        if result is None:
+            metrics.inc("send_failures_total")
+        if not future.done():
+            future.set_result(result)
 
-        return escaped_message
+    async def send_message_via_applescript(self, recipient, message):
+        """Send, returns the message as sent or None if it couldn't be"""
+        escaped_recipient = recipient.strip('"').strip()
+        escaped_message = message.strip('"').strip()
 
+        future = asyncio.get_running_loop().create_future()
+        self._queue.submit(
+            escaped_recipient,
+            partial(self._send, escaped_recipient, escaped_message, future),
+        )
+        return await future
 
-# Setup logging
-logging.basicConfig(level=logging.INFO)
+    async def close(self):
+        """drop queued sends and stop the helper"""
+        await self._queue.close()
+        if self._process is not None and self._process.returncode is None:
+            self._process.stdin.close()
+            try:
+                await asyncio.wait_for(self._process.wait(), 5)
+            except asyncio.TimeoutError:
+                pass
+        await self._stop_helper()
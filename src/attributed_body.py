@@ -0,0 +1,119 @@
+"""
+attributedBody decoding
+"""
+
+import logging
+import time
+from collections import OrderedDict
+
+# NSString's string payload is archived as a "+" typed (byte string) value
+_NSSTRING_CLASS = b"NSString"
+_BYTES_VALUE = b"\x84\x01+"
+
+
+def fast_extract_text(blob):
+    """
+    Pull the text out of an attributedBody archive without building the
+    typedstream object graph. Covers archives whose first string is a plain
+    NSString, which is nearly every message; None means use the full decoder.
+    """
+    class_at = blob.find(_NSSTRING_CLASS)
+    if class_at < 0:
+        return None
+    value_at = blob.find(_BYTES_VALUE, class_at)
+    if value_at < 0:
+        return None
+    pos = value_at + len(_BYTES_VALUE)
+    if pos >= len(blob):
+        return None
+    # typedstream integers: a literal byte, or a tag then int16 / int32
+    length = blob[pos]
+    if length == 0x81:
+        length = int.from_bytes(blob[pos + 1 : pos + 3], "little", signed=True)
+        pos += 3
+    elif length == 0x82:
+        length = int.from_bytes(blob[pos + 1 : pos + 5], "little", signed=True)
+        pos += 5
+    elif length >= 0x80:
+        return None
+    else:
+        pos += 1
+    raw = blob[pos : pos + length]
+    if length < 0 or len(raw) != length:
+        return None
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+
+
+def unarchive_from_data(blob):
+    """
+    the full typedstream decoder, imported on first use since only archives
+    the fast path can't read need it
+    """
+    from typedstream import unarchive_from_data as unarchive  # type: ignore
+
+    return unarchive(blob)
+
+
+def decode_attributed_body(blob):
+    """text of an attributedBody blob"""
+    text = fast_extract_text(blob)
+    if text is None:
+        unarch = unarchive_from_data(blob)
+        text = unarch.contents[0].value.value
+    return text
+
+
+def decode_many(blobs):
+    """
+    (text, seconds) for each blob, None for any that won't decode. Runs on
+    the decode pool, so it touches nothing shared.
+    """
+    results = []
+    for blob in blobs:
+        start = time.perf_counter()
+        try:
+            text = decode_attributed_body(blob)
+        except Exception as e:
+            logging.info(f"Couldn't decode attributedBody: {e}")
+            text = None
+        results.append((text, time.perf_counter() - start))
+    return results
+
+
+class DecodeCache:
+    """Bounded LRU of decoded attributedBody text, keyed by message ROWID"""
+
+    def __init__(self, max_size=4096):
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, rowid):
+        """(True, text) on a hit, (False, None) on a miss"""
+        try:
+            text = self._entries[rowid]
+        except KeyError:
+            self.misses += 1
+            return False, None
+        self._entries.move_to_end(rowid)
+        self.hits += 1
+        return True, text
+
+    def store(self, rowid, text):
+        self._entries[rowid] = text
+        if len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        """hit / miss counters"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
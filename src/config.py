@@ -3,8 +3,53 @@
 config = {
     "model": "llama3",  # Ollama model choice, e.g. ollama pull $MODEL
     "db_path": "~/Library/Messages",  # location of your Messages chat.db
+    "state_path": "~/Library/Application Support/AIMessenger",  # where the agent keeps its own state
+    "state_flush_interval": 1.0,  # seconds state changes are batched before being written, replies are written at once
     "mention": "@a",  # how you want to call out to the agent
-    "max_chat_items": 10,  # how many items to load into the context window
+    "max_chat_items": 40,  # most messages kept per conversation, the token budget decides how many the model sees
+    "context_token_budget": 1536,  # estimated tokens of conversation history sent with each request
+    "num_ctx": 4096,  # model context window, leave room for the system prompt and the reply
+    "ollama_host": None,  # Ollama server URL, None uses OLLAMA_HOST or the local default
+    "backends": None,  # several Ollama servers, e.g. [{"host": "http://gpu1:11434", "model": "llama3:70b", "size": "large", "max_connections": 4}], None uses ollama_host and model
+    "router_policy": "least_loaded",  # with backends, "least_loaded" or "size" (short messages to the "small" ones, the rest to "large")
+    "small_message_chars": 80,  # newest messages shorter than this count as short for the "size" policy
+    "backend_timeout": 60,  # seconds before a backend's reply is given up on and the next one tried
+    "backend_cooldown": 30,  # seconds a failed backend is skipped for
+    "keep_alive": "30m",  # how long Ollama keeps the model loaded between requests
+    "keep_warm_seconds": 4 * 3600,  # keep the model loaded this long after the last chat activity, 0 to never ping
+    "keep_warm_interval": 600,  # seconds between keep-alive pings, keep it under keep_alive
+    "response_cache": False,  # reuse replies to repeated questions instead of generating them again
+    "response_cache_size": 1000,  # cached replies kept, least recently used go first
+    "response_cache_ttl": 24 * 3600,  # seconds a cached reply stays usable
+    "response_cache_context": 2,  # earlier messages that must match too, 0 matches on the question alone; replies are only reused within a chat
+    "history_index": False,  # keep a full-text index of chat history so replies can draw on older messages
+    "history_recall": 3,  # older messages relevant to a mention added to its prompt, 0 to only index
+    "history_build_batch": 5000,  # chat.db rows per batch when first building the history index
+    "context_cache_conversations": 64,  # conversations whose recent messages are kept in memory
+    "context_idle_seconds": 3600,  # drop a conversation's cached messages after this long without activity
+    "summarize": False,  # fold messages trimmed from a conversation's context into a rolling summary sent with each prompt
+    "summary_idle_seconds": 30,  # quiet time before summaries are brought up to date, new messages interrupt one in progress
+    "summary_tokens": 200,  # longest a summary can get, it's sent with every prompt on top of context_token_budget
+    "decode_cache_size": 4096,  # decoded message bodies kept in memory
+    "decode_workers": 2,  # threads decoding message bodies off the event loop
     "max_interval": 30,  # max polling interval - will affect how snappy agent feels
     "sleep_interval": 2,  # the smaller sleep interval - will affect how snappy agent feels
+    "stream": False,  # send the reply in pieces as it's generated instead of all at once
+    "stream_boundary": "sentence",  # where streamed replies are split, "sentence" or "paragraph"
+    "stream_min_chars": 40,  # shorter pieces are held and joined with the next one
+    "debounce_seconds": 0.5,  # wait for a chat to go quiet this long before answering, so a burst gets one reply
+    "max_concurrency": 2,  # conversations handled at once, size to what your model server can run
+    "max_supersedes": 2,  # times new messages can restart a reply being generated before it's let finish
+    "max_batch_retries": 3,  # polls a batch of new messages that keeps failing is retried on before its rows are logged and skipped
+    "send_helper": None,  # command for the send helper process, None runs the built in osascript one
+    "watcher": "auto",  # "auto" wakes on chat.db change events, "stat" polls with the intervals above
+    "metrics_port": None,  # serve Prometheus metrics on this localhost port (0 picks one), None to turn off
+    "metrics_path": None,  # write a JSON metrics snapshot here every metrics_interval seconds, None to turn off
+    "metrics_interval": 60,  # seconds between JSON metrics snapshots
+    "diagnostics_path": None,  # write profiles and memory snapshots here, with this or diagnostics_port set diagnostics are on
+    "diagnostics_port": None,  # localhost port taking "profile [seconds]", "stacks" and "memory" commands (0 picks one), None to turn off
+    "slow_callback_ms": 100,  # with diagnostics on, log the stack of anything blocking the event loop this long, 0 to not watch
+    "profile_seconds": 10,  # how long a sampling profile triggered by SIGUSR1 runs
+    "tracemalloc_interval": 0,  # with diagnostics on, seconds between top allocation snapshots, 0 leaves tracemalloc off
+    "tracemalloc_top": 15,  # allocation sites listed in each memory snapshot
 }
@@ -0,0 +1,185 @@
+"""
+Conversation context cache
+"""
+
+import time
+from collections import OrderedDict, deque
+
+from prompt_builder import estimate_tokens
+
+
+class ConversationContextCache:
+    """
+    The recent messages of each active conversation, already cleaned and
+    given a role, kept up to date from the new message stream so building a
+    prompt doesn't need a chat.db round trip. Messages the agent sent are
+    "assistant", everything else is "user". Conversations idle for longer
+    than idle_seconds, or beyond max_conversations, are dropped.
+
+    A conversation over max_items or token_budget is cut back to half in one
+    go rather than sliding one message at a time, so the start of the prompt
+    stays the same for many turns and the model server's KV cache stays warm.
+
+    With keep_trimmed, what's cut is kept until the summarizer folds it into
+    the conversation's rolling summary.
+    """
+
+    def __init__(
+        self,
+        max_items,
+        mention,
+        token_budget=None,
+        max_conversations=64,
+        idle_seconds=3600,
+        keep_trimmed=False,
+    ):
+        self._max_items = max_items
+        self._token_budget = token_budget or float("inf")
+        self._mention = mention
+        self._max_conversations = max_conversations
+        self._idle_seconds = idle_seconds
+        self._keep_trimmed = keep_trimmed
+        # key -> {"entries": deque, "tokens": int, "last_rowid": int, "last_used": float,
+        #         "summary": str, "summary_rowid": int, "trimmed": list}
+        self._conversations = OrderedDict()
+
+    def _clean_text(self, text):
+        """strip the mention, the model doesn't need to see it"""
+        return text.removeprefix(self._mention).removesuffix(self._mention).strip()
+
+    def _entry(self, role, text, rowid=None):
+        content = self._clean_text(text)
+        return {
+            "rowid": rowid,
+            "role": role,
+            "content": content,
+            "tokens": estimate_tokens(content),
+            "agent_directed": text.startswith(self._mention)
+            or text.endswith(self._mention),
+        }
+
+    def _add(self, conversation, entry):
+        conversation["entries"].append(entry)
+        conversation["tokens"] += entry["tokens"]
+        entries = conversation["entries"]
+        if (
+            len(entries) <= self._max_items
+            and conversation["tokens"] <= self._token_budget
+        ):
+            return
+        # always keep the newest entry, it's the one being answered
+        while len(entries) > 1 and (
+            len(entries) > self._max_items // 2
+            or conversation["tokens"] > self._token_budget / 2
+        ):
+            entry = entries.popleft()
+            conversation["tokens"] -= entry["tokens"]
+            if self._keep_trimmed:
+                conversation["trimmed"].append(entry)
+        # a summarizer that can't keep up loses the oldest, not the newest
+        del conversation["trimmed"][: -self._max_items * 4]
+
+    def _touch(self, key):
+        conversation = self._conversations[key]
+        conversation["last_used"] = time.monotonic()
+        self._conversations.move_to_end(key)
+        return conversation
+
+    def __contains__(self, key):
+        return key in self._conversations
+
+    def load(self, key, messages, sent_messages=(), sent_guids=(), summary=None, summary_rowid=0):
+        """
+        Cold start a conversation from chat.db rows (newest first, as
+        get_latest_messages_for_chat returns them). is_from_me rows whose text
+        is in sent_messages, or whose guid is in sent_guids, were written by
+        the agent. Rows up to summary_rowid are already in summary.
+        """
+        conversation = {
+            "entries": deque(),
+            "tokens": 0,
+            "last_rowid": 0,
+            "summary": summary,
+            "summary_rowid": summary_rowid,
+            "trimmed": [],
+        }
+        # one hash lookup per row rather than a scan of the recent replies
+        sent_messages = set(sent_messages)
+        for message in reversed(messages):
+            conversation["last_rowid"] = max(conversation["last_rowid"], message.rowid)
+            if message.text is None or message.rowid <= summary_rowid:
+                continue
+            agent_sent = message.is_from_me and (
+                message.guid in sent_guids or message.text in sent_messages
+            )
+            role = "assistant" if agent_sent else "user"
+            self._add(conversation, self._entry(role, message.text, message.rowid))
+        self._conversations[key] = conversation
+        self._touch(key)
+        self.evict()
+
+    def append(self, key, message):
+        """add a new incoming row, rows already seen (by ROWID) are ignored"""
+        conversation = self._touch(key)
+        if message.rowid <= conversation["last_rowid"]:
+            return
+        conversation["last_rowid"] = message.rowid
+        if message.text is not None:
+            self._add(conversation, self._entry("user", message.text, message.rowid))
+
+    def add_reply(self, key, text):
+        """record a reply the agent sent"""
+        if key in self._conversations:
+            self._add(self._touch(key), self._entry("assistant", text))
+
+    def get(self, key):
+        """the conversation, oldest first"""
+        return list(self._touch(key)["entries"])
+
+    def summary(self, key):
+        """the conversation's rolling summary, None if it has none"""
+        conversation = self._conversations.get(key)
+        return conversation["summary"] if conversation else None
+
+    def needs_summary(self):
+        """keys of conversations with trimmed entries not yet summarized, least recently used first"""
+        return [key for key, c in self._conversations.items() if c["trimmed"]]
+
+    def pending_summary(self, key):
+        """(summary, trimmed entries oldest first) for the summarizer"""
+        conversation = self._conversations.get(key)
+        if conversation is None:
+            return None, []
+        return conversation["summary"], list(conversation["trimmed"])
+
+    def set_summary(self, key, summary, count):
+        """
+        the summary now covers the first count trimmed entries, those trimmed
+        while it was written stay for the next one. Returns the newest rowid
+        covered, None if the conversation has gone
+        """
+        conversation = self._conversations.get(key)
+        if conversation is None:
+            return None
+        covered = conversation["trimmed"][:count]
+        del conversation["trimmed"][:count]
+        conversation["summary"] = summary
+        conversation["summary_rowid"] = max(
+            [conversation["summary_rowid"]] + [e["rowid"] for e in covered if e["rowid"]]
+        )
+        return conversation["summary_rowid"]
+
+    def evict(self):
+        """drop idle conversations and the least recently used beyond the cap"""
+        cutoff = time.monotonic() - self._idle_seconds
+        while self._conversations:
+            key, conversation = next(iter(self._conversations.items()))
+            if (
+                len(self._conversations) <= self._max_conversations
+                and conversation["last_used"] >= cutoff
+            ):
+                break
+            del self._conversations[key]
+
+    def __len__(self):
+        return len(self._conversations)
@@ -0,0 +1,139 @@
+"""
+Conversation scheduler
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+
+class ConversationScheduler:
+    """
+    Queues work per conversation and runs up to max_concurrency conversations
+    at once. Jobs for the same conversation run one at a time in the order
+    they were submitted, so a slow chat never holds up the others.
+
+    A conversation's next job starts only once debounce seconds have passed
+    since its last submit, so a burst settles first, and a coalescing submit
+    replaces the job still waiting instead of queueing another. The running
+    job can be cancelled with cancel_running when it has been overtaken.
+    """
+
+    def __init__(self, max_concurrency, wait_samples=1000, debounce=0.0):
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._debounce = debounce
+        self._queues = {}
+        self._workers = {}
+        self._running = {}
+        self._last_submit = {}
+        self._wait_times = deque(maxlen=wait_samples)
+        self._in_flight = 0
+        self._max_depth = 0
+        self._completed = 0
+        self._coalesced = 0
+        self._superseded = 0
+
+    def submit(self, key, job, coalesce=False):
+        """
+        queue job (a zero argument coroutine function) for conversation key,
+        with coalesce it replaces a job of key's that hasn't started yet
+        """
+        queue = self._queues.setdefault(key, deque())
+        self._last_submit[key] = time.monotonic()
+        if coalesce and queue:
+            enqueued_at, _ = queue[-1]
+            queue[-1] = (enqueued_at, job)
+            self._coalesced += 1
+            return
+        queue.append((time.monotonic(), job))
+        self._max_depth = max(self._max_depth, self.queued())
+        if key not in self._workers:
+            self._workers[key] = asyncio.create_task(self._drain(key))
+
+    def cancel_running(self, key):
+        """cancel key's running job, True if there was one"""
+        task = self._running.get(key)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        return True
+
+    async def _settle(self, key):
+        """wait until key has had no submits for the debounce window"""
+        while True:
+            remaining = self._last_submit[key] + self._debounce - time.monotonic()
+            if remaining <= 0:
+                return
+            await asyncio.sleep(remaining)
+
+    async def _drain(self, key):
+        """run a conversation's jobs in order"""
+        queue = self._queues[key]
+        try:
+            while queue:
+                if self._debounce:
+                    await self._settle(key)
+                async with self._semaphore:
+                    enqueued_at, job = queue.popleft()
+                    self._wait_times.append(time.monotonic() - enqueued_at)
+                    self._in_flight += 1
+                    task = self._running[key] = asyncio.ensure_future(job())
+                    try:
+                        # wait() rather than await, a cancelled job mustn't
+                        # take the worker down with it
+                        await asyncio.wait([task])
+                    except asyncio.CancelledError:
+                        task.cancel()
+                        raise
+                    finally:
+                        del self._running[key]
+                        self._in_flight -= 1
+                        self._completed += 1
+                    if task.cancelled():
+                        self._superseded += 1
+                    elif task.exception() is not None:
+                        e = task.exception()
+                        logging.error(
+                            f"Job for {key} failed: {e}", exc_info=(type(e), e, e.__traceback__)
+                        )
+        finally:
+            del self._workers[key]
+            del self._queues[key]
+            self._last_submit.pop(key, None)
+
+    def queued(self):
+        """jobs waiting to start"""
+        return sum(len(q) for q in self._queues.values())
+
+    def stats(self):
+        """queue depth and wait time stats for sizing max_concurrency"""
+        waits = sorted(self._wait_times)
+
+        def percentile(p):
+            return waits[min(len(waits) - 1, int(len(waits) * p))] if waits else 0.0
+
+        return {
+            "conversations": len(self._workers),
+            "queued": self.queued(),
+            "in_flight": self._in_flight,
+            "max_depth": self._max_depth,
+            "completed": self._completed,
+            "coalesced": self._coalesced,
+            "superseded": self._superseded,
+            "wait_p50": percentile(0.5),
+            "wait_p95": percentile(0.95),
+            "wait_max": waits[-1] if waits else 0.0,
+        }
+
+    async def join(self):
+        """wait for everything queued so far to finish"""
+        while self._workers:
+            await asyncio.gather(*self._workers.values(), return_exceptions=True)
+
+    async def close(self):
+        """cancel outstanding work"""
+        workers = list(self._workers.values())
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
@@ -3,22 +3,92 @@ chat.db manager
 """
 
 import os
+import asyncio
 import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from pathlib import Path
 
 import aiosqlite
 
+from attributed_body import DecodeCache, decode_many
+from db_watcher import create_watcher
+from message import APPLE_EPOCH, Message
+from metrics import metrics
+
+# every message with the thread it belongs to; the handle is the sender and
+# is missing for our own messages in group chats. message.date stays raw,
+# Message converts it, no per-row datetime() in SQL
+_MESSAGE_COLUMNS = """message.ROWID, message.guid, chat.ROWID, chat.guid, handle.id,
+            message.text, message.attributedBody, message.is_from_me, message.date"""
+_MESSAGE_FROM = """
+        FROM message
+        JOIN chat_message_join ON chat_message_join.message_id = message.ROWID
+        JOIN chat ON chat.ROWID = chat_message_join.chat_id
+        LEFT JOIN handle ON message.handle_id = handle.ROWID
+"""
+_MESSAGE_SELECT = f"""
+        SELECT {_MESSAGE_COLUMNS}{_MESSAGE_FROM}"""
+# ROWID ordered batches for walking all of chat.db, shared with
+# history_export; params are (after ROWID, up to ROWID, limit). Ordering by
+# the join's message_id follows chat_message_join's message_id index, ORDER
+# BY message.ROWID would sort everything left in the range for every batch
+BATCH_SELECT = f"""{_MESSAGE_SELECT}
+        WHERE message.ROWID > ? AND message.ROWID <= ?
+        ORDER BY chat_message_join.message_id
+        LIMIT ?;
+"""
+# the same plus whether the mention is anywhere in the text or, as UTF-8
+# bytes, in the archived body; a byte search costs far less than a decode
+_MENTION_SELECT = f"""
+        SELECT {_MESSAGE_COLUMNS},
+            instr(message.text, ?) > 0 OR instr(message.attributedBody, ?) > 0{_MESSAGE_FROM}"""
+
 
 class DatabaseManager:
     """DatabaseManager"""
 
-    def __init__(self, base_path):
+    def __init__(
+        self,
+        base_path,
+        state_path=None,
+        watcher="auto",
+        decode_cache_size=4096,
+        mention=None,
+        decode_workers=2,
+        state=None,
+    ):
         self._db_path = os.path.expanduser(os.path.join(base_path, "chat.db"))
         self._wal_path = os.path.expanduser(os.path.join(base_path, "chat.db-wal"))
         self._last_mod_times = {
             "db": os.path.getmtime(self._db_path),
             "wal": os.path.getmtime(self._wal_path),
         }
+        # message.ROWID high water mark, persisted so restarts pick up where we left off
+        self._cursor_path = (
+            os.path.expanduser(os.path.join(state_path, "cursor")) if state_path else None
+        )
+        self._cursor = None
+        # StateStore, keeps the cursor and decoded bodies when given
+        self._state = state
+        # OS change notifications, None means stat polling
+        self._watcher = create_watcher([self._db_path, self._wal_path], watcher)
+        # the same rows get re-read for context on every mention
+        self._decode_cache = DecodeCache(decode_cache_size)
+        if state is not None:
+            # oldest first, so the newest end up most recently used
+            for rowid, text in reversed(state.decoded()[:decode_cache_size]):
+                self._decode_cache.store(rowid, text)
+        # attributedBody decoding happens here, off the event loop
+        self._decode_workers = decode_workers
+        self._decode_pool = None
+        # with a mention, new rows come back undecoded and flagged
+        self._mention = mention
+        # long lived read-only connection, opened on first use
+        self._conn = None
+        self._conn_file_id = None
 
     async def has_db_changed(self):
         """has changed"""
@@ -35,84 +105,250 @@ class DatabaseManager:
             return True
         return False
 
+    def _file_id(self):
+        """identity of the chat.db file, changes if Messages replaces it"""
+        stat = os.stat(self._db_path)
+        return stat.st_dev, stat.st_ino
+
+    async def _get_connection(self):
+        """
+        The shared read-only connection. sqlite3 keeps a prepared statement
+        cache per connection, so reusing it means each query is parsed once.
+        """
+        if self._conn is not None and self._file_id() != self._conn_file_id:
+            logging.info("chat.db was replaced, reconnecting")
+            await self.close()
+        if self._conn is None:
+            uri = f"{Path(self._db_path).as_uri()}?mode=ro"
+            self._conn_file_id = self._file_id()
+            self._conn = await aiosqlite.connect(uri, uri=True)
+            await self._conn.execute("PRAGMA query_only = ON;")
+        return self._conn
+
+    async def close(self):
+        """close the connection and watcher"""
+        if self._watcher is not None:
+            self._watcher.close()
+            self._watcher = None
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            await conn.close()
+        if self._decode_pool is not None:
+            self._decode_pool.shutdown(wait=False)
+            self._decode_pool = None
+
+    async def wait_for_change(self, timeout):
+        """
+        Wait up to timeout seconds for chat.db to change. With a watcher this
+        returns as soon as Messages writes, otherwise it sleeps then stats.
+        """
+        if self._watcher is None:
+            await asyncio.sleep(timeout)
+            return await self.has_db_changed()
+        if await self._watcher.wait(timeout):
+            logging.info(f"Database change detected at {datetime.now()}")
+            return True
+        return False
+
     async def _execute_query(self, query, params=None, fetchall=False):
         """execute"""
+        # one retry on a fresh connection in case the handle went stale
+        for _ in range(2):
+            try:
+                conn = await self._get_connection()
+                if fetchall:
+                    return await conn.execute_fetchall(query, params if params else ())
+                async with conn.execute(query, params if params else ()) as cursor:
+                    return await cursor.fetchone()
+            except sqlite3.DatabaseError as e:
+                logging.info(f"Database error, reconnecting: {e}")
+                await self.close()
+            except Exception as e:
+                logging.info(f"An error occurred: {e}")
+                return None
+        return None
+
+    def _load_cursor(self):
+        """load the persisted cursor, None if there isn't one"""
+        if self._state is not None and self._state.get("cursor") is not None:
+            return self._state.get("cursor")
+        # the cursor file is what came before the state store
+        if not self._cursor_path:
+            return None
         try:
-            # Using aiosqlite to handle database operations asynchronously
-            async with aiosqlite.connect(self._db_path) as conn:
-                async with conn.cursor() as cursor:
-                    await cursor.execute(query, params if params else ())
-                    result = (
-                        await cursor.fetchall() if fetchall else await cursor.fetchone()
-                    )
-                    return result
-        except Exception as e:
-            logging.info(f"An error occurred: {e}")
+            with open(self._cursor_path, encoding="utf-8") as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
             return None
 
+    def _save_cursor(self, rowid):
+        """write the cursor atomically so a crash never leaves a torn file"""
+        os.makedirs(os.path.dirname(self._cursor_path), exist_ok=True)
+        tmp_path = f"{self._cursor_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(str(rowid))
+        os.replace(tmp_path, self._cursor_path)
+
+    async def advance_cursor(self, rowid):
+        """Move the cursor up to rowid and persist it"""
+        if self._cursor is not None and rowid <= self._cursor:
+            return
+        self._cursor = rowid
+        if self._state is not None:
+            self._state.set("cursor", rowid)
+        elif self._cursor_path:
+            self._save_cursor(rowid)
+
+    async def get_new_messages(self):
+        """
+        Get messages with a message.ROWID above the cursor, oldest first.
+
+        Returns (messages, high_water). The range is capped at the current
+        MAX(ROWID) so rows committed while we read land in the next batch;
+        hand high_water to advance_cursor once the messages are handled.
+        chat.db uses AUTOINCREMENT and a single writer, so ROWIDs only grow.
+
+        With a mention set, rows whose text is only in attributedBody aren't
+        decoded: each Message says whether it mentions the agent, and the
+        caller hands the ones it needs to decode().
+        """
+        metrics.inc("polls_total")
+        with metrics.span("poll_query"):
+            return await self._get_new_messages()
+
+    async def _get_new_messages(self):
+        row = await self._execute_query("SELECT MAX(ROWID) FROM message;")
+        if row is None:
+            return [], self._cursor
+        high_water = row[0] or 0
+
+        if self._cursor is None:
+            saved_cursor = self._load_cursor()
+            if saved_cursor is None or saved_cursor > high_water:
+                # first run (or chat.db was replaced), start at the tip
+                # rather than answering the whole history
+                await self.advance_cursor(high_water)
+                return [], high_water
+            self._cursor = saved_cursor
+
+        if high_water <= self._cursor:
+            return [], self._cursor
+
+        if self._mention is None:
+            query, params = _MESSAGE_SELECT, (self._cursor, high_water)
+        else:
+            query = _MENTION_SELECT
+            params = (self._mention, self._mention.encode(), self._cursor, high_water)
+        new_messages = await self._execute_query(
+            f"""{query}
+            WHERE message.ROWID > ? AND message.ROWID <= ?
+            ORDER BY message.ROWID;
+            """,
+            params,
+            fetchall=True,
+        )
+        if new_messages is None:
+            return [], self._cursor
+        metrics.inc("rows_scanned_total", len(new_messages))
+        messages = [Message.from_row(row) for row in new_messages]
+        if self._mention is None:
+            await self.decode(messages)
+        return messages, high_water
+
+    async def iter_messages(self, after_rowid=0, batch_size=5000):
+        """
+        Every message above after_rowid, oldest first, as (messages,
+        last_rowid) batches of up to batch_size rows. Each batch is its own
+        ROWID range query, so nothing is held open between them and the
+        whole of chat.db is never in memory at once.
+        """
+        row = await self._execute_query("SELECT MAX(ROWID) FROM message;")
+        high_water = (row[0] if row else None) or 0
+        while after_rowid < high_water:
+            rows = await self._execute_query(
+                BATCH_SELECT, (after_rowid, high_water, batch_size), fetchall=True
+            )
+            if not rows:
+                break
+            after_rowid = rows[-1][0]
+            messages = [Message.from_row(row) for row in rows]
+            # bypasses the decode cache, these rows won't be read again
+            await self.decode(messages, cache=False)
+            yield messages, after_rowid
+
+    def decode_cache_stats(self):
+        """attributedBody decode cache hit / miss counters"""
+        return self._decode_cache.stats()
+
+    async def decode(self, messages, cache=True):
+        """
+        Fill in the text of messages that only have an attributedBody. Cache
+        hits are answered here, the rest are decoded in one batch on the
+        decode pool so a burst of archives never stalls the event loop.
+        Returns how many were decoded.
+        """
+        pending = []
+        for message in messages:
+            if message.attributed_body is None:
+                continue
+            if cache:
+                hit, text = self._decode_cache.lookup(message.rowid)
+                if hit:
+                    message.text, message.attributed_body = text, None
+                    continue
+            pending.append(message)
+        if not pending:
+            return 0
+        if self._decode_pool is None:
+            self._decode_pool = ThreadPoolExecutor(
+                self._decode_workers, thread_name_prefix="decode"
+            )
+        results = await asyncio.get_running_loop().run_in_executor(
+            self._decode_pool, decode_many, [m.attributed_body for m in pending]
+        )
+        for message, (text, seconds) in zip(pending, results):
+            metrics.observe("decode_seconds", seconds)
+            message.text, message.attributed_body = text, None
+            if cache:
+                self._decode_cache.store(message.rowid, text)
+                if self._state is not None:
+                    self._state.add_decoded(message.rowid, text)
+        metrics.inc("bodies_decoded_total", len(pending))
+        return len(pending)
+
     async def _process_messages(self, messages):
         """process"""
-        results = []
-        if messages:
-            for message in messages:
-                handle_id, text, attributed_body, timestamp, is_from_me = message
-                if text is None and attributed_body:
-                    from typedstream import unarchive_from_data  # type: ignore
-
-                    unarch = unarchive_from_data(attributed_body)
-                    text = unarch.contents[0].value.value
-                message_dict = {
-                    "handle_id": handle_id,
-                    "text": text,
-                    "timestamp": timestamp,
-                    "is_from_me": is_from_me,
-                }
-                results.append(message_dict)
+        results = [Message.from_row(row) for row in messages or []]
+        await self.decode(results)
         return results
 
-    async def get_latest_messages_for_chat(self, k, handle_id):
-        """get latest by id"""
-        query = """
-        SELECT handle.id, message.text, message.attributedBody,
-            datetime(message.date/1000000000 + strftime("%s", "2001-01-01"),
-            "unixepoch", "localtime") as timestamp, message.is_from_me
-        FROM message
-        JOIN handle ON message.handle_id = handle.ROWID
-        WHERE handle.id = ?
-        ORDER BY message.date DESC
+    async def get_latest_messages_for_chat(self, k, chat_id):
+        """
+        The latest k messages of a thread (chat.ROWID), newest first, every
+        sender included. One range scan of chat_message_join's
+        (chat_id, message_date) index. None if the query failed.
+        """
+        query = f"""{_MESSAGE_SELECT}
+        WHERE chat_message_join.chat_id = ?
+        ORDER BY chat_message_join.message_date DESC
         LIMIT ?;
         """
-        # Fetch all results using the provided handle_id and limit
         latest_messages = await self._execute_query(
-            query, (handle_id, k), fetchall=True
+            query, (chat_id, k), fetchall=True
         )
+        if latest_messages is None:
+            return None
         return await self._process_messages(latest_messages)
 
     async def get_messages_in_last_seconds(self, seconds):
         """Get messages from the last specified number of seconds."""
-        # Calculate the current time in nanoseconds and the time threshold
-        nanoseconds = seconds * 1000000000
-
-        # Updated SQL query using correct time comparison
-        query = """
-        SELECT handle.id, message.text, message.attributedBody,
-               datetime((message.date / 1000000000) + strftime('%s', '2001-01-01'),
-                        'unixepoch', 'localtime') as timestamp, message.is_from_me
-        FROM message
-        JOIN handle ON message.handle_id = handle.ROWID
-        WHERE message.date >= ((strftime("%s", 'now') - strftime("%s", '2001-01-01')) * 1000000000 - ?)
+        # message.date is nanoseconds since 2001-01-01
+        since = int((time.time() - APPLE_EPOCH - seconds) * 1e9)
+        query = f"""{_MESSAGE_SELECT}
+        WHERE message.date >= ?
         ORDER BY message.date DESC;
         """
-
-        # Fetch all results since we are limiting based on time in the query itself
         messages_in_last_seconds = await self._execute_query(
-            query, (nanoseconds,), fetchall=True
+            query, (since,), fetchall=True
         )
-
-        # Process and return the messages
-        processed_messages = await self._process_messages(messages_in_last_seconds)
-        return processed_messages
-
-
-# Setup logging
-logging.basicConfig(level=logging.INFO)
+        return await self._process_messages(messages_in_last_seconds)
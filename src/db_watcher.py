@@ -0,0 +1,190 @@
+"""
+chat.db change watchers
+
+Event driven replacements for stat polling. Each backend watches the
+directory holding chat.db so a WAL that's deleted and recreated is still seen,
+and wakes the event loop through add_reader, so an idle agent costs no CPU.
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+
+
+class ChangeWatcher:
+    """Base watcher, wait() returns True as soon as a watched file changes"""
+
+    def __init__(self, paths):
+        self._paths = [os.path.abspath(p) for p in paths]
+        self._names = {os.path.basename(p) for p in self._paths}
+        self._directory = os.path.dirname(self._paths[0])
+        self._event = None
+        self._loop = None
+
+    def _fileno(self):
+        raise NotImplementedError
+
+    def _drain(self):
+        """read pending notifications, True if any touched a watched file"""
+        raise NotImplementedError
+
+    def _on_readable(self):
+        if self._drain():
+            self._event.set()
+
+    async def wait(self, timeout):
+        """wait up to timeout seconds for a change"""
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            self._event = asyncio.Event()
+            self._loop.add_reader(self._fileno(), self._on_readable)
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._event.clear()
+
+    def close(self):
+        """stop watching"""
+        if self._loop is not None:
+            self._loop.remove_reader(self._fileno())
+            self._loop = None
+
+
+class InotifyWatcher(ChangeWatcher):
+    """Linux inotify, through libc since the stdlib has no binding"""
+
+    _IN_MODIFY = 0x00000002
+    _IN_MOVED_TO = 0x00000080
+    _IN_CREATE = 0x00000100
+    _EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, paths):
+        super().__init__(paths)
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = self._IN_MODIFY | self._IN_MOVED_TO | self._IN_CREATE
+        if libc.inotify_add_watch(self._fd, os.fsencode(self._directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, f"inotify_add_watch failed for {self._directory}")
+
+    def _fileno(self):
+        return self._fd
+
+    def _drain(self):
+        changed = False
+        while True:
+            try:
+                buffer = os.read(self._fd, 4096)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(buffer):
+                _, _, _, length = self._EVENT_HEADER.unpack_from(buffer, offset)
+                offset += self._EVENT_HEADER.size
+                name = buffer[offset : offset + length].rstrip(b"\0")
+                offset += length
+                if os.fsdecode(name) in self._names:
+                    changed = True
+
+    def close(self):
+        super().close()
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class KqueueWatcher(ChangeWatcher):
+    """macOS / BSD kqueue vnode events"""
+
+    # O_EVTONLY on macOS, holds the file without blocking unmounts
+    _OPEN_FLAGS = os.O_RDONLY | getattr(
+        os, "O_EVTONLY", 0x8000 if sys.platform == "darwin" else 0
+    )
+
+    def __init__(self, paths):
+        super().__init__(paths)
+        self._kq = select.kqueue()
+        self._fds = {}
+        # directory writes signal files being created or renamed into place
+        self._dir_fd = os.open(self._directory, self._OPEN_FLAGS)
+        self._register(self._dir_fd, select.KQ_NOTE_WRITE)
+        self._arm_files()
+
+    def _register(self, fd, fflags):
+        event = select.kevent(
+            fd,
+            filter=select.KQ_FILTER_VNODE,
+            flags=select.KQ_EV_ADD | select.KQ_EV_CLEAR,
+            fflags=fflags,
+        )
+        self._kq.control([event], 0, 0)
+
+    def _arm_files(self):
+        """(re)open watched files that appeared since we last looked"""
+        for path in self._paths:
+            if path in self._fds:
+                continue
+            try:
+                fd = os.open(path, self._OPEN_FLAGS)
+            except FileNotFoundError:
+                continue
+            self._fds[path] = fd
+            self._register(
+                fd,
+                select.KQ_NOTE_WRITE
+                | select.KQ_NOTE_EXTEND
+                | select.KQ_NOTE_DELETE
+                | select.KQ_NOTE_RENAME,
+            )
+
+    def _fileno(self):
+        return self._kq.fileno()
+
+    def _drain(self):
+        changed = False
+        gone = select.KQ_NOTE_DELETE | select.KQ_NOTE_RENAME
+        for event in self._kq.control(None, 16, 0):
+            changed = True
+            if event.ident != self._dir_fd and event.fflags & gone:
+                for path, fd in list(self._fds.items()):
+                    if fd == event.ident:
+                        os.close(fd)
+                        del self._fds[path]
+        self._arm_files()
+        return changed
+
+    def close(self):
+        super().close()
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds = {}
+        os.close(self._dir_fd)
+        self._kq.close()
+
+
+def create_watcher(paths, backend="auto"):
+    """
+    Best watcher available on this platform, or None when only stat polling
+    will do (backend="stat" or the OS backend can't be set up).
+    """
+    if backend == "stat":
+        return None
+    try:
+        if sys.platform.startswith("linux"):
+            return InotifyWatcher(paths)
+        if hasattr(select, "kqueue"):
+            return KqueueWatcher(paths)
+    except OSError as e:
+        logging.info(f"Falling back to stat polling: {e}")
+    return None
@@ -0,0 +1,242 @@
+"""
+Diagnostics
+"""
+
+import asyncio
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+from metrics import metrics
+
+
+def _frames(frame, limit=64):
+    """a thread's stack, outermost first, as (file, function, line)"""
+    frames = []
+    while frame is not None and len(frames) < limit:
+        code = frame.f_code
+        frames.append((os.path.basename(code.co_filename), code.co_name, frame.f_lineno))
+        frame = frame.f_back
+    return frames[::-1]
+
+
+def format_stack(frame):
+    return "\n".join(f"  {file}:{line} in {function}" for file, function, line in _frames(frame))
+
+
+def sample(thread_id, seconds, interval=0.005):
+    """
+    Sample a thread's stack every interval seconds for seconds, from the
+    calling thread. Returns a Counter of collapsed stacks ("a;b;c"), the
+    input flamegraph tools take.
+    """
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is not None:
+            stacks[";".join(f"{file}:{function}" for file, function, _ in _frames(frame))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+class LoopWatchdog:
+    """
+    Flags anything that blocks the event loop for threshold seconds or more.
+    A task on the loop records a heartbeat; a thread checks it, and when it
+    goes stale logs the loop thread's stack while it's still stuck, so the
+    blocking call itself shows up, not just the task it was in.
+    """
+
+    def __init__(self, threshold):
+        self._threshold = threshold
+        self._beat = time.monotonic()
+        self._thread_id = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.stalls = []
+
+    async def run(self):
+        self._thread_id = threading.get_ident()
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        interval = self._threshold / 2
+        try:
+            while True:
+                self._beat = time.monotonic()
+                await asyncio.sleep(interval)
+                late = time.monotonic() - self._beat - interval
+                if late >= self._threshold:
+                    metrics.observe("loop_blocked_seconds", late)
+        finally:
+            self._stop.set()
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(self._threshold / 2):
+            beat = self._beat
+            if beat == reported or time.monotonic() - beat < self._threshold * 1.5:
+                continue
+            reported = beat
+            frame = sys._current_frames().get(self._thread_id)
+            stack = format_stack(frame) if frame is not None else "  (no frame)"
+            self.stalls.append(stack)
+            metrics.inc("slow_callbacks_total")
+            logging.warning(
+                f"Event loop blocked for over {self._threshold * 1000:.0f} ms, at:\n{stack}"
+            )
+
+
+class Diagnostics:
+    """
+    Opt-in profiling for the running agent, on when diagnostics_path or
+    diagnostics_port is set:
+    - a sampling profile of the event loop thread, on SIGUSR1 or a
+      "profile [seconds]" command, written as collapsed stacks
+    - a watchdog logging the stack of any callback blocking the loop
+    - tracemalloc top allocations every tracemalloc_interval seconds
+    The port takes one line commands on localhost: profile [seconds],
+    stacks, memory.
+    """
+
+    def __init__(self, config):
+        self._path = (
+            os.path.expanduser(config["diagnostics_path"]) if config["diagnostics_path"] else None
+        )
+        self._port = config["diagnostics_port"]
+        self._slow_callback = config["slow_callback_ms"] / 1000
+        self._profile_seconds = config["profile_seconds"]
+        self._tracemalloc_interval = config["tracemalloc_interval"]
+        self._tracemalloc_top = config["tracemalloc_top"]
+        self._thread_id = None
+        self._server = None
+        self._tasks = []
+        self._previous_snapshot = None
+        self.watchdog = None
+
+    @property
+    def enabled(self):
+        return self._port is not None or bool(self._path)
+
+    async def start(self, host="127.0.0.1"):
+        """start whatever is configured, returns the command port if there is one"""
+        if not self.enabled:
+            return None
+        self._thread_id = threading.get_ident()
+        loop = asyncio.get_running_loop()
+        if self._slow_callback:
+            self.watchdog = LoopWatchdog(self._slow_callback)
+            self._tasks.append(asyncio.create_task(self.watchdog.run()))
+        if self._tracemalloc_interval:
+            tracemalloc.start(16)
+            self._tasks.append(asyncio.create_task(self._memory_loop()))
+        try:
+            loop.add_signal_handler(signal.SIGUSR1, self._on_signal)
+        except (NotImplementedError, RuntimeError, ValueError):
+            pass
+        logging.info(f"Diagnostics on, kill -USR1 {os.getpid()} for a {self._profile_seconds}s profile")
+        if self._port is None:
+            return None
+        self._server = await asyncio.start_server(self._serve, host, self._port)
+        port = self._server.sockets[0].getsockname()[1]
+        logging.info(f"Diagnostics commands at {host}:{port}")
+        return port
+
+    def _write(self, kind, text):
+        """write a dump to diagnostics_path, returns where"""
+        if not self._path:
+            return None
+        os.makedirs(self._path, exist_ok=True)
+        path = os.path.join(self._path, f"{kind}-{datetime.now():%Y%m%d-%H%M%S}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+    async def profile(self, seconds=None):
+        """sample the loop thread, collapsed stacks most frequent first"""
+        stacks = await asyncio.to_thread(
+            sample, self._thread_id, seconds or self._profile_seconds
+        )
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    def stacks(self):
+        """every thread's current stack"""
+        names = {t.ident: t.name for t in threading.enumerate()}
+        frames = sys._current_frames()
+        return "\n\n".join(
+            f"{names.get(ident, ident)}:\n{format_stack(frame)}" for ident, frame in frames.items()
+        ) + "\n"
+
+    def memory(self):
+        """top allocations by line, and what grew since the last call"""
+        if not tracemalloc.is_tracing():
+            return "tracemalloc is off, set tracemalloc_interval\n"
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"traced {current / 1e6:.1f} MB, peak {peak / 1e6:.1f} MB", "top:"]
+        lines += [f"  {stat}" for stat in snapshot.statistics("lineno")[: self._tracemalloc_top]]
+        if self._previous_snapshot is not None:
+            lines.append("grown:")
+            lines += [
+                f"  {stat}"
+                for stat in snapshot.compare_to(self._previous_snapshot, "lineno")[: self._tracemalloc_top]
+            ]
+        self._previous_snapshot = snapshot
+        return "\n".join(lines) + "\n"
+
+    def _on_signal(self):
+        self._tasks.append(asyncio.create_task(self._dump_profile()))
+
+    async def _dump_profile(self):
+        text = await self.profile()
+        path = self._write("profile", text)
+        logging.info(f"Profile written to {path}" if path else f"Profile:\n{text}")
+
+    async def _memory_loop(self):
+        while True:
+            await asyncio.sleep(self._tracemalloc_interval)
+            text = await asyncio.to_thread(self.memory)
+            path = self._write("memory", text)
+            logging.info(f"Memory snapshot written to {path}" if path else f"Memory:\n{text}")
+
+    async def _serve(self, reader, writer):
+        try:
+            command = (await reader.readline()).decode(errors="replace").split()
+            if command[:1] == ["profile"]:
+                seconds = float(command[1]) if len(command) > 1 else None
+                reply = await self.profile(seconds)
+            elif command[:1] == ["stacks"]:
+                reply = self.stacks()
+            elif command[:1] == ["memory"]:
+                reply = await asyncio.to_thread(self.memory)
+            else:
+                reply = "commands: profile [seconds], stacks, memory\n"
+            writer.write(reply.encode())
+            await writer.drain()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        try:
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGUSR1)
+        except (NotImplementedError, RuntimeError, ValueError):
+            pass
@@ -0,0 +1,230 @@
+"""
+History export
+
+Streams every message in chat.db to a JSONL file (or a directory of
+Parquet files, which needs pyarrow) for offline work: building indexes,
+evaluating prompts, warming caches.
+
+    python src/history_export.py ~/messages.jsonl
+"""
+
+import argparse
+import json
+import logging
+import os
+import resource
+import sqlite3
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from attributed_body import decode_many
+from config import config
+from db_manager import BATCH_SELECT
+from message import Message
+
+FORMATS = ("jsonl", "parquet")
+
+
+def export_batch(rows, fmt):
+    """
+    Turn a batch of _MESSAGE_SELECT rows into output, run on the process
+    pool: JSONL bytes, or a dict of columns for Parquet. Returns (output,
+    bodies decoded).
+    """
+    messages = [Message.from_row(row) for row in rows]
+    pending = [m for m in messages if m.attributed_body is not None]
+    for message, (text, _) in zip(pending, decode_many([m.attributed_body for m in pending])):
+        message.text, message.attributed_body = text, None
+    fields = ("rowid", "guid", "chat_id", "chat_guid", "handle_id", "text", "is_from_me", "unix_time")
+    if fmt == "parquet":
+        return {name: [getattr(m, name) for m in messages] for name in fields}, len(pending)
+    lines = [json.dumps({name: getattr(m, name) for name in fields}, ensure_ascii=False) for m in messages]
+    return ("\n".join(lines) + "\n").encode("utf-8"), len(pending)
+
+
+class _JsonlOutput:
+    """one file, appended to; position is its size for the checkpoint"""
+
+    def __init__(self, path, position):
+        self._file = open(path, "r+b" if position else "wb")
+        # drop anything written after the last checkpoint
+        self._file.truncate(position)
+        self._file.seek(position)
+
+    def write(self, data, first_rowid):
+        self._file.write(data)
+
+    def position(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+
+
+class _ParquetOutput:
+    """a directory with a part file per batch, named by its first ROWID"""
+
+    def __init__(self, path, position):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise RuntimeError("Parquet export needs pyarrow, pip install pyarrow") from e
+        self._pyarrow = pyarrow
+        self._path = path
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, columns, first_rowid):
+        part = os.path.join(self._path, f"part-{first_rowid:012d}.parquet")
+        self._pyarrow.parquet.write_table(self._pyarrow.table(columns), part)
+
+    def position(self):
+        return 0
+
+    def close(self):
+        pass
+
+
+def _load_checkpoint(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_checkpoint(path, checkpoint):
+    """written atomically, like the cursor"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+def _batches(conn, after_rowid, batch_size):
+    """ROWID ordered batches of raw rows, one range query each"""
+    high_water = conn.execute("SELECT MAX(ROWID) FROM message;").fetchone()[0] or 0
+    while after_rowid < high_water:
+        rows = conn.execute(BATCH_SELECT, (after_rowid, high_water, batch_size)).fetchall()
+        if not rows:
+            break
+        after_rowid = rows[-1][0]
+        yield rows
+
+
+def peak_rss_mb():
+    """peak resident memory of this process and of its finished children, in MB"""
+    # ru_maxrss is bytes on macOS and kilobytes on Linux
+    scale = 1 / 1e6 if sys.platform == "darwin" else 1 / 1e3
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return own, children
+
+
+def export_history(db_path, out_path, fmt="jsonl", batch_size=5000, workers=None, restart=False):
+    """
+    Export chat.db's messages oldest first to out_path. Batches are read by
+    ROWID range and handed to a process pool to decode and serialize, with
+    at most two per worker in flight so memory stays bounded whatever the
+    size of chat.db; they're written back in order. After each batch a
+    checkpoint next to the output records the last ROWID written, so an
+    interrupted export, or a later one, carries on from there. Returns
+    throughput stats.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {FORMATS}")
+    out_path = os.path.expanduser(out_path)
+    checkpoint_path = f"{out_path}.checkpoint"
+    checkpoint = None if restart else _load_checkpoint(checkpoint_path)
+    if (
+        checkpoint is not None
+        and fmt == "jsonl"
+        and os.path.exists(out_path)
+        and os.path.getsize(out_path) < checkpoint.get("position", 0)
+    ):
+        # replaced or cut short since, carrying on would pad it with NULs
+        logging.warning(f"Export: {out_path} is shorter than its checkpoint, starting over")
+        checkpoint = None
+    if (
+        checkpoint is None
+        or checkpoint.get("format") != fmt
+        # the output it describes has gone
+        or (fmt == "jsonl" and not os.path.exists(out_path))
+    ):
+        checkpoint = {"format": fmt, "rowid": 0, "position": 0}
+    if checkpoint["rowid"]:
+        logging.info(f"Export: resuming after ROWID {checkpoint['rowid']}")
+
+    uri = f"{Path(os.path.expanduser(db_path)).as_uri()}?mode=ro"
+    conn = sqlite3.connect(uri, uri=True)
+    output = (_JsonlOutput if fmt == "jsonl" else _ParquetOutput)(out_path, checkpoint["position"])
+    workers = workers or os.cpu_count() or 1
+    stats = {"messages": 0, "decoded": 0}
+    start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(workers) as pool:
+            in_flight = deque()
+
+            def write_oldest():
+                rows, future = in_flight.popleft()
+                data, decoded = future.result()
+                output.write(data, rows[0][0])
+                stats["messages"] += len(rows)
+                stats["decoded"] += decoded
+                checkpoint["rowid"] = rows[-1][0]
+                checkpoint["position"] = output.position()
+                _save_checkpoint(checkpoint_path, checkpoint)
+
+            for rows in _batches(conn, checkpoint["rowid"], batch_size):
+                in_flight.append((rows, pool.submit(export_batch, rows, fmt)))
+                if len(in_flight) >= workers * 2:
+                    write_oldest()
+            while in_flight:
+                write_oldest()
+    finally:
+        output.close()
+        conn.close()
+    seconds = time.perf_counter() - start
+    own_rss, workers_rss = peak_rss_mb()
+    stats.update(
+        seconds=seconds,
+        messages_per_second=stats["messages"] / seconds if seconds else 0.0,
+        through_rowid=checkpoint["rowid"],
+        peak_rss_mb=own_rss,
+        worker_peak_rss_mb=workers_rss,
+    )
+    logging.info(
+        f"Export: {stats['messages']} messages ({stats['decoded']} decoded) in {seconds:.1f}s, "
+        f"{stats['messages_per_second']:.0f}/s, peak RSS {own_rss:.0f} MB "
+        f"(workers {workers_rss:.0f} MB)"
+    )
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("out", help="JSONL file, or directory for parquet")
+    parser.add_argument("--format", choices=FORMATS, default="jsonl")
+    parser.add_argument("--db-path", default=config["db_path"], help="directory holding chat.db")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=None, help="decode processes, default every core")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start over")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    export_history(
+        os.path.join(args.db_path, "chat.db"),
+        args.out,
+        fmt=args.format,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        restart=args.restart,
+    )
+
+
+if __name__ == "__main__":
+    main()
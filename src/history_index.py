@@ -0,0 +1,150 @@
+"""
+History index
+"""
+
+import logging
+import os
+import re
+
+import aiosqlite
+
+from metrics import metrics
+
+_WORD = re.compile(r"\w+")
+
+# too common to say anything about relevance
+_STOPWORDS = frozenset(
+    """a about all an and any are as at be but by can could did do does for from
+    had has have he her him his how i if in is it its just me my no not of on or
+    our she so than that the their them then there they this to up us was we were
+    what when where which who why will with would you your""".split()
+)
+
+
+def match_query(text, max_terms=16):
+    """an FTS5 query matching any of the meaningful words in text, None if there are none"""
+    terms = []
+    for word in _WORD.findall(text.lower()):
+        if len(word) > 1 and word not in _STOPWORDS and word not in terms:
+            terms.append(word)
+    if not terms:
+        return None
+    return " OR ".join(f'"{term}"' for term in terms[:max_terms])
+
+
+class HistoryIndex:
+    """
+    A full-text index of every message, kept in the agent's own state
+    directory so searching old history never scans chat.db. It's filled from
+    the rows the processor ingests, decoded attributedBody text included,
+    and a one off build() streams what came before in ROWID batches,
+    resuming where it stopped. search() is a bm25 ranked FTS5 lookup
+    limited to one chat.
+    """
+
+    def __init__(self, path):
+        self._path = os.path.expanduser(path)
+        self._conn = None
+
+    async def _get_connection(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+            self._conn = await aiosqlite.connect(self._path)
+            await self._conn.execute("PRAGMA journal_mode=WAL;")
+            await self._conn.execute("PRAGMA synchronous=NORMAL;")
+            # rowid is message.ROWID, so indexing a row twice is harmless.
+            # chat is a token like "c42" rather than an unindexed column so
+            # limiting to one chat intersects posting lists instead of
+            # ranking every match in every chat and filtering afterwards
+            await self._conn.execute(
+                """CREATE VIRTUAL TABLE IF NOT EXISTS history USING fts5(
+                text, chat, is_from_me UNINDEXED, unix_time UNINDEXED,
+                tokenize = 'porter unicode61');"""
+            )
+            await self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS history_meta (key TEXT PRIMARY KEY, value INTEGER);"
+            )
+            await self._conn.commit()
+        return self._conn
+
+    async def add(self, messages):
+        """index a batch of message rows"""
+        rows = [
+            (m.rowid, m.text, f"c{m.chat_id}", m.is_from_me, m.unix_time)
+            for m in messages
+            if m.text
+        ]
+        if not rows:
+            return
+        conn = await self._get_connection()
+        await conn.executemany(
+            """INSERT OR REPLACE INTO history (rowid, text, chat, is_from_me, unix_time)
+            VALUES (?, ?, ?, ?, ?);""",
+            rows,
+        )
+        await conn.commit()
+        metrics.inc("history_indexed_total", len(rows))
+
+    async def _built_through(self):
+        conn = await self._get_connection()
+        async with conn.execute(
+            "SELECT value FROM history_meta WHERE key = 'built_through';"
+        ) as cursor:
+            row = await cursor.fetchone()
+        return row[0] if row else 0
+
+    async def build(self, db_manager, batch_size=5000):
+        """
+        index everything already in chat.db, a batch at a time, recording
+        progress so an interrupted build carries on from the last batch
+        """
+        built_through = await self._built_through()
+        conn = await self._get_connection()
+        total = 0
+        async for messages, last_rowid in db_manager.iter_messages(built_through, batch_size):
+            await self.add(messages)
+            await conn.execute(
+                "INSERT OR REPLACE INTO history_meta (key, value) VALUES ('built_through', ?);",
+                (last_rowid,),
+            )
+            await conn.commit()
+            total += len(messages)
+        if total:
+            logging.info(f"History index: added {total} messages")
+        return total
+
+    async def search(self, chat_id, text, k=3, before_rowid=None):
+        """
+        the k messages of a chat most relevant to text, best first, as
+        dicts with rowid, text, is_from_me, unix_time and a short snippet.
+        before_rowid leaves out that message and everything after it
+        """
+        query = match_query(text)
+        if query is None or k <= 0:
+            return []
+        conn = await self._get_connection()
+        with metrics.span("history_search"):
+            async with conn.execute(
+                """SELECT rowid, text, is_from_me, unix_time,
+                    snippet(history, 0, '', '', '...', 24)
+                FROM history
+                WHERE history MATCH ? AND rowid < ?
+                ORDER BY bm25(history, 1.0, 0.0) LIMIT ?;""",
+                (f'chat : "c{chat_id}" AND text : ({query})', before_rowid or 1 << 62, k),
+            ) as cursor:
+                rows = await cursor.fetchall()
+        return [
+            {
+                "rowid": rowid,
+                "text": text,
+                "is_from_me": is_from_me,
+                "unix_time": unix_time,
+                "snippet": snippet,
+            }
+            for rowid, text, is_from_me, unix_time, snippet in rows
+        ]
+
+    async def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            await conn.close()
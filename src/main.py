@@ -2,21 +2,114 @@
 Messages Agent
 """
 
+# first, launch is timed from here
+from startup import profile
+
 import asyncio
+import logging
+import os
 
 from model_client import OllamaClient
 from db_manager import DatabaseManager
+from history_index import HistoryIndex
 from message_processor import MessageProcessor
+from metrics import MetricsExporter, metrics
+from model_warmer import ModelWarmer
+from state_store import StateStore
 from config import config
 
 
+async def close_all(*closers):
+    """await each close in turn, logging rather than raising failures"""
+    for close in closers:
+        if close is None:
+            continue
+        try:
+            await close()
+        except Exception as e:
+            logging.error(f"Error during shutdown: {e}", exc_info=True)
+
+
+async def after_ready(processor, warmer, client, db_manager, history):
+    """
+    Everything that doesn't need to happen before the first poll: loading
+    the model (ollama itself is imported on a worker thread here) and
+    indexing chat history.
+    """
+    await processor.ready.wait()
+    ready = profile.mark("first poll")
+    metrics.set("startup_seconds", ready)
+    logging.info(f"Ready in {ready * 1000:.0f} ms")
+    await warmer.warm_up()
+    profile.mark("model warm")
+    logging.info(f"Model health: {await client.health()}")
+    profile.report()
+    profile.stop()
+    if history is not None:
+        await history.build(db_manager, config["history_build_batch"])
+
+
 async def main():
     """main"""
+    profile.mark("imports")
     client = OllamaClient(config)
-    db_manager = DatabaseManager(base_path=config["db_path"])
-    processor = MessageProcessor(db_manager, client, config)
-    await processor.run()
+    state = StateStore(
+        os.path.join(config["state_path"], "state.db"),
+        flush_interval=config["state_flush_interval"],
+        max_decoded=config["decode_cache_size"],
+    )
+    await state.open()
+    state_task = asyncio.create_task(state.run())
+    db_manager = DatabaseManager(
+        base_path=config["db_path"],
+        state_path=config["state_path"],
+        watcher=config["watcher"],
+        decode_cache_size=config["decode_cache_size"],
+        mention=config["mention"],
+        decode_workers=config["decode_workers"],
+        state=state,
+    )
+    warmer = ModelWarmer(client, config)
+    warmer_task = asyncio.create_task(warmer.run())
+    exporter = MetricsExporter(config)
+    await exporter.start()
+    exporter_task = asyncio.create_task(exporter.run())
+    diagnostics = None
+    if config["diagnostics_path"] or config["diagnostics_port"] is not None:
+        # off by default, not even imported then
+        from diagnostics import Diagnostics
+
+        diagnostics = Diagnostics(config)
+        await diagnostics.start()
+    history = None
+    if config["history_index"]:
+        history = HistoryIndex(os.path.join(config["state_path"], "history.db"))
+    processor = MessageProcessor(
+        db_manager, client, config, warmer=warmer, history=history, state=state
+    )
+    # the model loads once we're polling rather than before
+    startup_task = asyncio.create_task(
+        after_ready(processor, warmer, client, db_manager, history)
+    )
+    try:
+        await processor.run()
+    finally:
+        warmer_task.cancel()
+        state_task.cancel()
+        exporter_task.cancel()
+        startup_task.cancel()
+        # each on its own, so nothing can stop the state being flushed last
+        await close_all(
+            processor.close,
+            exporter.close,
+            diagnostics.close if diagnostics is not None else None,
+            client.close,
+            history.close if history is not None else None,
+            db_manager.close,
+            state.close,
+        )
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     asyncio.run(main())
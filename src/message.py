@@ -0,0 +1,53 @@
+"""
+Message record
+"""
+
+from dataclasses import dataclass
+from typing import Optional
+
+# seconds between 1970-01-01 and 2001-01-01, message.date counts from the latter
+APPLE_EPOCH = 978307200
+
+
+@dataclass(slots=True)
+class Message:
+    """
+    One chat.db row, the unit everything from the poll query to the history
+    index passes around. Slots keep it to a fixed handful of fields with no
+    per-row dict.
+    """
+
+    rowid: int
+    guid: str
+    chat_id: int
+    chat_guid: str
+    handle_id: Optional[str]  # the sender, None for our own messages in group chats
+    # None until decoded for rows whose text is only in attributedBody
+    text: Optional[str]
+    is_from_me: int
+    unix_time: Optional[float] = None  # when it hit chat.db, unix seconds
+    # the archived body while text is still to be decoded from it
+    attributed_body: Optional[bytes] = None
+    # whether the mention is somewhere in the text or body, None if unknown
+    mentions: Optional[bool] = None
+
+    @classmethod
+    def from_row(cls, row):
+        """
+        from a _MESSAGE_SELECT row, optionally with the mention test as a
+        tenth column. A row with no text keeps its attributedBody for decode
+        """
+        date = row[8]
+        text = row[5]
+        return cls(
+            row[0],
+            row[1],
+            row[2],
+            row[3],
+            row[4],
+            text,
+            row[7],
+            date / 1e9 + APPLE_EPOCH if date else None,
+            row[6] if text is None and row[6] else None,
+            bool(row[9]) if len(row) > 9 else None,
+        )
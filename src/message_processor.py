@@ -4,31 +4,108 @@ Message processor
 
 import asyncio
 import logging
+import time
+from collections import deque
+from functools import partial
+from context_cache import ConversationContextCache
+from conversation_scheduler import ConversationScheduler
 from db_manager import DatabaseManager
+from metrics import metrics
 from model_client import OllamaClient
+from summarizer import ConversationSummarizer
 from apple_script_messenger import AppleScriptMessenger
 
 
 class MessageProcessor:
     """MessageProcessor"""
 
-    def __init__(self, db_manager: DatabaseManager, client: OllamaClient, config):
+    def __init__(
+        self,
+        db_manager: DatabaseManager,
+        client: OllamaClient,
+        config,
+        warmer=None,
+        history=None,
+        state=None,
+    ):
         self._db_manager = db_manager
-        self._as_utils = AppleScriptMessenger()
+        # StateStore, remembers replies and what was answered across restarts
+        self._state = state
+        self._warmer = warmer
+        # HistoryIndex, older messages relevant to a mention go in the prompt
+        self._history = history
+        self._history_recall = config["history_recall"]
+        self._as_utils = AppleScriptMessenger(config["send_helper"])
         self._client = client
+        self._scheduler = ConversationScheduler(
+            config["max_concurrency"], debounce=config["debounce_seconds"]
+        )
         self._max_chat_items = config["max_chat_items"]
         self._max_interval = config["max_interval"]
         self._sleep_interval = config["sleep_interval"]
         self._mention = config["mention"]
-        self._last_sent_message = None
+        self._stream = config["stream"]
+        # recent replies, to tell ours apart when loading a chat from chat.db
+        self._sent_messages = deque(maxlen=32)
+        # chat_id -> replies sent whose chat.db row hasn't shown up yet
+        self._echoes = {}
+        # chats whose reply is being generated and not yet sent
+        self._generating = set()
+        # chat_id -> generations restarted for the mention being answered,
+        # capped so a busy chat can't keep a reply from ever finishing
+        self._supersedes = {}
+        self._max_supersedes = config["max_supersedes"]
+        # polls in a row the batch of new messages has failed on
+        self._batch_failures = 0
+        self._max_batch_retries = config["max_batch_retries"]
         self._previous_sleep_interval = None
+        # set once the first poll is done
+        self.ready = asyncio.Event()
+        # chat_id -> timings of the oldest mention still waiting on a reply
+        self._traces = {}
+        self._context = ConversationContextCache(
+            self._max_chat_items,
+            self._mention,
+            token_budget=config["context_token_budget"],
+            max_conversations=config["context_cache_conversations"],
+            idle_seconds=config["context_idle_seconds"],
+            keep_trimmed=config["summarize"],
+        )
+        # folds what's trimmed from a conversation into its rolling summary
+        self._summarizer = None
+        self._summarizer_task = None
+        if config["summarize"]:
+            self._summarizer = ConversationSummarizer(
+                client,
+                self._context,
+                config,
+                state=state,
+                busy=lambda: bool(self._generating) or self._scheduler.queued() > 0,
+            )
+        if state is not None:
+            # replies sent just before a restart whose rows haven't shown up
+            for chat_id, text in state.echoes():
+                self._sent_messages.append(text)
+                self._echoes.setdefault(chat_id, deque(maxlen=32)).append(text)
 
     async def run(self):
         """run"""
+        if self._summarizer is not None:
+            self._summarizer_task = asyncio.create_task(self._summarizer.run())
+        # catch up on anything that arrived while we weren't running
+        try:
+            await self._process_new_messages()
+        except Exception as e:
+            logging.error(f"An error occurred: {e}", exc_info=True)
+        self.ready.set()
         while True:
             try:
-                if await self._db_manager.has_db_changed():
-                    await self._process_new_messages()
+                # returns as soon as chat.db changes, the interval only
+                # bounds how long we idle when change events aren't available
+                if await self._db_manager.wait_for_change(self._sleep_interval):
+                    metrics.inc("wakeups_total")
+                    with metrics.span("poll"):
+                        await self._process_new_messages()
                     self._sleep_interval = 2
                 else:
                     self._sleep_interval = min(
@@ -36,10 +113,8 @@ class MessageProcessor:
                     )
 
                 if self._sleep_interval != self._previous_sleep_interval:
-                    logging.info(f"Sleeping for {self._sleep_interval} seconds...")
+                    logging.info(f"Waiting up to {self._sleep_interval} seconds...")
                     self._previous_sleep_interval = self._sleep_interval
-
-                await asyncio.sleep(self._sleep_interval)
             except KeyboardInterrupt:
                 logging.info("Program interrupted.")
                 break
@@ -48,53 +123,317 @@ class MessageProcessor:
 
     async def _process_new_messages(self):
         """process new messages"""
-        last_k = await self._db_manager.get_messages_in_last_seconds(
-            self._sleep_interval
-        )
-        drop_last_sent = [m for m in last_k if m["text"] != self._last_sent_message]
-        if not drop_last_sent:
+        new_messages, high_water = await self._db_manager.get_new_messages()
+        detected = time.time()
+        if new_messages and self._warmer is not None:
+            self._warmer.record_activity()
+        if new_messages and self._summarizer is not None:
+            self._summarizer.record_activity()
+        try:
+            await self._decode_needed(new_messages)
+            if new_messages and self._history is not None:
+                await self._index_history(new_messages)
+            fresh = [m for m in new_messages if not self._claim_echo(m)]
+            if fresh:
+                await self._dispatch(fresh, detected)
+        except Exception:
+            # the rows come round again on the next poll, unless they've
+            # failed so often they'd hold up everything after them for good
+            self._batch_failures += 1
+            if self._batch_failures <= self._max_batch_retries:
+                raise
+            logging.error(
+                f"Skipping messages {[m.rowid for m in new_messages]} after "
+                f"{self._batch_failures} failed attempts",
+                exc_info=True,
+            )
+            metrics.inc("batches_skipped_total")
+        self._batch_failures = 0
+        # only once the batch has been handed off (or given up on)
+        await self._db_manager.advance_cursor(high_water)
+
+    async def _dispatch(self, fresh, detected):
+        """feed new rows into their conversations and queue the chats to answer"""
+        # one unit of work per thread, however many people wrote in it
+        grouped_k = await self._group_by(fresh, "chat_id")
+
+        self._context.evict()
+        for chat_id, messages in grouped_k.items():
+            # a chat we hold no context for only matters once it mentions us
+            if chat_id not in self._context and not any(
+                self._mentions(m) for m in messages
+            ):
+                continue
+            self._trace_mentions(chat_id, messages, detected)
+            with metrics.span("context"):
+                await self._update_context(chat_id, messages)
+            # a reply still being generated is already stale, start over
+            # with the new messages in the context
+            if self._supersede(chat_id):
+                metrics.inc("generations_superseded_total")
+            # hand each chat to the scheduler so polling carries on
+            # while replies are generated; a burst becomes one job
+            self._scheduler.submit(
+                chat_id,
+                partial(self._process_chat, chat_id, messages[-1].chat_guid),
+                coalesce=True,
+            )
+        logging.info(f"Scheduler: {self._scheduler.stats()}")
+        metrics.set("conversations_cached", len(self._context))
+        metrics.set("scheduler_queued", self._scheduler.queued())
+
+    async def close(self):
+        """cancel in flight conversations and stop the send helper"""
+        if self._summarizer_task is not None:
+            self._summarizer_task.cancel()
+        await self._scheduler.close()
+        await self._as_utils.close()
+
+    async def _decode_needed(self, messages):
+        """
+        Decode the archived bodies of the rows something will read: ones
+        mentioning the agent, ones in a conversation we hold and possible
+        echoes of our replies. With a history index every row is read.
+        """
+        wanted = [
+            m
+            for m in messages
+            if m.attributed_body is not None
+            and (
+                self._history is not None
+                or m.mentions
+                or m.chat_id in self._context
+                or (m.is_from_me and m.chat_id in self._echoes)
+            )
+        ]
+        if wanted:
+            await self._db_manager.decode(wanted)
+        skipped = sum(1 for m in messages if m.attributed_body is not None)
+        if skipped:
+            metrics.inc("bodies_skipped_total", skipped)
+
+    def _supersede(self, chat_id):
+        """restart the chat's reply being generated, unless it's been restarted enough"""
+        if chat_id not in self._generating:
+            return False
+        if self._supersedes.get(chat_id, 0) >= self._max_supersedes:
+            return False
+        if not self._scheduler.cancel_running(chat_id):
+            return False
+        self._supersedes[chat_id] = self._supersedes.get(chat_id, 0) + 1
+        return True
+
+    def _mentions(self, message):
+        """whether the row mentions the agent, from the query's flag when there is one"""
+        if message.mentions is not None:
+            return message.mentions
+        return bool(message.text) and self._mention in message.text
+
+    async def _index_history(self, messages):
+        """add new rows to the history index, a failure doesn't hold up replies"""
+        try:
+            await self._history.add(messages)
+        except Exception as e:
+            logging.info(f"Couldn't index messages: {e}")
+
+    async def _recall(self, chat_id, context):
+        """
+        messages from before the context that match the question being
+        answered, empty without a history index
+        """
+        if self._history is None or not self._history_recall:
+            return []
+        question = next((e for e in reversed(context) if e["agent_directed"]), None)
+        rowids = [e["rowid"] for e in context if e.get("rowid")]
+        if question is None or not rowids:
+            return []
+        try:
+            return await self._history.search(
+                chat_id, question["content"], self._history_recall, before_rowid=min(rowids)
+            )
+        except Exception as e:
+            logging.info(f"History search failed: {e}")
+            return []
+
+    def _claim_echo(self, message):
+        """
+        True for the chat.db row of a reply we sent. Each reply claims one
+        row, after that it's known by ROWID like everything else, so someone
+        else sending the same words still counts as a new message.
+        """
+        if not message.is_from_me:
+            return False
+        echoes = self._echoes.get(message.chat_id)
+        if not echoes or message.text not in echoes:
+            return False
+        echoes.remove(message.text)
+        if not echoes:
+            del self._echoes[message.chat_id]
+        if self._state is not None:
+            self._state.claim_echo(message.chat_id, message.text, message.guid, message.rowid)
+        return True
+
+    def _record_reply(self, chat_id, sent_message, chat_guid=None, context=()):
+        """a reply went out answering context"""
+        self._supersedes.pop(chat_id, None)
+        self._sent_messages.append(sent_message)
+        self._echoes.setdefault(chat_id, deque(maxlen=32)).append(sent_message)
+        self._context.add_reply(chat_id, sent_message)
+        if self._state is not None:
+            answered = max((e["rowid"] for e in context if e.get("rowid")), default=0)
+            self._state.record_reply(chat_id, chat_guid, sent_message, answered)
+
+    def _already_answered(self, chat_id, context):
+        """
+        the mention was answered before a restart and its rows came round
+        again, the cursor having not been saved yet
+        """
+        if self._state is None:
+            return False
+        question = next((e for e in reversed(context) if e["agent_directed"]), None)
+        if question is None or not question.get("rowid"):
+            return False
+        return question["rowid"] <= self._state.chat(chat_id).get("answered_rowid", 0)
+
+    def _needs_reply(self, context):
+        """
+        a mention since the agent last spoke, so "@a weather?" then "in
+        Paris" is answered as one question
+        """
+        for entry in reversed(context):
+            if entry["role"] == "assistant":
+                return False
+            if entry["agent_directed"]:
+                return True
+        return False
+
+    def _trace_mentions(self, chat_id, messages, detected):
+        """start timing the first mention in a chat that has none waiting"""
+        if chat_id in self._traces:
             return
+        for message in messages:
+            if self._mentions(message):
+                # when it hit chat.db, falling back to when we saw it
+                arrived = message.unix_time or detected
+                metrics.observe("detect_seconds", max(0.0, detected - arrived))
+                self._traces[chat_id] = {
+                    "arrived": arrived,
+                    "detected": detected,
+                    "queued": time.perf_counter(),
+                }
+                return
 
-        grouped_k = await self._group_by(drop_last_sent, "handle_id")
+    @staticmethod
+    def _finish_trace(trace, sent):
+        """record the end to end latency of the mention that was just answered"""
+        if trace is None or not sent:
+            return
+        now = time.time()
+        metrics.inc("replies_total")
+        metrics.observe("mention_to_send_seconds", max(0.0, now - trace["arrived"]))
+        metrics.observe("detect_to_send_seconds", now - trace["detected"])
 
-        for handle_id, _ in grouped_k.items():
-            await self._process_messages_by_handle_id(handle_id)
+    async def _update_context(self, chat_id, messages):
+        """
+        Feed new rows into the conversation's context. Only a conversation we
+        aren't holding yet costs a chat.db query, done here in the poll loop
+        so no rows can slip in between the load and the next batch.
+        """
+        if chat_id in self._context:
+            for message in messages:
+                self._context.append(chat_id, message)
+        else:
+            recent_messages = await self._db_manager.get_latest_messages_for_chat(
+                self._max_chat_items, chat_id
+            )
+            if recent_messages is None:
+                # the query failed, start from the batch rather than lose it
+                logging.info(f"Couldn't load chat {chat_id}, starting from the new messages")
+                recent_messages = list(reversed(messages))
+            summary, summary_rowid = (
+                self._state.summary(chat_id) if self._state is not None else (None, 0)
+            )
+            self._context.load(
+                chat_id,
+                recent_messages,
+                self._sent_messages,
+                self._state.sent_guids if self._state is not None else (),
+                summary=summary,
+                summary_rowid=summary_rowid,
+            )
 
-    async def _process_messages_by_handle_id(self, handle_id):
-        """process each "chat" determined by handle_id"""
-        recent_messages = await self._db_manager.get_latest_messages_for_chat(
-            self._max_chat_items, handle_id
-        )
-        if recent_messages and recent_messages[0]:
-            await self._check_and_send_messages(handle_id, recent_messages)
+    async def _process_chat(self, chat_id, chat_guid):
+        """answer the thread if its newest message is for the agent"""
+        # this job answers whatever mention is waiting, later ones start a new trace
+        trace = self._traces.pop(chat_id, None)
+        if trace is not None:
+            metrics.observe("queue_wait_seconds", time.perf_counter() - trace["queued"])
+        if chat_id not in self._context:
+            return
+        context = self._context.get(chat_id)
+        if not context:
+            return
+        try:
+            await self._check_and_send_messages(chat_id, chat_guid, context, trace)
+        except asyncio.CancelledError:
+            # superseded, the job replacing this one answers the same mention
+            if trace is not None:
+                self._traces.setdefault(chat_id, trace)
+            raise
 
-    async def _check_and_send_messages(self, handle_id, recent_messages):
+    async def _check_and_send_messages(self, chat_id, chat_guid, context, trace=None):
         """check and send messages"""
-        most_recent_msg = recent_messages[0]["text"]
-        agent_directed = self._is_agent_directed(most_recent_msg)
-
-        if agent_directed:
-            sent_message = await self._as_utils.send_message_via_applescript(
-                handle_id, await self._client.get_msg(recent_messages)
+        if not self._needs_reply(context) or self._already_answered(chat_id, context):
+            self._supersedes.pop(chat_id, None)
+            return
+        if self._stream:
+            await self._stream_messages(chat_id, chat_guid, context, trace)
+            return
+        self._generating.add(chat_id)
+        try:
+            recalled = await self._recall(chat_id, context)
+            reply = await self._client.get_msg(
+                context, recalled, summary=self._context.summary(chat_id), chat_id=chat_id
             )
-            if sent_message:
-                self._last_sent_message = sent_message
+        finally:
+            self._generating.discard(chat_id)
+        sent_message = await self._as_utils.send_message_via_applescript(chat_guid, reply)
+        self._finish_trace(trace, sent_message)
+        if sent_message:
+            self._record_reply(chat_id, sent_message, chat_guid, context)
 
-    def _is_agent_directed(self, text):
-        """Check if text starts with or ends with the mention"""
-        return text and (text.startswith(self._mention) or text.endswith(self._mention))
+    async def _stream_messages(self, chat_id, chat_guid, context, trace=None):
+        """send each chunk of the reply as soon as the model finishes it"""
+        start = time.perf_counter()
+        timings = {}
+        # can be superseded until the first chunk goes out
+        self._generating.add(chat_id)
+        try:
+            recalled = await self._recall(chat_id, context)
+            summary = self._context.summary(chat_id)
+            async for chunk in self._client.stream_msg(context, timings, recalled, summary):
+                self._generating.discard(chat_id)
+                sent_message = await self._as_utils.send_message_via_applescript(
+                    chat_guid, chunk
+                )
+                if sent_message:
+                    if "time_to_first_message" not in timings:
+                        timings["time_to_first_message"] = time.perf_counter() - start
+                        self._finish_trace(trace, sent_message)
+                        logging.info(
+                            f"Time to first message: {timings['time_to_first_message']:.2f}s"
+                        )
+                    self._record_reply(chat_id, sent_message, chat_guid, context)
+        finally:
+            self._generating.discard(chat_id)
 
     async def _group_by(self, data, key):
         """group_by"""
         grouped_data = {}
         for entry in data:
-            handle_id = entry[key]
-            if handle_id in grouped_data:
-                grouped_data[handle_id].append(entry)
+            value = getattr(entry, key)
+            if value in grouped_data:
+                grouped_data[value].append(entry)
             else:
-                grouped_data[handle_id] = [entry]
+                grouped_data[value] = [entry]
         return grouped_data
-
-
-# Setup logging
-logging.basicConfig(level=logging.INFO)
@@ -0,0 +1,210 @@
+"""
+Metrics
+"""
+
+import asyncio
+import bisect
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+# seconds, from a fast SQL query up to a slow generation
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+class Histogram:
+    """Cumulative bucket counts plus sum and count, the Prometheus way"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """upper bound of the bucket holding the q quantile"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Metrics:
+    """
+    Counters, gauges and latency histograms for the message pipeline. Every
+    update is a dict lookup and an add, cheap enough for the idle loop;
+    nothing is formatted until an export asks for it.
+    """
+
+    def __init__(self, prefix="aim"):
+        self._prefix = prefix
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name, value):
+        self.gauges[name] = value
+
+    def observe(self, name, seconds):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+    @contextmanager
+    def span(self, name):
+        """time the block into the name_seconds histogram"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(f"{name}_seconds", time.perf_counter() - start)
+
+    def reset(self):
+        self.counters.clear()
+        self.gauges.clear()
+        self.histograms.clear()
+
+    def snapshot(self):
+        """everything as plain data, for the JSON file"""
+        return {
+            "time": time.time(),
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges),
+            "histograms": {
+                name: histogram.summary() for name, histogram in self.histograms.items()
+            },
+        }
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+        for name, value in sorted(self.counters.items()):
+            name = f"{self._prefix}_{name}"
+            lines += [f"# TYPE {name} counter", f"{name} {value}"]
+        for name, value in sorted(self.gauges.items()):
+            name = f"{self._prefix}_{name}"
+            lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+        for name, histogram in sorted(self.histograms.items()):
+            name = f"{self._prefix}_{name}"
+            lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{le="+Inf"}} {histogram.count}')
+            lines.append(f"{name}_sum {histogram.sum}")
+            lines.append(f"{name}_count {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+# shared by every module, like config
+metrics = Metrics()
+
+
+class MetricsExporter:
+    """
+    Serves metrics at http://host:metrics_port/metrics in Prometheus text
+    format and / or writes a JSON snapshot to metrics_path every
+    metrics_interval seconds. Both are off unless configured.
+    """
+
+    def __init__(self, config, registry=metrics):
+        self._metrics = registry
+        self._port = config["metrics_port"]
+        self._path = (
+            os.path.expanduser(config["metrics_path"]) if config["metrics_path"] else None
+        )
+        self._interval = config["metrics_interval"]
+        self._server = None
+
+    @property
+    def enabled(self):
+        return self._port is not None or bool(self._path)
+
+    async def start(self, host="127.0.0.1"):
+        """start the HTTP endpoint, if there is one, returns its port"""
+        if self._port is None:
+            return None
+        self._server = await asyncio.start_server(self._serve, host, self._port)
+        port = self._server.sockets[0].getsockname()[1]
+        logging.info(f"Metrics at http://{host}:{port}/metrics")
+        return port
+
+    async def _serve(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            if request_line.split(b" ")[1:2] == [b"/metrics"]:
+                status, body = "200 OK", self._metrics.render().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except (ConnectionError, IndexError):
+            pass
+        finally:
+            writer.close()
+
+    def write_snapshot(self):
+        """write the JSON snapshot atomically"""
+        os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+        tmp_path = f"{self._path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._metrics.snapshot(), f, indent=2)
+        os.replace(tmp_path, self._path)
+
+    async def run(self):
+        """background loop writing the JSON snapshot"""
+        if not self._path:
+            return
+        while True:
+            await asyncio.sleep(self._interval)
+            try:
+                self.write_snapshot()
+            except OSError as e:
+                logging.error(f"Couldn't write metrics: {e}")
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._path:
+            try:
+                self.write_snapshot()
+            except OSError:
+                pass
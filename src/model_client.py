@@ -2,8 +2,57 @@
 Model
 """
 
+import asyncio
 import logging
-from ollama import AsyncClient  # type: ignore
+import os
+import re
+import time
+
+from metrics import metrics
+from prompt_builder import PromptBuilder
+from response_cache import ResponseCache
+
+SUMMARY_PROMPT = """You keep a running summary of a text message conversation.
+Rewrite the summary so far to also cover the new messages. Keep names, plans,
+decisions, dates, open questions and anything said about "you" (the assistant).
+Write short plain sentences, no preamble, and keep it brief."""
+
+
+class ReplyChunker:
+    """
+    Splits a streamed reply into sendable chunks at sentence or paragraph
+    boundaries. Chunks shorter than min_chars are held and joined with the
+    next one so a reply doesn't turn into a flurry of tiny texts.
+    """
+
+    # a digit before the period is a list marker ("1. "), not a sentence end
+    _BOUNDARIES = {
+        "sentence": re.compile(r"(?<=[^\d\s][.!?])\s+"),
+        "paragraph": re.compile(r"\n\s*\n"),
+    }
+
+    def __init__(self, boundary="sentence", min_chars=0):
+        self._pattern = self._BOUNDARIES[boundary]
+        self._min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, text):
+        """add streamed text, returns the chunks it completed"""
+        self._buffer += text
+        chunks = []
+        start = 0
+        for match in self._pattern.finditer(self._buffer):
+            chunk = self._buffer[start : match.start()].strip()
+            if len(chunk) >= self._min_chars:
+                chunks.append(chunk)
+                start = match.end()
+        self._buffer = self._buffer[start:]
+        return chunks
+
+    def flush(self):
+        """whatever is left once the stream ends"""
+        chunk, self._buffer = self._buffer.strip(), ""
+        return chunk
 
 
 class OllamaClient:
@@ -11,8 +60,14 @@ class OllamaClient:
 
     def __init__(self, config):
         self._model = config["model"]
-        self._mention = config["mention"]
-        self._client = AsyncClient()
+        self._host = config["ollama_host"]
+        # several backends go through the router, which talks like an AsyncClient
+        self._router_config = config if config["backends"] else None
+        self._router = None
+        # created by _get_client on first use
+        self._client = None
+        self._stream_boundary = config["stream_boundary"]
+        self._stream_min_chars = config["stream_min_chars"]
         self._system_msg = f"""You are AI Messenger (get it AIM, ha!), an assistant who responds to SMS messages.
         You don't do much now other than chat, but you will have many cool features someday!
         You respond in style and format perfect for SMS / iMessage.
@@ -21,71 +76,212 @@ class OllamaClient:
         ## Bonus info:
         You are powered by a total private local LLM called {self._model}.
         """
+        self._prompt_builder = PromptBuilder(
+            self._system_msg, config["context_token_budget"]
+        )
+        # num_ctx has to stay put too, changing it makes Ollama reload the model
+        self._options = {"num_ctx": config["num_ctx"]}
+        self._summary_options = dict(self._options, num_predict=config["summary_tokens"])
+        self._keep_alive = config["keep_alive"]
+        self._health = {"model": self._model, "loaded": False}
+        self._response_cache = None
+        if config["response_cache"]:
+            self._response_cache = ResponseCache(
+                os.path.join(config["state_path"], "responses.db"),
+                max_entries=config["response_cache_size"],
+                ttl_seconds=config["response_cache_ttl"],
+                context_messages=config["response_cache_context"],
+            )
+
+    def _get_client(self):
+        """
+        The Ollama client. ollama (with httpx and pydantic) is the slowest
+        import in the app, so it isn't loaded until the client is needed.
+        """
+        if self._client is None:
+            if self._router_config is not None:
+                from model_router import ModelRouter
+
+                self._router = ModelRouter.from_config(self._router_config)
+                self._client = self._router
+            else:
+                from ollama import AsyncClient  # type: ignore
+
+                self._client = AsyncClient(host=self._host)
+        return self._client
+
+    async def load(self):
+        """create the client on a worker thread, the import doesn't stall the event loop"""
+        if self._client is None:
+            await asyncio.to_thread(self._get_client)
 
     @staticmethod
-    def _remove_substring(original_string, substring):
-        return original_string.replace(substring, "")
+    def _count_tokens(response):
+        """model token counters from a final response"""
+        metrics.inc("model_requests_total")
+        metrics.inc("model_prompt_tokens_total", response.get("prompt_eval_count") or 0)
+        metrics.inc("model_output_tokens_total", response.get("eval_count") or 0)
 
-    def _clean_text(self, text):
+    def _build_messages(self, context, recalled=(), summary=None):
         """
-        Clean up the text before sending it to the LLM
+        the chat API messages. context is the conversation oldest first,
+        cleaned and with roles assigned, recalled any older messages from
+        the history index worth showing the model, summary what came before
+        context
         """
-        return text.removeprefix(self._mention).removesuffix(self._mention).strip()
+        messages = self._prompt_builder.build(context, recalled, summary)
+        logging.info(f"Messages:\n{messages}")
+        return messages
 
-    def _format_data(self, data):
+    async def warm_up(self):
         """
-        the user / assistant paradigm isn't really setup for multi party chat
-        because the incoming message is supposed to be a user message, we work backwards
-        to create a user / assistant thread,
-        regardless of who actually sent the previous messages
-        not ideal, but the client is happy
+        Load the model (a no-op if it's already loaded) so the first reply
+        doesn't pay for it. Uses the same options as real requests, a
+        different num_ctx would make Ollama load it all over again.
         """
-        formatted_data = []
-
-        for i, entry in enumerate(data):
-            role = "user" if i % 2 == 0 else "assistant"
-            content = self._clean_text(entry["text"])
-            formatted_entry = {"role": role, "content": content}
-            formatted_data.append(formatted_entry)
+        start = time.perf_counter()
+        await self.load()
+        try:
+            response = await self._client.chat(
+                model=self._model,
+                messages=[],
+                options=self._options,
+                keep_alive=self._keep_alive,
+            )
+        except Exception as e:
+            logging.info(f"Couldn't load {self._model}: {e}")
+            self._health.update(loaded=False, error=str(e))
+            return self._health
+        self._health = {
+            "model": self._model,
+            "loaded": True,
+            "load_seconds": (response.get("load_duration") or 0) / 1e9,
+            "warm_up_seconds": time.perf_counter() - start,
+            "checked_at": time.time(),
+        }
+        logging.info(f"Model warm: {self._health}")
+        return self._health
 
-        formatted_data.reverse()
-        return formatted_data
+    async def health(self):
+        """model load state and the last measured load latency"""
+        health = dict(self._health)
+        # ps() isn't there on older ollama releases, the router's is None then too
+        ps = getattr(self._get_client(), "ps", None)
+        running = None
+        if ps is not None:
+            try:
+                running = await ps()
+            except Exception as e:
+                health.update(loaded=False, error=str(e))
+                return health
+        if running is not None:
+            names = {
+                (m.get("model") or m.get("name") or "").split(":")[0]
+                for m in running.get("models") or []
+            }
+            models = self._router.models() if self._router else {self._model}
+            health["loaded"] = {m.split(":")[0] for m in models} <= names
+        if self._router is not None:
+            health["backends"] = self._router.stats()
+        return health
 
-    def _single_msg_format(self, data):
+    async def get_msg(self, context, recalled=(), summary=None, chat_id=None):
         """
-        put everything together into a single message for response
+        get msg, from the response cache when it has the answer. Only
+        replies for a chat_id are cached, and only served again in that chat
         """
-        bldr = []
-        for d in data:
-            c = self._clean_text(d["content"])
-            if c and c not in bldr:
-                bldr.append(c)
-        chats = "\n".join(bldr).strip()
-        return chats
-
-    async def get_msg(self, msg):
-        """get msg"""
-        formatted = self._format_data(msg)
-        msg_history = self._single_msg_format(formatted[:-1])
-        formatted_msg = f"""## Conversation History:
-        {msg_history}
+        cache_key = None
+        if self._response_cache is not None and chat_id is not None:
+            cache_key = self._response_cache.key(
+                context, f"{self._model}\0{self._system_msg}\0{chat_id}"
+            )
+        if cache_key is not None:
+            cached = await self._response_cache.get(cache_key)
+            if cached is not None:
+                logging.info(f"Agent (cached): '{cached}'")
+                return cached
+        messages = self._build_messages(context, recalled, summary)
+        with metrics.span("generate"):
+            response = await self._get_client().chat(
+                model=self._model,
+                messages=messages,
+                options=self._options,
+                keep_alive=self._keep_alive,
+            )
+        self._count_tokens(response)
+        model_res = response["message"]["content"]
+        logging.info(f"Agent: '{model_res}'")
+        if cache_key is not None and model_res:
+            await self._response_cache.put(cache_key, model_res)
+        return model_res
+
+    async def summarize(self, summary, entries):
+        """
+        summary extended with entries, messages that have scrolled out of a
+        conversation's context, oldest first
         """
+        lines = "\n".join(
+            f"{'you' if e['role'] == 'assistant' else 'them'}: {e['content']}" for e in entries
+        )
+        prompt = f"Summary so far:\n{summary}\n\n" if summary else ""
         messages = [
-            {
-                "role": "system",
-                "content": self._system_msg + formatted_msg,
-            },
-            formatted[-1],
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": f"{prompt}Messages since:\n{lines}"},
         ]
-        logging.info(f"Messages:\n{messages}")
-        response = await self._client.chat(
+        with metrics.span("summarize"):
+            response = await self._get_client().chat(
+                model=self._model,
+                messages=messages,
+                options=self._summary_options,
+                keep_alive=self._keep_alive,
+            )
+        self._count_tokens(response)
+        return response["message"]["content"].strip()
+
+    def response_cache_stats(self):
+        """response cache hit / miss counters, None when it's off"""
+        return self._response_cache.stats() if self._response_cache else None
+
+    async def close(self):
+        if self._response_cache is not None:
+            await self._response_cache.close()
+        if self._router is not None:
+            await self._router.close()
+
+    async def stream_msg(self, context, timings=None, recalled=(), summary=None):
+        """
+        Stream the reply, yielding each chunk as soon as it's complete so it
+        can be sent while the rest is generated. Fills timings (if given)
+        with time_to_first_token and total seconds.
+        """
+        timings = {} if timings is None else timings
+        messages = self._build_messages(context, recalled, summary)
+        chunker = ReplyChunker(self._stream_boundary, self._stream_min_chars)
+        start = time.perf_counter()
+        stream = await self._get_client().chat(
             model=self._model,
             messages=messages,
+            stream=True,
+            options=self._options,
+            keep_alive=self._keep_alive,
         )
-        model_res = response["message"]["content"]
-        logging.info(f"Agent: '{model_res}'")
-        return model_res
-
-
-# Setup logging
-logging.basicConfig(level=logging.INFO)
+        async for part in stream:
+            content = part["message"]["content"]
+            if content and "time_to_first_token" not in timings:
+                timings["time_to_first_token"] = time.perf_counter() - start
+                metrics.observe(
+                    "time_to_first_token_seconds", timings["time_to_first_token"]
+                )
+                logging.info(
+                    f"Time to first token: {timings['time_to_first_token']:.2f}s"
+                )
+            if part.get("done"):
+                self._count_tokens(part)
+            for chunk in chunker.feed(content):
+                yield chunk
+        tail = chunker.flush()
+        if tail:
+            yield tail
+        timings["total"] = time.perf_counter() - start
+        metrics.observe("generate_seconds", timings["total"])
+        logging.info(f"Streamed reply in {timings['total']:.2f}s")
@@ -0,0 +1,248 @@
+"""
+Model router
+"""
+
+import asyncio
+import logging
+import statistics
+import time
+from collections import deque
+
+import httpx
+from ollama import AsyncClient, ResponseError  # type: ignore
+
+from metrics import metrics
+
+
+class Backend:
+    """
+    One Ollama host and the model it serves, with its own pool of
+    max_connections keep-alive connections. Tracks requests in flight, the
+    latency of the last few and when it last failed.
+    """
+
+    def __init__(self, host, model, size="large", max_connections=4, latency_samples=20):
+        self.host = host
+        self.model = model
+        self.size = size
+        self.max_connections = max_connections
+        self.client = AsyncClient(
+            host=host,
+            limits=httpx.Limits(
+                max_connections=max_connections, max_keepalive_connections=max_connections
+            ),
+        )
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.latencies = deque(maxlen=latency_samples)
+        self.down_until = 0.0
+
+    @property
+    def latency(self):
+        """median of the recent request latencies, 0 before there are any"""
+        return statistics.median(self.latencies) if self.latencies else 0.0
+
+    def available(self, now):
+        return now >= self.down_until
+
+    def load(self):
+        """what least_loaded sorts on, fullest pool last then slowest last"""
+        return (self.in_flight / self.max_connections, self.latency)
+
+    async def ps(self):
+        """AsyncClient.ps, None on ollama releases before it was added"""
+        ps = getattr(self.client, "ps", None)
+        return await ps() if ps is not None else None
+
+    async def close(self):
+        """close the connection pool, AsyncClient only has close() on newer ollama releases"""
+        close = getattr(self.client, "close", None)
+        if close is not None:
+            await close()
+        else:
+            await self.client._client.aclose()
+
+    def stats(self):
+        return {
+            "host": self.host,
+            "model": self.model,
+            "size": self.size,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "latency": self.latency,
+            "down": not self.available(time.monotonic()),
+        }
+
+
+class ModelRouter:
+    """
+    Spreads chat requests over several backends, a drop in for AsyncClient's
+    chat and ps. The policy picks the order backends are tried in:
+    "least_loaded" goes to the one with the emptiest pool, "size" sends
+    conversations whose newest message is under small_message_chars to the
+    small backends and everything else to the large ones, either falling back
+    to the other. A backend that times out, can't be reached or returns a
+    server error is skipped for cooldown seconds and the request moves on to
+    the next. The backend's own model replaces the one asked for.
+    """
+
+    POLICIES = ("least_loaded", "size")
+
+    def __init__(self, backends, policy="least_loaded", small_message_chars=80, timeout=60.0, cooldown=30.0):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown router policy {policy!r}, expected one of {self.POLICIES}")
+        self.backends = list(backends)
+        self._policy = policy
+        self._small_message_chars = small_message_chars
+        self._timeout = timeout
+        self._cooldown = cooldown
+
+    @classmethod
+    def from_config(cls, config):
+        """from the backends list in config, each a dict of Backend arguments"""
+        backends = [
+            Backend(
+                spec.get("host"),
+                spec.get("model") or config["model"],
+                spec.get("size", "large"),
+                spec.get("max_connections", 4),
+            )
+            for spec in config["backends"]
+        ]
+        return cls(
+            backends,
+            policy=config["router_policy"],
+            small_message_chars=config["small_message_chars"],
+            timeout=config["backend_timeout"],
+            cooldown=config["backend_cooldown"],
+        )
+
+    def _is_short(self, messages):
+        for message in reversed(messages):
+            if message.get("role") == "user":
+                return len(message.get("content") or "") < self._small_message_chars
+        return False
+
+    def _candidates(self, messages):
+        """backends in the order to try them"""
+        now = time.monotonic()
+        up = [b for b in self.backends if b.available(now)]
+        # when everything is cooling down, trying beats failing outright
+        candidates = sorted(up or self.backends, key=Backend.load)
+        if self._policy == "size":
+            preferred = "small" if self._is_short(messages) else "large"
+            # stable, so least loaded still decides within a size
+            candidates.sort(key=lambda b: b.size != preferred)
+        return candidates
+
+    def _failed(self, backend, error):
+        backend.failures += 1
+        metrics.inc("backend_failures_total")
+        if isinstance(error, ResponseError) and error.status_code < 500:
+            # the request, not the backend, e.g. a model it hasn't pulled
+            return
+        backend.down_until = time.monotonic() + self._cooldown
+        logging.info(f"Backend {backend.host} ({backend.model}) down for {self._cooldown}s: {error!r}")
+
+    async def chat(self, model=None, messages=None, stream=False, **kwargs):
+        """AsyncClient.chat on the first backend that answers"""
+        messages = messages or []
+        if not messages:
+            # loading a model, all of them should be
+            return await self._broadcast(kwargs)
+        if stream:
+            return self._stream(messages, kwargs)
+        # what's raised if there's no backend to try
+        error = RuntimeError("no model backend available")
+        for i, backend in enumerate(self._candidates(messages)):
+            if i:
+                metrics.inc("backend_failovers_total")
+            backend.in_flight += 1
+            backend.requests += 1
+            start = time.perf_counter()
+            try:
+                response = await asyncio.wait_for(
+                    backend.client.chat(model=backend.model, messages=messages, **kwargs),
+                    self._timeout,
+                )
+            except (asyncio.TimeoutError, ConnectionError, httpx.TransportError, ResponseError) as e:
+                self._failed(backend, e)
+                error = e
+                continue
+            finally:
+                backend.in_flight -= 1
+            backend.latencies.append(time.perf_counter() - start)
+            return response
+        raise error
+
+    async def _stream(self, messages, kwargs):
+        """
+        streaming can only fail over until the first part arrives, after
+        that the reply has been partly sent
+        """
+        # what's raised if there's no backend to try
+        error = RuntimeError("no model backend available")
+        for i, backend in enumerate(self._candidates(messages)):
+            if i:
+                metrics.inc("backend_failovers_total")
+            backend.in_flight += 1
+            backend.requests += 1
+            start = time.perf_counter()
+            try:
+                try:
+                    stream = await backend.client.chat(
+                        model=backend.model, messages=messages, stream=True, **kwargs
+                    )
+                    first = await asyncio.wait_for(anext(stream), self._timeout)
+                except (asyncio.TimeoutError, ConnectionError, httpx.TransportError, ResponseError) as e:
+                    self._failed(backend, e)
+                    error = e
+                    continue
+                yield first
+                async for part in stream:
+                    yield part
+                backend.latencies.append(time.perf_counter() - start)
+                return
+            finally:
+                backend.in_flight -= 1
+        raise error
+
+    async def _broadcast(self, kwargs):
+        """an empty chat on every backend, returns the first that worked"""
+        results = await asyncio.gather(
+            *(b.client.chat(model=b.model, messages=[], **kwargs) for b in self.backends),
+            return_exceptions=True,
+        )
+        for backend, result in zip(self.backends, results):
+            if isinstance(result, Exception):
+                self._failed(backend, result)
+        responses = [r for r in results if not isinstance(r, Exception)]
+        if not responses:
+            raise results[0] if results else RuntimeError("no model backend available")
+        return responses[0]
+
+    async def ps(self):
+        """
+        the models loaded across every reachable backend, None if none of
+        them can list their models
+        """
+        results = await asyncio.gather(*(b.ps() for b in self.backends), return_exceptions=True)
+        results = [r for r in results if r is not None]
+        if not results:
+            return None
+        responses = [r for r in results if not isinstance(r, Exception)]
+        if not responses:
+            raise results[0]
+        return {"models": [m for r in responses for m in r.get("models") or []]}
+
+    def models(self):
+        return {b.model for b in self.backends}
+
+    def stats(self):
+        """per backend load, latency and failures"""
+        return [b.stats() for b in self.backends]
+
+    async def close(self):
+        await asyncio.gather(*(b.close() for b in self.backends), return_exceptions=True)
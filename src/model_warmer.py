@@ -0,0 +1,55 @@
+"""
+Model warmer
+"""
+
+import asyncio
+import logging
+import time
+
+
+class ModelWarmer:
+    """
+    Keeps the model loaded while people are chatting. Ollama unloads a model
+    keep_alive after its last request, so while there's been chat activity in
+    the last keep_warm_seconds the model is pinged every keep_warm_interval
+    (shorter than keep_alive). New activity after a quiet spell triggers a
+    ping straight away, so loading overlaps with reading the chat.
+    """
+
+    def __init__(self, client, config):
+        self._client = client
+        self._interval = config["keep_warm_interval"]
+        self._window = config["keep_warm_seconds"]
+        # launching counts as activity
+        self._last_activity = time.monotonic()
+        self._last_warm = None
+        self._wake = asyncio.Event()
+
+    def record_activity(self):
+        """called whenever new messages arrive"""
+        now = time.monotonic()
+        self._last_activity = now
+        if self._last_warm is None or now - self._last_warm >= self._interval:
+            self._wake.set()
+
+    async def warm_up(self):
+        """load the model now"""
+        health = await self._client.warm_up()
+        if health["loaded"]:
+            self._last_warm = time.monotonic()
+        return health
+
+    async def run(self):
+        """background keep-alive loop"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self._interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if time.monotonic() - self._last_activity > self._window:
+                continue
+            try:
+                await self.warm_up()
+            except Exception as e:
+                logging.error(f"Keep-alive failed: {e}", exc_info=True)
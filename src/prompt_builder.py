@@ -0,0 +1,76 @@
+"""
+Prompt builder
+"""
+
+# rough, but close enough for llama style tokenizers on chat text
+CHARS_PER_TOKEN = 4
+# role markers and separators the chat template adds around each message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text):
+    """estimated tokens for one chat message"""
+    return len(text) // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS
+
+
+class PromptBuilder:
+    """
+    A fixed system prompt followed by the conversation as plain user /
+    assistant messages. Nothing before the newest message changes from one
+    turn to the next, so Ollama can reuse the KV cache for the whole prefix
+    and only evaluate what was added since the last request.
+
+    Older messages recalled from the history index go in a system message
+    just before the newest one, the only place they don't disturb the
+    cached prefix. They're a few short snippets and aren't counted against
+    token_budget.
+
+    A conversation's rolling summary goes right after the system prompt. It
+    only changes when the context cache trims the conversation, which moves
+    the start of the prompt anyway, and is capped at summary_tokens outside
+    token_budget.
+    """
+
+    def __init__(self, system_msg, token_budget):
+        self._system_msg = {"role": "system", "content": system_msg}
+        self._token_budget = token_budget
+
+    @staticmethod
+    def _recall_message(recalled):
+        lines = [
+            f"{'you' if r['is_from_me'] else 'them'}: {r.get('snippet') or r['text']}"
+            for r in recalled
+        ]
+        return {
+            "role": "system",
+            "content": "Possibly relevant earlier messages from this chat:\n" + "\n".join(lines),
+        }
+
+    def build(self, context, recalled=(), summary=None):
+        """
+        messages for the chat API. context is oldest first and is normally
+        already trimmed to the budget by the context cache; if it isn't, the
+        oldest entries are dropped so the request still fits
+        """
+        total = 0
+        start = len(context)
+        while start > 0:
+            tokens = context[start - 1].get("tokens") or estimate_tokens(
+                context[start - 1]["content"]
+            )
+            if total + tokens > self._token_budget and start < len(context):
+                break
+            total += tokens
+            start -= 1
+        messages = [self._system_msg]
+        if summary:
+            messages.append(
+                {"role": "system", "content": f"Summary of the conversation before this:\n{summary}"}
+            )
+        messages += [
+            {"role": entry["role"], "content": entry["content"]}
+            for entry in context[start:]
+        ]
+        if recalled:
+            messages.insert(len(messages) - 1, self._recall_message(recalled))
+        return messages
@@ -0,0 +1,140 @@
+"""
+Response cache
+"""
+
+import hashlib
+import logging
+import os
+import re
+import time
+
+import aiosqlite
+
+from metrics import metrics
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+
+
+def normalize(text):
+    """lower case, no punctuation, single spaces"""
+    return " ".join(_PUNCTUATION.sub("", text.lower()).split())
+
+
+class ResponseCache:
+    """
+    Replies keyed on the normalized newest message plus a digest of the
+    context_messages before it, so "@a what's the weather like?" and "@a
+    Whats the weather like" share an answer but "yes" only does within the
+    same exchange. Keys are scoped to a chat (and the model and system
+    prompt): a reply may draw on history further back than the key covers,
+    so it's only ever served again in the chat it was written for. Kept in a
+    small SQLite file, entries expire after ttl_seconds and the least
+    recently used go past max_entries.
+    """
+
+    def __init__(self, path, max_entries=1000, ttl_seconds=24 * 3600, context_messages=2):
+        self._path = os.path.expanduser(path)
+        self._max_entries = max_entries
+        self._ttl_seconds = ttl_seconds
+        self._context_messages = context_messages
+        self._conn = None
+        self._size = None
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, context, scope=""):
+        """cache key for a conversation, oldest first, within scope"""
+        digest = hashlib.sha256(f"{scope}\0".encode())
+        for entry in context[-(self._context_messages + 1) :]:
+            digest.update(f"{entry['role']}\0{normalize(entry['content'])}\0".encode())
+        return digest.hexdigest()
+
+    async def _get_connection(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+            self._conn = await aiosqlite.connect(self._path)
+            await self._conn.execute("PRAGMA journal_mode=WAL;")
+            await self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY, reply TEXT NOT NULL,
+                created REAL NOT NULL, last_used REAL NOT NULL);"""
+            )
+            await self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used);"
+            )
+            # anything that expired while we weren't running
+            await self._conn.execute(
+                "DELETE FROM responses WHERE created < ?;", (time.time() - self._ttl_seconds,)
+            )
+            await self._conn.commit()
+            async with self._conn.execute("SELECT COUNT(*) FROM responses;") as cursor:
+                self._size = (await cursor.fetchone())[0]
+        return self._conn
+
+    async def get(self, key):
+        """the cached reply, or None"""
+        try:
+            conn = await self._get_connection()
+            now = time.time()
+            async with conn.execute(
+                "SELECT reply FROM responses WHERE key = ? AND created >= ?;",
+                (key, now - self._ttl_seconds),
+            ) as cursor:
+                row = await cursor.fetchone()
+            if row is not None:
+                await conn.execute(
+                    "UPDATE responses SET last_used = ? WHERE key = ?;", (now, key)
+                )
+                await conn.commit()
+        except Exception as e:
+            logging.info(f"Response cache unavailable: {e}")
+            row = None
+        if row is None:
+            self.misses += 1
+            metrics.inc("response_cache_misses_total")
+            return None
+        self.hits += 1
+        metrics.inc("response_cache_hits_total")
+        return row[0]
+
+    async def put(self, key, reply):
+        """store a reply, evicting the least recently used past max_entries"""
+        try:
+            conn = await self._get_connection()
+            now = time.time()
+            await conn.execute(
+                "INSERT OR REPLACE INTO responses (key, reply, created, last_used) VALUES (?, ?, ?, ?);",
+                (key, reply, now, now),
+            )
+            self._size += 1
+            if self._size > self._max_entries:
+                # expired first, then the least recently used
+                await conn.execute(
+                    "DELETE FROM responses WHERE created < ?;", (now - self._ttl_seconds,)
+                )
+                await conn.execute(
+                    """DELETE FROM responses WHERE key IN (SELECT key FROM responses
+                    ORDER BY last_used LIMIT max(0, (SELECT COUNT(*) FROM responses) - ?));""",
+                    (self._max_entries,),
+                )
+                async with conn.execute("SELECT COUNT(*) FROM responses;") as cursor:
+                    self._size = (await cursor.fetchone())[0]
+            await conn.commit()
+        except Exception as e:
+            logging.info(f"Response cache unavailable: {e}")
+        metrics.set("response_cache_size", self._size or 0)
+
+    def stats(self):
+        """hit / miss counters"""
+        total = self.hits + self.misses
+        return {
+            "size": self._size or 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    async def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            await conn.close()
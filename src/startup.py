@@ -0,0 +1,103 @@
+"""
+Startup profile
+"""
+
+import importlib.abc
+import logging
+import os
+import sys
+import time
+
+# set to 1 to log where launch time goes
+PROFILE_ENV = "AIM_STARTUP_PROFILE"
+
+
+class _TimedLoader:
+    """wraps a module's loader to time exec_module, everything else passes through"""
+
+    def __init__(self, loader, name, times):
+        self._loader = loader
+        self._name = name
+        self._times = times
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        start = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._times[self._name] = time.perf_counter() - start
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+
+class _ImportTimer(importlib.abc.MetaPathFinder):
+    """times the first import of each top level package, submodules included"""
+
+    def __init__(self, times):
+        self._times = times
+
+    def find_spec(self, name, path, target=None):
+        if "." in name or name in self._times:
+            return None
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        # builtin and frozen modules have nothing worth timing
+        if spec.loader is None or isinstance(spec.loader, type):
+            return spec
+        self._times[name] = 0.0
+        spec.loader = _TimedLoader(spec.loader, name, self._times)
+        return spec
+
+
+class StartupProfile:
+    """
+    Launch timing: named marks measured from when this module was imported
+    (main imports it first), and with the profile on, how long each package
+    took to import, lazily loaded ones included. Off it only keeps marks.
+    """
+
+    def __init__(self, enabled=None):
+        self._start = time.perf_counter()
+        self.enabled = os.environ.get(PROFILE_ENV) == "1" if enabled is None else enabled
+        self.marks = []
+        self.imports = {}
+        self._timer = None
+        if self.enabled:
+            self._timer = _ImportTimer(self.imports)
+            sys.meta_path.insert(0, self._timer)
+
+    def mark(self, name):
+        """seconds since launch that name was reached"""
+        elapsed = time.perf_counter() - self._start
+        self.marks.append((name, elapsed))
+        if self.enabled:
+            logging.info(f"Startup: {name} at {elapsed * 1000:.1f} ms")
+        return elapsed
+
+    def report(self, top=10):
+        """log the slowest imports so far"""
+        if not self.enabled:
+            return
+        slowest = sorted(self.imports.items(), key=lambda item: item[1], reverse=True)
+        lines = [f"  {name:<24} {seconds * 1000:8.1f} ms" for name, seconds in slowest[:top]]
+        logging.info("Startup imports (slowest first):\n" + "\n".join(lines))
+
+    def stop(self):
+        """stop timing imports"""
+        if self._timer is not None and self._timer in sys.meta_path:
+            sys.meta_path.remove(self._timer)
+        self._timer = None
+
+
+# created on first import, which main does before anything heavy
+profile = StartupProfile()
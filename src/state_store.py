@@ -0,0 +1,315 @@
+"""
+State store
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+import aiosqlite
+
+from metrics import metrics
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);",
+    # replies the agent sent whose chat.db row hasn't been seen yet
+    "CREATE TABLE IF NOT EXISTS echoes (chat_id INTEGER NOT NULL, text TEXT NOT NULL, sent_at REAL NOT NULL);",
+    # chat.db rows the agent wrote, by message.guid
+    """CREATE TABLE IF NOT EXISTS sent_messages (
+    guid TEXT PRIMARY KEY, chat_id INTEGER NOT NULL, rowid INTEGER, sent_at REAL NOT NULL);""",
+    """CREATE TABLE IF NOT EXISTS chats (
+    chat_id INTEGER PRIMARY KEY, chat_guid TEXT, answered_rowid INTEGER NOT NULL DEFAULT 0,
+    replies INTEGER NOT NULL DEFAULT 0, last_reply REAL);""",
+    # each conversation's rolling summary and the newest row folded into it
+    """CREATE TABLE IF NOT EXISTS summaries (
+    chat_id INTEGER PRIMARY KEY, summary TEXT NOT NULL, through_rowid INTEGER NOT NULL);""",
+    # decoded attributedBody text, so a restart doesn't decode it all again
+    "CREATE TABLE IF NOT EXISTS decoded (rowid INTEGER PRIMARY KEY, text TEXT);",
+]
+
+
+class StateStore:
+    """
+    The agent's own state in a small SQLite file: the chat.db cursor,
+    replies sent and the rows they became, what each chat was last answered
+    up to, conversation summaries and decoded message bodies. Everything is
+    read once by open() and served from memory; changes are queued and
+    written together every flush_interval seconds by run(), in one
+    transaction, with repeated writes to the same key coalesced. Sending a
+    reply asks for a flush straight away so a crash can't make the agent
+    answer twice. A reply whose row hasn't turned up within echo_ttl seconds
+    never will, it's forgotten so it can't claim a later message.
+    """
+
+    def __init__(
+        self,
+        path,
+        flush_interval=1.0,
+        max_sent=10000,
+        max_decoded=4096,
+        echo_ttl=600,
+        max_echoes=256,
+    ):
+        self._path = os.path.expanduser(path)
+        self._flush_interval = flush_interval
+        self._max_sent = max_sent
+        self._max_decoded = max_decoded
+        self._echo_ttl = echo_ttl
+        self._max_echoes = max_echoes
+        self._conn = None
+        self._meta = {}
+        self._chats = {}
+        self._summaries = {}
+        # (chat_id, text, sent_at), oldest first
+        self._echoes = []
+        self._decoded = []
+        self.sent_guids = set()
+        # queued writes: coalesced by key, or in order for the rest
+        self._pending_meta = {}
+        self._pending_chats = {}
+        self._pending_summaries = {}
+        self._pending_ops = []
+        self._urgent = asyncio.Event()
+        self.writes = 0
+        self.rows_written = 0
+        self.flushes = 0
+
+    async def open(self):
+        """create the file if needed and load what's in it"""
+        os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+        self._conn = await aiosqlite.connect(self._path)
+        await self._conn.execute("PRAGMA journal_mode=WAL;")
+        # a crash can lose the last commit but never corrupts the file
+        await self._conn.execute("PRAGMA synchronous=NORMAL;")
+        for statement in _SCHEMA:
+            await self._conn.execute(statement)
+        await self._conn.commit()
+        self._meta = dict(await self._conn.execute_fetchall("SELECT key, value FROM meta;"))
+        self._chats = {
+            row[0]: {"chat_guid": row[1], "answered_rowid": row[2], "replies": row[3], "last_reply": row[4]}
+            for row in await self._conn.execute_fetchall(
+                "SELECT chat_id, chat_guid, answered_rowid, replies, last_reply FROM chats;"
+            )
+        }
+        self._summaries = {
+            row[0]: (row[1], row[2])
+            for row in await self._conn.execute_fetchall(
+                "SELECT chat_id, summary, through_rowid FROM summaries;"
+            )
+        }
+        await self._trim()
+        self._echoes = list(
+            await self._conn.execute_fetchall(
+                "SELECT chat_id, text, sent_at FROM echoes WHERE sent_at >= ? ORDER BY rowid;",
+                (time.time() - self._echo_ttl,),
+            )
+        )[-self._max_echoes :]
+        self.sent_guids = {
+            row[0] for row in await self._conn.execute_fetchall("SELECT guid FROM sent_messages;")
+        }
+        self._decoded = list(
+            await self._conn.execute_fetchall(
+                "SELECT rowid, text FROM decoded ORDER BY rowid DESC LIMIT ?;", (self._max_decoded,)
+            )
+        )
+        logging.info(
+            f"State: cursor {self._meta.get('cursor')}, {len(self._chats)} chats, "
+            f"{len(self._echoes)} replies pending, {len(self._decoded)} decoded bodies"
+        )
+        return self
+
+    def _queued(self, rows=1):
+        self.writes += rows
+        metrics.inc("state_writes_total", rows)
+
+    def get(self, key, default=None):
+        """a value set with set()"""
+        return self._meta.get(key, default)
+
+    def set(self, key, value):
+        """queue a value, only the last one set before a flush is written"""
+        self._meta[key] = value
+        self._pending_meta[key] = value
+        self._queued()
+
+    def chat(self, chat_id):
+        """per chat metadata, {} for a chat never answered"""
+        return self._chats.get(chat_id, {})
+
+    def record_reply(self, chat_id, chat_guid, text, answered_rowid):
+        """a reply was sent that answers everything up to answered_rowid"""
+        chat = self._chats.setdefault(chat_id, {"answered_rowid": 0, "replies": 0})
+        chat["chat_guid"] = chat_guid
+        chat["answered_rowid"] = max(chat["answered_rowid"], answered_rowid or 0)
+        chat["replies"] += 1
+        chat["last_reply"] = time.time()
+        self._pending_chats[chat_id] = dict(chat)
+        self._echoes.append((chat_id, text, chat["last_reply"]))
+        self._expire_echoes()
+        self._pending_ops.append(
+            (
+                "INSERT INTO echoes (chat_id, text, sent_at) VALUES (?, ?, ?);",
+                (chat_id, text, chat["last_reply"]),
+            )
+        )
+        self._queued(2)
+        self._urgent.set()
+
+    def summary(self, chat_id):
+        """(summary, newest rowid it covers), (None, 0) for a chat without one"""
+        return self._summaries.get(chat_id, (None, 0))
+
+    def set_summary(self, chat_id, summary, through_rowid):
+        self._summaries[chat_id] = (summary, through_rowid)
+        self._pending_summaries[chat_id] = (summary, through_rowid)
+        self._queued()
+
+    def _expire_echoes(self):
+        """drop echoes past echo_ttl, and the oldest past max_echoes"""
+        cutoff = time.time() - self._echo_ttl
+        self._echoes = [e for e in self._echoes[-self._max_echoes :] if e[2] >= cutoff]
+
+    def echoes(self):
+        """(chat_id, text) of recent replies whose chat.db row hasn't been claimed, oldest first"""
+        self._expire_echoes()
+        return [(chat_id, text) for chat_id, text, _ in self._echoes]
+
+    def claim_echo(self, chat_id, text, guid, rowid):
+        """the reply's row turned up in chat.db"""
+        for i, (echo_chat_id, echo_text, _) in enumerate(self._echoes):
+            if echo_chat_id == chat_id and echo_text == text:
+                del self._echoes[i]
+                break
+        self.sent_guids.add(guid)
+        self._pending_ops.append(
+            (
+                """DELETE FROM echoes WHERE rowid =
+                (SELECT rowid FROM echoes WHERE chat_id = ? AND text = ? ORDER BY rowid LIMIT 1);""",
+                (chat_id, text),
+            )
+        )
+        self._pending_ops.append(
+            (
+                "INSERT OR REPLACE INTO sent_messages (guid, chat_id, rowid, sent_at) VALUES (?, ?, ?, ?);",
+                (guid, chat_id, rowid, time.time()),
+            )
+        )
+        self._queued(2)
+
+    def decoded(self):
+        """(rowid, text) of the most recently stored decoded bodies, newest first"""
+        return list(self._decoded)
+
+    def add_decoded(self, rowid, text):
+        self._pending_ops.append(
+            ("INSERT OR REPLACE INTO decoded (rowid, text) VALUES (?, ?);", (rowid, text))
+        )
+        self._queued()
+
+    def pending(self):
+        """writes waiting for the next flush"""
+        return (
+            len(self._pending_meta)
+            + len(self._pending_chats)
+            + len(self._pending_summaries)
+            + len(self._pending_ops)
+        )
+
+    async def flush(self):
+        """write everything queued in one transaction"""
+        if not self.pending() or self._conn is None:
+            return 0
+        meta, self._pending_meta = self._pending_meta, {}
+        chats, self._pending_chats = self._pending_chats, {}
+        summaries, self._pending_summaries = self._pending_summaries, {}
+        ops, self._pending_ops = self._pending_ops, []
+        rows = len(meta) + len(chats) + len(summaries) + len(ops)
+        start = time.perf_counter()
+        try:
+            await self._conn.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?);", meta.items()
+            )
+            await self._conn.executemany(
+                """INSERT OR REPLACE INTO chats (chat_id, chat_guid, answered_rowid, replies, last_reply)
+                VALUES (?, ?, ?, ?, ?);""",
+                [
+                    (chat_id, c["chat_guid"], c["answered_rowid"], c["replies"], c["last_reply"])
+                    for chat_id, c in chats.items()
+                ],
+            )
+            await self._conn.executemany(
+                "INSERT OR REPLACE INTO summaries (chat_id, summary, through_rowid) VALUES (?, ?, ?);",
+                [(chat_id, text, rowid) for chat_id, (text, rowid) in summaries.items()],
+            )
+            for statement, params in ops:
+                await self._conn.execute(statement, params)
+            await self._conn.commit()
+        except Exception as e:
+            logging.info(f"Couldn't save state, will retry: {e}")
+            await self._conn.rollback()
+            self._pending_meta = {**meta, **self._pending_meta}
+            self._pending_chats = {**chats, **self._pending_chats}
+            self._pending_summaries = {**summaries, **self._pending_summaries}
+            self._pending_ops = ops + self._pending_ops
+            return 0
+        self.rows_written += rows
+        self.flushes += 1
+        metrics.inc("state_rows_written_total", rows)
+        metrics.inc("state_flushes_total")
+        metrics.observe("state_flush_seconds", time.perf_counter() - start)
+        return rows
+
+    async def _trim(self):
+        """keep the echoes, sent and decoded tables bounded, best effort"""
+        try:
+            await self._conn.execute(
+                "DELETE FROM echoes WHERE sent_at < ?;", (time.time() - self._echo_ttl,)
+            )
+            await self._conn.execute(
+                """DELETE FROM echoes WHERE rowid NOT IN
+                (SELECT rowid FROM echoes ORDER BY rowid DESC LIMIT ?);""",
+                (self._max_echoes,),
+            )
+            await self._conn.execute(
+                """DELETE FROM sent_messages WHERE guid NOT IN
+                (SELECT guid FROM sent_messages ORDER BY sent_at DESC LIMIT ?);""",
+                (self._max_sent,),
+            )
+            await self._conn.execute(
+                """DELETE FROM decoded WHERE rowid NOT IN
+                (SELECT rowid FROM decoded ORDER BY rowid DESC LIMIT ?);""",
+                (self._max_decoded,),
+            )
+            await self._conn.commit()
+        except Exception as e:
+            logging.info(f"Couldn't trim state: {e}")
+
+    async def run(self):
+        """flush every flush_interval seconds, straight away after a reply"""
+        while True:
+            try:
+                await asyncio.wait_for(self._urgent.wait(), self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._urgent.clear()
+            if await self.flush() and self.flushes % 256 == 0:
+                await self._trim()
+
+    def stats(self):
+        """queued writes against rows and transactions that reached disk"""
+        return {
+            "writes": self.writes,
+            "rows_written": self.rows_written,
+            "flushes": self.flushes,
+            "pending": self.pending(),
+        }
+
+    async def close(self):
+        """flush what's queued and close"""
+        if self._conn is None:
+            return
+        await self.flush()
+        await self._trim()
+        conn, self._conn = self._conn, None
+        await conn.close()
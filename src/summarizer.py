@@ -0,0 +1,86 @@
+"""
+Conversation summarizer
+"""
+
+import asyncio
+import logging
+import time
+
+from metrics import metrics
+
+
+class ConversationSummarizer:
+    """
+    Folds messages that fall out of a conversation's context into a rolling
+    summary, so the prompt carries the summary and the last max_chat_items
+    messages rather than the whole conversation. It only runs once chat has
+    been quiet for summary_idle_seconds and nothing is being answered, one
+    conversation at a time, and each pass adds the newly trimmed messages to
+    the previous summary instead of starting over. New activity cancels a
+    pass in flight; the trimmed messages stay queued for the next one.
+    """
+
+    def __init__(self, client, context, config, state=None, busy=None):
+        self._client = client
+        self._context = context
+        self._state = state
+        self._busy = busy or (lambda: False)
+        self._idle = config["summary_idle_seconds"]
+        self._last_activity = time.monotonic()
+        self._task = None
+        self._wake = asyncio.Event()
+
+    def record_activity(self):
+        """called whenever new messages arrive"""
+        self._last_activity = time.monotonic()
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        self._wake.set()
+
+    async def summarize(self, key):
+        """fold key's trimmed messages into its summary, returns the new one"""
+        summary, entries = self._context.pending_summary(key)
+        if not entries:
+            return summary
+        summary = await self._client.summarize(summary, entries)
+        through_rowid = self._context.set_summary(key, summary, len(entries))
+        if through_rowid is None:
+            return summary
+        if self._state is not None:
+            self._state.set_summary(key, summary, through_rowid)
+        metrics.inc("summaries_total")
+        logging.info(f"Summarized {len(entries)} messages of chat {key}")
+        return summary
+
+    async def run(self):
+        """background loop summarizing while idle"""
+        while True:
+            # until idle_seconds after the last activity, then poll while busy
+            wait = self._idle - (time.monotonic() - self._last_activity)
+            try:
+                await asyncio.wait_for(self._wake.wait(), max(wait, min(self._idle, 1.0)))
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if time.monotonic() - self._last_activity < self._idle or self._busy():
+                continue
+            pending = self._context.needs_summary()
+            if not pending:
+                # nothing to do until something new arrives
+                await self._wake.wait()
+                continue
+            self._task = asyncio.create_task(self.summarize(pending[0]))
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                # run() itself is being cancelled, not just the pass
+                if asyncio.current_task().cancelling():
+                    self._task.cancel()
+                    raise
+                metrics.inc("summaries_cancelled_total")
+            except Exception as e:
+                logging.error(f"Summary failed: {e}", exc_info=True)
+                # don't retry a failing model in a tight loop
+                self._last_activity = time.monotonic()
+            finally:
+                self._task = None
@@ -1,25 +1,47 @@
 """ Apple Script Tests """
 
+import os
 import sys
+import json
+import asyncio
+import tempfile
 from pathlib import Path
 import unittest
-from unittest.mock import patch, Mock
 
 # Add the src directory to the sys.path
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
 
 from apple_script_messenger import AppleScriptMessenger  # type: ignore
 
+STUB_HELPER = str(Path(__file__).resolve().parent / "stub_send_helper.py")
+
 
 class TestAppleScriptMessenger(unittest.IsolatedAsyncioTestCase):
     """Test class for AppleScriptMessenger"""
 
-    @patch("subprocess.run")
-    async def test_send_detailed_message(self, mock_subprocess_run):
+    async def asyncSetUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.log_path = os.path.join(self.test_dir.name, "sent.jsonl")
+
+    async def asyncTearDown(self):
+        self.test_dir.cleanup()
+
+    def _messenger(self, *args, **kwargs):
+        messenger = AppleScriptMessenger(
+            [sys.executable, STUB_HELPER, "--log", self.log_path, *args], **kwargs
+        )
+        self.addAsyncCleanup(messenger.close)
+        return messenger
+
+    def _sent(self):
+        with open(self.log_path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    async def test_send_detailed_message(self):
         """Test sending a detailed message using AppleScriptMessenger"""
 
         # Arrange
-        messenger = AppleScriptMessenger()
+        messenger = self._messenger()
         recipient = "test@example.com"
         message = """Here's a simple yet delicious pizza recipe:
 
@@ -57,19 +79,82 @@ class TestAppleScriptMessenger(unittest.IsolatedAsyncioTestCase):
 
         Feel free to get creative and make it your own!"""
 
-        mock_subprocess_run.return_value = Mock(stdout="Message sent")
-
         # Act
         result = await messenger.send_message_via_applescript(recipient, message)
 
         # Assert
-        mock_subprocess_run.assert_called_once_with(
-            ["osascript", "-e", messenger.get_template(), message, recipient],
-            check=True,
-            text=True,
-            capture_output=True,
-        )
         self.assertEqual(result, message)
+        self.assertEqual(self._sent(), [{"recipient": recipient, "message": message}])
+
+    async def test_helper_is_reused(self):
+        messenger = self._messenger()
+        await messenger.send_message_via_applescript("a@example.com", "one")
+        helper = messenger._process
+        await messenger.send_message_via_applescript("a@example.com", "two")
+        self.assertIs(messenger._process, helper)
+
+    async def test_order_is_kept_per_recipient(self):
+        messenger = self._messenger("--delay", "0.01")
+        sends = [
+            messenger.send_message_via_applescript(recipient, f"{recipient} {i}")
+            for i in range(5)
+            for recipient in ("a@example.com", "b@example.com")
+        ]
+        await asyncio.gather(*sends)
+
+        for recipient in ("a@example.com", "b@example.com"):
+            sent = [m["message"] for m in self._sent() if m["recipient"] == recipient]
+            self.assertEqual(sent, [f"{recipient} {i}" for i in range(5)])
+
+    async def test_unreachable_helper_is_retried(self):
+        messenger = self._messenger(retries=1)
+        get_helper = messenger._get_helper
+        spawns = 0
+
+        async def flaky_helper():
+            nonlocal spawns
+            spawns += 1
+            if spawns == 1:
+                raise BrokenPipeError("helper gone")
+            return await get_helper()
+
+        messenger._get_helper = flaky_helper
+        result = await messenger.send_message_via_applescript("a@example.com", "hi")
+        self.assertEqual(result, "hi")
+        self.assertEqual(spawns, 2)
+        self.assertEqual(len(self._sent()), 1)
+
+    async def test_refused_send_is_not_retried(self):
+        messenger = self._messenger("--fail-first", "1", retries=2)
+        result = await messenger.send_message_via_applescript("a@example.com", "hi")
+        self.assertIsNone(result)
+        # the helper is still good for the next one
+        result = await messenger.send_message_via_applescript("a@example.com", "again")
+        self.assertEqual(result, "again")
+        self.assertEqual(self._sent(), [{"recipient": "a@example.com", "message": "again"}])
+
+    async def test_stalled_send_is_not_retried(self):
+        messenger = self._messenger("--stall", retries=2, timeout=0.2)
+        result = await messenger.send_message_via_applescript("a@example.com", "hi")
+        self.assertIsNone(result)
+        self.assertEqual(len(self._sent()), 1)
+        # the stalled helper was stopped
+        self.assertIsNone(messenger._process)
+
+    async def test_send_does_not_block_the_loop(self):
+        messenger = self._messenger("--delay", "0.3")
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.create_task(tick())
+        await messenger.send_message_via_applescript("a@example.com", "hi")
+        ticker.cancel()
+        self.assertGreater(ticks, 10)
 
 
 if __name__ == "__main__":
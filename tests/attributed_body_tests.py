@@ -0,0 +1,77 @@
+""" attributedBody decoding tests """
+
+import sys
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+# Add the src directory to the sys.path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from typedstream import unarchive_from_data  # type: ignore
+
+from attributed_body import (  # type: ignore
+    DecodeCache,
+    decode_attributed_body,
+    decode_many,
+    fast_extract_text,
+)
+from chat_db_factory import make_attributed_body
+
+
+class TestFastExtract(unittest.TestCase):
+    """Test class for fast_extract_text"""
+
+    def test_matches_full_decoder(self):
+        for text in ["hi", "@a what's up", "x" * 200, "héllo 👋", "y" * 40000]:
+            blob = make_attributed_body(text)
+            self.assertEqual(unarchive_from_data(blob).contents[0].value.value, text)
+            self.assertEqual(fast_extract_text(blob), text)
+
+    def test_plain_nsstring_archive(self):
+        blob = b"\x04\x0bstreamtyped\x81\xe8\x03\x84\x01@\x84\x84\x84\x08NSString\x01\x84\x84\x08NSObject\x00\x85\x84\x01+\x0cstring value\x86"
+        self.assertEqual(fast_extract_text(blob), "string value")
+
+    def test_unrecognised_archives_fall_back(self):
+        self.assertIsNone(fast_extract_text(b"\x04\x0bstreamtyped"))
+        # truncated payload
+        blob = make_attributed_body("hello")
+        self.assertIsNone(fast_extract_text(blob[: blob.find(b"hello") + 3]))
+
+    @patch("attributed_body.unarchive_from_data")
+    def test_full_decoder_only_when_needed(self, mock_unarchive):
+        self.assertEqual(decode_attributed_body(make_attributed_body("hi")), "hi")
+        mock_unarchive.assert_not_called()
+
+
+class TestDecodeCache(unittest.TestCase):
+    """Test class for DecodeCache"""
+
+    def test_hits_and_misses(self):
+        cache = DecodeCache(max_size=10)
+        self.assertEqual(cache.lookup(1), (False, None))
+        cache.store(1, "hello")
+        self.assertEqual(cache.lookup(1), (True, "hello"))
+        self.assertEqual(cache.stats(), {"size": 1, "hits": 1, "misses": 1, "hit_rate": 0.5})
+
+    def test_evicts_least_recently_used(self):
+        cache = DecodeCache(max_size=2)
+        cache.store(1, "one")
+        cache.store(2, "two")
+        cache.lookup(1)  # touch 1, so 2 is the oldest
+        cache.store(3, "three")
+        self.assertEqual(cache.stats()["size"], 2)
+        self.assertEqual(cache.lookup(1), (True, "one"))
+        self.assertEqual(cache.lookup(2), (False, None))
+
+    def test_undecodable_blob_is_cached_as_none(self):
+        # what DatabaseManager.decode stores for a blob that won't decode
+        (text, _), = decode_many([b"garbage"])
+        self.assertIsNone(text)
+        cache = DecodeCache()
+        cache.store(1, text)
+        self.assertEqual(cache.lookup(1), (True, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,261 @@
+"""
+Builders for chat.db test data
+"""
+
+import itertools
+import random
+import sqlite3
+import time
+
+
+def _typedstream_int(value):
+    """typedstream integer encoding"""
+    if 0 <= value < 0x80:
+        return bytes([value])
+    if value < 0x8000:
+        return b"\x81" + value.to_bytes(2, "little")
+    return b"\x82" + value.to_bytes(4, "little")
+
+
+def make_attributed_body(text):
+    """an NSAttributedString archive laid out the way Messages writes them"""
+    raw = text.encode("utf-8")
+    length = _typedstream_int(len(raw))
+    return (
+        b"\x04\x0bstreamtyped\x81\xe8\x03\x84\x01@\x84\x84\x84\x12NSAttributedString\x00"
+        b"\x84\x84\x08NSObject\x00\x85\x92\x84\x84\x84\x08NSString\x01\x94\x84\x01+"
+        + length
+        + raw
+        + b"\x86\x84\x02iI\x01"
+        + _typedstream_int(len(text))
+        + b"\x92\x84\x84\x84\x0cNSDictionary\x00\x94\x84\x01i\x01\x92\x84\x96\x96"
+        b"\x1d__kIMMessagePartAttributeName\x86\x92\x84\x84\x84\x08NSNumber\x00"
+        b"\x84\x84\x07NSValue\x00\x94\x84\x01*\x84\x99\x99\x00\x86\x86\x86"
+    )
+
+
+# the parts of the Messages schema the agent touches, columns and indexes as
+# macOS creates them
+SCHEMA = """
+CREATE TABLE handle (
+    ROWID INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE,
+    id TEXT NOT NULL,
+    country TEXT,
+    service TEXT NOT NULL,
+    uncanonicalized_id TEXT,
+    person_centric_id TEXT,
+    UNIQUE (id, service)
+);
+CREATE TABLE chat (
+    ROWID INTEGER PRIMARY KEY AUTOINCREMENT,
+    guid TEXT UNIQUE NOT NULL,
+    style INTEGER,
+    state INTEGER,
+    account_id TEXT,
+    chat_identifier TEXT,
+    service_name TEXT,
+    room_name TEXT,
+    display_name TEXT,
+    last_read_message_timestamp INTEGER DEFAULT 0
+);
+CREATE TABLE message (
+    ROWID INTEGER PRIMARY KEY AUTOINCREMENT,
+    guid TEXT UNIQUE NOT NULL,
+    text TEXT,
+    handle_id INTEGER DEFAULT 0,
+    service TEXT,
+    attributedBody BLOB,
+    date INTEGER,
+    date_read INTEGER,
+    date_delivered INTEGER,
+    is_delivered INTEGER DEFAULT 0,
+    is_finished INTEGER DEFAULT 0,
+    is_from_me INTEGER DEFAULT 0,
+    is_read INTEGER DEFAULT 0,
+    is_sent INTEGER DEFAULT 0,
+    cache_roomnames TEXT,
+    item_type INTEGER DEFAULT 0,
+    associated_message_type INTEGER DEFAULT 0,
+    other_handle INTEGER DEFAULT 0
+);
+CREATE TABLE chat_handle_join (
+    chat_id INTEGER REFERENCES chat (ROWID) ON DELETE CASCADE,
+    handle_id INTEGER REFERENCES handle (ROWID) ON DELETE CASCADE,
+    UNIQUE (chat_id, handle_id)
+);
+CREATE TABLE chat_message_join (
+    chat_id INTEGER REFERENCES chat (ROWID) ON DELETE CASCADE,
+    message_id INTEGER REFERENCES message (ROWID) ON DELETE CASCADE,
+    message_date INTEGER DEFAULT 0,
+    PRIMARY KEY (chat_id, message_id)
+);
+CREATE INDEX message_idx_handle ON message(handle_id, date);
+CREATE INDEX message_idx_handle_id ON message(handle_id);
+CREATE INDEX message_idx_is_read ON message(is_read, is_from_me, is_finished);
+CREATE INDEX message_idx_other_handle ON message(other_handle);
+CREATE INDEX chat_message_join_idx_message_date_id_chat_id ON chat_message_join(chat_id, message_date, message_id);
+CREATE INDEX chat_message_join_idx_message_id_only ON chat_message_join(message_id);
+CREATE INDEX chat_handle_join_idx_handle_id ON chat_handle_join(handle_id);
+"""
+
+# seconds between 1970-01-01 and 2001-01-01, message.date counts from the latter
+APPLE_EPOCH = 978307200
+
+WORDS = (
+    "hey ok lol sure dinner tonight tomorrow maybe what time works for me "
+    "sounds good see you there running late on my way haha yes no thanks "
+    "did you see that game weekend plans coffee later call me"
+).split()
+
+
+def apple_time_ns(unix_seconds):
+    """message.date for a unix timestamp"""
+    return int((unix_seconds - APPLE_EPOCH) * 1000000000)
+
+
+class ChatDbWriter:
+    """
+    Writes messages the way Messages does: one transaction per message
+    inserting into message and chat_message_join, through a WAL connection
+    that stays open.
+    """
+
+    def __init__(self, path, seed=0):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.rng = random.Random(seed)
+        self._guid = itertools.count(1)
+        self.handles = []  # handle.id strings
+        self.chats = []  # (chat ROWID, chat guid, [handle ROWIDs])
+
+    def create_schema(self):
+        self.conn.executescript(SCHEMA)
+
+    def add_handles(self, count):
+        start = len(self.handles)
+        ids = [f"+1555{i:07d}" for i in range(start, start + count)]
+        self.conn.executemany(
+            "INSERT INTO handle (id, country, service, uncanonicalized_id) VALUES (?, 'us', 'iMessage', ?);",
+            ((handle_id, handle_id) for handle_id in ids),
+        )
+        self.handles.extend(ids)
+        self.conn.commit()
+
+    def add_chat(self, handle_rowids, display_name=None):
+        group = len(handle_rowids) > 1
+        guid = f"iMessage;{'+' if group else '-'};" + (
+            f"chat{self.rng.getrandbits(60)}" if group else self.handles[handle_rowids[0] - 1]
+        )
+        cursor = self.conn.execute(
+            "INSERT INTO chat (guid, style, state, account_id, chat_identifier, service_name, display_name) VALUES (?, ?, 3, 'A', ?, 'iMessage', ?);",
+            (guid, 43 if group else 45, guid.split(";")[-1], display_name),
+        )
+        chat_rowid = cursor.lastrowid
+        self.conn.executemany(
+            "INSERT INTO chat_handle_join (chat_id, handle_id) VALUES (?, ?);",
+            ((chat_rowid, h) for h in handle_rowids),
+        )
+        self.chats.append((chat_rowid, guid, list(handle_rowids)))
+        self.conn.commit()
+        return chat_rowid
+
+    def random_text(self, min_words=1, max_words=25):
+        return " ".join(self.rng.choices(WORDS, k=self.rng.randint(min_words, max_words)))
+
+    def _row(self, chat, text, is_from_me, sender, unix_seconds, attributed):
+        chat_rowid, chat_guid, handle_rowids = chat
+        date = apple_time_ns(unix_seconds)
+        if sender is None:
+            sender = handle_rowids[0] if len(handle_rowids) == 1 else 0
+        # newer macOS leaves text NULL and only fills attributedBody
+        body = make_attributed_body(text) if attributed else None
+        return (
+            f"{next(self._guid):08X}-0000-0000-0000-{self.rng.getrandbits(48):012X}",
+            None if attributed else text,
+            0 if is_from_me and len(handle_rowids) > 1 else sender,
+            body,
+            date,
+            date if not is_from_me else 0,
+            date,
+            is_from_me,
+            chat_guid.split(";")[-1] if len(handle_rowids) > 1 else None,
+        ), chat_rowid, date
+
+    def insert_messages(self, rows):
+        """rows of (chat, text, is_from_me, sender handle ROWID or None, unix seconds, attributed)"""
+        for row in rows:
+            values, chat_rowid, date = self._row(*row)
+            cursor = self.conn.execute(
+                """INSERT INTO message (guid, text, handle_id, attributedBody, date, date_read,
+                date_delivered, is_from_me, cache_roomnames, service, is_delivered, is_finished,
+                is_read, is_sent) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'iMessage', 1, 1, 1, 1);""",
+                values,
+            )
+            self.conn.execute(
+                "INSERT INTO chat_message_join (chat_id, message_id, message_date) VALUES (?, ?, ?);",
+                (chat_rowid, cursor.lastrowid, date),
+            )
+
+    def send(self, chat, text, is_from_me=0, sender=None, attributed=True):
+        """one live message in its own transaction, returns its ROWID"""
+        with self.conn:
+            self.insert_messages([(chat, text, is_from_me, sender, time.time(), attributed)])
+        return self.conn.execute("SELECT MAX(ROWID) FROM message;").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+def build_chat_db(
+    path,
+    messages,
+    handles=200,
+    chats=150,
+    group_fraction=0.2,
+    attributed_fraction=0.7,
+    days=3 * 365,
+    seed=0,
+    batch_size=50000,
+):
+    """
+    A chat.db with messages spread over days of history, returns the open
+    ChatDbWriter (keep it open, it holds the WAL like Messages does).
+    """
+    writer = ChatDbWriter(path, seed)
+    writer.create_schema()
+    writer.add_handles(handles)
+    rng = writer.rng
+    # one 1:1 chat per handle at most, like Messages
+    direct = iter(rng.sample(range(1, handles + 1), handles))
+    for _ in range(chats):
+        member = next(direct, None)
+        if member is None or rng.random() < group_fraction:
+            members = rng.sample(range(1, handles + 1), min(handles, rng.randint(2, 8)))
+        else:
+            members = [member]
+        writer.add_chat(members)
+
+    start = time.time() - days * 86400
+    step = days * 86400 / max(messages, 1)
+    # chat activity is skewed, a few threads get most of the traffic
+    weights = [1 / (i + 1) for i in range(len(writer.chats))]
+    for offset in range(0, messages, batch_size):
+        rows = []
+        for i in range(offset, min(offset + batch_size, messages)):
+            chat = rng.choices(writer.chats, weights)[0]
+            is_from_me = int(rng.random() < 0.4)
+            sender = None if is_from_me else rng.choice(chat[2])
+            rows.append(
+                (
+                    chat,
+                    writer.random_text(),
+                    is_from_me,
+                    sender,
+                    start + i * step,
+                    rng.random() < attributed_fraction,
+                )
+            )
+        with writer.conn:
+            writer.insert_messages(rows)
+    return writer
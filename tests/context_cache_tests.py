@@ -0,0 +1,114 @@
+""" Conversation context cache tests """
+
+import sys
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+# Add the src directory to the sys.path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from context_cache import ConversationContextCache  # type: ignore
+from message import Message  # type: ignore
+
+
+def row(rowid, text, is_from_me=0):
+    return Message(rowid, f"MSG-{rowid}", 1, "iMessage;-;+15550001", "+15550001", text, is_from_me)
+
+
+class TestConversationContextCache(unittest.TestCase):
+    """Test class for ConversationContextCache"""
+
+    def test_load_cleans_and_assigns_roles(self):
+        cache = ConversationContextCache(10, "@a")
+        # newest first, like get_latest_messages_for_chat
+        cache.load(
+            "chat",
+            [row(3, "@a and now?"), row(2, "sure thing", 1), row(1, "@a hi")],
+            sent_messages=["sure thing"],
+        )
+        context = cache.get("chat")
+        self.assertEqual(
+            [(e["role"], e["content"], e["agent_directed"]) for e in context],
+            [("user", "hi", True), ("assistant", "sure thing", False), ("user", "and now?", True)],
+        )
+
+    def test_append_is_incremental_and_skips_seen_rows(self):
+        cache = ConversationContextCache(10, "@a")
+        cache.load("chat", [row(2, "two"), row(1, "one")])
+        cache.append("chat", row(2, "two"))
+        cache.append("chat", row(3, "three"))
+        cache.add_reply("chat", "reply")
+        cache.append("chat", row(4, "four @a"))
+        self.assertEqual(
+            [e["content"] for e in cache.get("chat")],
+            ["one", "two", "three", "reply", "four"],
+        )
+
+    def test_trims_in_chunks_so_the_prefix_is_stable(self):
+        cache = ConversationContextCache(6, "@a")
+        cache.load("chat", [])
+        firsts = []
+        for rowid in range(1, 13):
+            cache.append("chat", row(rowid, f"m{rowid}"))
+            firsts.append(cache.get("chat")[0]["content"])
+        # cut back to half when the cap is passed, not one at a time
+        self.assertEqual(
+            firsts,
+            ["m1"] * 6 + ["m5"] * 4 + ["m9"] * 2,
+        )
+
+    def test_trimmed_entries_wait_for_the_summary(self):
+        cache = ConversationContextCache(6, "@a", keep_trimmed=True)
+        cache.load("chat", [])
+        for rowid in range(1, 8):
+            cache.append("chat", row(rowid, f"m{rowid}"))
+        self.assertEqual(cache.needs_summary(), ["chat"])
+        summary, trimmed = cache.pending_summary("chat")
+        self.assertIsNone(summary)
+        self.assertEqual([e["content"] for e in trimmed], ["m1", "m2", "m3", "m4"])
+
+        # trimmed while the summary was being written, kept for the next one
+        for rowid in range(8, 12):
+            cache.append("chat", row(rowid, f"m{rowid}"))
+        self.assertEqual(cache.set_summary("chat", "m1 to m4", len(trimmed)), 4)
+        self.assertEqual(cache.summary("chat"), "m1 to m4")
+        self.assertEqual(
+            [e["content"] for e in cache.pending_summary("chat")[1]], ["m5", "m6", "m7", "m8"]
+        )
+
+        # a cold load leaves out what the summary covers
+        rows = [row(rowid, f"m{rowid}") for rowid in range(6, 0, -1)]
+        cache.load("chat", rows, summary="s", summary_rowid=4)
+        self.assertEqual([e["content"] for e in cache.get("chat")], ["m5", "m6"])
+        self.assertEqual(cache.summary("chat"), "s")
+        self.assertEqual(cache.needs_summary(), [])
+
+    def test_trims_to_token_budget(self):
+        cache = ConversationContextCache(100, "@a", token_budget=50)
+        cache.load("chat", [])
+        for rowid in range(1, 6):
+            cache.append("chat", row(rowid, "x" * 40))  # 14 tokens each
+        self.assertEqual([e["rowid"] for e in cache.get("chat")], [4, 5])
+
+    def test_rows_without_text_are_skipped(self):
+        cache = ConversationContextCache(10, "@a")
+        cache.load("chat", [row(1, None)])
+        cache.append("chat", row(2, None))
+        self.assertEqual(cache.get("chat"), [])
+
+    def test_evicts_beyond_cap_and_idle(self):
+        cache = ConversationContextCache(10, "@a", max_conversations=2, idle_seconds=60)
+        cache.load("a", [])
+        cache.load("b", [])
+        cache.load("c", [])
+        self.assertNotIn("a", cache)
+        self.assertEqual(len(cache), 2)
+
+        with patch("context_cache.time.monotonic", return_value=10**9):
+            cache.evict()
+        self.assertEqual(len(cache), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
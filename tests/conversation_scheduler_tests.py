@@ -0,0 +1,140 @@
+""" Conversation scheduler tests """
+
+import sys
+import asyncio
+import unittest
+from pathlib import Path
+
+# Add the src directory to the sys.path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from conversation_scheduler import ConversationScheduler  # type: ignore
+
+
+class TestConversationScheduler(unittest.IsolatedAsyncioTestCase):
+    """Test class for ConversationScheduler"""
+
+    async def test_order_is_preserved_per_conversation(self):
+        scheduler = ConversationScheduler(max_concurrency=4)
+        seen = []
+
+        def job(key, i, delay):
+            async def run():
+                await asyncio.sleep(delay)
+                seen.append((key, i))
+
+            return run
+
+        for i in range(5):
+            # later jobs are quicker, they'd overtake if run concurrently
+            scheduler.submit("a", job("a", i, 0.01 * (5 - i)))
+            scheduler.submit("b", job("b", i, 0.001))
+        await scheduler.join()
+
+        self.assertEqual([i for k, i in seen if k == "a"], list(range(5)))
+        self.assertEqual([i for k, i in seen if k == "b"], list(range(5)))
+
+    async def test_concurrency_is_bounded(self):
+        scheduler = ConversationScheduler(max_concurrency=2)
+        running = 0
+        peak = 0
+
+        async def job():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.02)
+            running -= 1
+
+        for key in range(6):
+            scheduler.submit(key, job)
+        await scheduler.join()
+
+        self.assertEqual(peak, 2)
+        stats = scheduler.stats()
+        self.assertEqual(stats["completed"], 6)
+        self.assertEqual(stats["queued"], 0)
+        self.assertEqual(stats["max_depth"], 6)
+        self.assertGreater(stats["wait_max"], 0.0)
+
+    async def test_slow_conversation_does_not_block_others(self):
+        scheduler = ConversationScheduler(max_concurrency=2)
+        slow_started = asyncio.Event()
+        release = asyncio.Event()
+        fast_done = asyncio.Event()
+
+        async def slow():
+            slow_started.set()
+            await release.wait()
+
+        async def fast():
+            fast_done.set()
+
+        scheduler.submit("slow", slow)
+        await slow_started.wait()
+        scheduler.submit("fast", fast)
+        await asyncio.wait_for(fast_done.wait(), 1)
+        self.assertEqual(scheduler.stats()["in_flight"], 1)
+
+        release.set()
+        await scheduler.join()
+
+    async def test_failed_job_does_not_stop_the_queue(self):
+        scheduler = ConversationScheduler(max_concurrency=1)
+        done = []
+
+        async def boom():
+            raise RuntimeError("model server down")
+
+        async def after():
+            done.append(True)
+
+        scheduler.submit("a", boom)
+        scheduler.submit("a", after)
+        await scheduler.join()
+        self.assertEqual(done, [True])
+
+    async def test_debounce_and_coalesce(self):
+        scheduler = ConversationScheduler(max_concurrency=1, debounce=0.05)
+        ran = []
+
+        def job(i):
+            async def run():
+                ran.append(i)
+
+            return run
+
+        for i in range(3):
+            scheduler.submit("a", job(i), coalesce=True)
+            await asyncio.sleep(0.01)
+        await scheduler.join()
+
+        # the burst settled into the last job
+        self.assertEqual(ran, [2])
+        self.assertEqual(scheduler.stats()["coalesced"], 2)
+
+    async def test_cancel_running_keeps_the_worker(self):
+        scheduler = ConversationScheduler(max_concurrency=1)
+        started = asyncio.Event()
+        ran = []
+
+        async def slow():
+            started.set()
+            await asyncio.sleep(10)
+
+        async def quick():
+            ran.append("quick")
+
+        scheduler.submit("a", slow)
+        await started.wait()
+        scheduler.submit("a", quick)
+        self.assertTrue(scheduler.cancel_running("a"))
+        await scheduler.join()
+
+        self.assertEqual(ran, ["quick"])
+        self.assertEqual(scheduler.stats()["superseded"], 1)
+        self.assertFalse(scheduler.cancel_running("a"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -10,6 +10,25 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
 
 from db_manager import DatabaseManager  # type: ignore
+from state_store import StateStore  # type: ignore
+from chat_db_factory import build_chat_db, make_attributed_body
+
+
+def create_tables(conn):
+    """the columns DatabaseManager reads, every message filed under chat 1"""
+    conn.execute("CREATE TABLE handle (id INTEGER PRIMARY KEY, name TEXT);")
+    conn.execute(
+        "CREATE TABLE message (id INTEGER PRIMARY KEY, guid TEXT, handle_id INTEGER, text TEXT, attributedBody BLOB, date INTEGER, is_from_me INTEGER, FOREIGN KEY(handle_id) REFERENCES handle(id));"
+    )
+    conn.execute("CREATE TABLE chat (ROWID INTEGER PRIMARY KEY, guid TEXT);")
+    conn.execute(
+        "CREATE TABLE chat_message_join (chat_id INTEGER, message_id INTEGER, message_date INTEGER);"
+    )
+    conn.execute("INSERT INTO chat (ROWID, guid) VALUES (1, 'iMessage;-;test_handle');")
+    conn.execute(
+        """CREATE TRIGGER file_under_chat AFTER INSERT ON message BEGIN
+        INSERT INTO chat_message_join VALUES (1, new.id, new.date); END;"""
+    )
 
 
 class TestDatabaseManager(unittest.TestCase):
@@ -97,15 +116,17 @@ class TestDatabaseManagerAsync(unittest.IsolatedAsyncioTestCase):
         conn.close()
 
         with sqlite3.connect(self.db_path) as conn:
-            conn.execute("CREATE TABLE handle (id INTEGER PRIMARY KEY, name TEXT);")
-            conn.execute(
-                "CREATE TABLE message (id INTEGER PRIMARY KEY, handle_id INTEGER, text TEXT, attributedBody BLOB, date INTEGER, is_from_me INTEGER, FOREIGN KEY(handle_id) REFERENCES handle(id));"
-            )
-            conn.commit()
+            create_tables(conn)
 
         assert os.path.exists(self.wal_path)
 
+        # hold a connection open like Messages does, otherwise sqlite removes
+        # the WAL when the last connection closes
+        self.messages_conn = sqlite3.connect(self.db_path)
+        self.messages_conn.execute("SELECT 1 FROM message;")
+
     async def asyncTearDown(self):
+        self.messages_conn.close()
         self.test_dir.cleanup()
 
     async def test_get_messages_in_last_seconds(self):
@@ -116,6 +137,7 @@ class TestDatabaseManagerAsync(unittest.IsolatedAsyncioTestCase):
             return time_since_2001_ns
 
         db_manager = DatabaseManager(self.test_dir.name)
+        self.addAsyncCleanup(db_manager.close)
 
         current_time_ns = time_ns_since_2001()
         past_time_ns = current_time_ns - (10 * 1000000000)
@@ -164,9 +186,247 @@ class TestDatabaseManagerAsync(unittest.IsolatedAsyncioTestCase):
         print(f"Retrieved messages: {messages}")
 
         self.assertEqual(len(messages), 2)
-        self.assertTrue(any(msg["text"] == "recent_message" for msg in messages))
-        self.assertTrue(any(msg["text"] == "past_message" for msg in messages))
-        self.assertFalse(any(msg["text"] == "outside_message" for msg in messages))
+        self.assertTrue(any(msg.text == "recent_message" for msg in messages))
+        self.assertTrue(any(msg.text == "past_message" for msg in messages))
+        self.assertFalse(any(msg.text == "outside_message" for msg in messages))
+
+    def _insert_messages(self, texts):
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("INSERT OR IGNORE INTO handle (id, name) VALUES (1, ?);", ("test_handle",))
+            for text in texts:
+                conn.execute(
+                    "INSERT INTO message (handle_id, text, attributedBody, date, is_from_me) VALUES (?, ?, ?, ?, ?);",
+                    (1, text, None, int(time.time() * 1000000000), 0),
+                )
+            conn.commit()
+
+    async def test_get_new_messages_cursor(self):
+        self._insert_messages(["history_1", "history_2"])
+        db_manager = DatabaseManager(self.test_dir.name)
+        self.addAsyncCleanup(db_manager.close)
+
+        # first call primes the cursor at the tip, history isn't replayed
+        messages, high_water = await db_manager.get_new_messages()
+        self.assertEqual(messages, [])
+        self.assertEqual(high_water, 2)
+
+        self._insert_messages(["new_1", "new_2"])
+        messages, high_water = await db_manager.get_new_messages()
+        self.assertEqual([m.text for m in messages], ["new_1", "new_2"])
+        self.assertEqual(high_water, 4)
+
+        # until the cursor is advanced the same batch is handed out again
+        messages, _ = await db_manager.get_new_messages()
+        self.assertEqual(len(messages), 2)
+
+        await db_manager.advance_cursor(high_water)
+        messages, high_water = await db_manager.get_new_messages()
+        self.assertEqual(messages, [])
+        self.assertEqual(high_water, 4)
+
+    async def test_cursor_persists_across_restarts(self):
+        state_dir = os.path.join(self.test_dir.name, "state")
+        self._insert_messages(["history"])
+        db_manager = DatabaseManager(self.test_dir.name, state_path=state_dir)
+        self.addAsyncCleanup(db_manager.close)
+        await db_manager.get_new_messages()
+
+        self._insert_messages(["while_running"])
+        messages, high_water = await db_manager.get_new_messages()
+        await db_manager.advance_cursor(high_water)
+        self.assertEqual([m.text for m in messages], ["while_running"])
+
+        self._insert_messages(["while_stopped"])
+        restarted = DatabaseManager(self.test_dir.name, state_path=state_dir)
+        self.addAsyncCleanup(restarted.close)
+        messages, _ = await restarted.get_new_messages()
+        self.assertEqual([m.text for m in messages], ["while_stopped"])
+
+    async def test_state_store_keeps_cursor_and_decoded_bodies(self):
+        state_path = os.path.join(self.test_dir.name, "state", "state.db")
+        state = await StateStore(state_path).open()
+        db_manager = DatabaseManager(self.test_dir.name, state=state)
+        self.addAsyncCleanup(db_manager.close)
+        await db_manager.get_new_messages()
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("INSERT INTO handle (id, name) VALUES (1, 'test_handle');")
+            conn.execute(
+                "INSERT INTO message (handle_id, text, attributedBody, date, is_from_me) VALUES (?, ?, ?, ?, ?);",
+                (1, None, make_attributed_body("@a from the blob"), 1, 0),
+            )
+            conn.commit()
+        messages, high_water = await db_manager.get_new_messages()
+        await db_manager.advance_cursor(high_water)
+        await state.close()
+
+        self._insert_messages(["while_stopped"])
+        restarted_state = await StateStore(state_path).open()
+        self.addAsyncCleanup(restarted_state.close)
+        restarted = DatabaseManager(self.test_dir.name, state=restarted_state)
+        self.addAsyncCleanup(restarted.close)
+        messages, _ = await restarted.get_new_messages()
+        self.assertEqual([m.text for m in messages], ["while_stopped"])
+
+        # the body decoded before the restart isn't decoded again
+        await restarted.get_latest_messages_for_chat(10, 1)
+        self.assertEqual(restarted.decode_cache_stats()["misses"], 0)
+
+    async def test_connection_is_reused_and_read_only(self):
+        db_manager = DatabaseManager(self.test_dir.name)
+        self.addAsyncCleanup(db_manager.close)
+        await db_manager.get_new_messages()
+        conn = db_manager._conn
+        self.assertIsNotNone(conn)
+        await db_manager.get_new_messages()
+        self.assertIs(db_manager._conn, conn)
+
+        with self.assertRaises(sqlite3.OperationalError):
+            await conn.execute("DELETE FROM message;")
+
+    async def test_reconnects_when_db_replaced(self):
+        db_manager = DatabaseManager(self.test_dir.name)
+        self.addAsyncCleanup(db_manager.close)
+        await db_manager.get_new_messages()
+        conn = db_manager._conn
+
+        # swap in a new file the way a restore or migration would
+        replacement = os.path.join(self.test_dir.name, "replacement.db")
+        with sqlite3.connect(replacement) as dst:
+            create_tables(dst)
+            dst.execute("INSERT INTO handle (id, name) VALUES (1, 'test_handle');")
+            dst.execute(
+                "INSERT INTO message (handle_id, text, date, is_from_me) VALUES (1, 'after_swap', 0, 0);"
+            )
+        # a real replacement brings its own journal, never the old WAL
+        self.messages_conn.close()
+        os.replace(replacement, self.db_path)
+        for stale in (self.wal_path, f"{self.db_path}-shm"):
+            if os.path.exists(stale):
+                os.remove(stale)
+
+        messages, high_water = await db_manager.get_new_messages()
+        self.assertIsNot(db_manager._conn, conn)
+        self.assertEqual([m.text for m in messages], ["after_swap"])
+        self.assertEqual(high_water, 1)
+
+    async def test_wait_for_change_wakes_on_insert(self):
+        for watcher in ("auto", "stat"):
+            db_manager = DatabaseManager(self.test_dir.name, watcher=watcher)
+            self.addAsyncCleanup(db_manager.close)
+            self.assertFalse(await db_manager.wait_for_change(0.05))
+
+            time.sleep(0.01)  # let the mtime move on coarse filesystems
+            self._insert_messages(["wake_up"])
+            self.assertTrue(await db_manager.wait_for_change(0.05))
+
+    async def test_attributed_body_is_decoded_once(self):
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("INSERT INTO handle (id, name) VALUES (1, 'test_handle');")
+            conn.execute(
+                "INSERT INTO message (handle_id, text, attributedBody, date, is_from_me) VALUES (?, ?, ?, ?, ?);",
+                (1, None, make_attributed_body("@a from the blob"), 1, 0),
+            )
+            conn.commit()
+
+        db_manager = DatabaseManager(self.test_dir.name)
+        self.addAsyncCleanup(db_manager.close)
+        for _ in range(3):
+            messages = await db_manager.get_latest_messages_for_chat(10, 1)
+            self.assertEqual(messages[0].text, "@a from the blob")
+
+        stats = db_manager.decode_cache_stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 1))
+
+    async def test_mention_prefilter_defers_decoding(self):
+        db_manager = DatabaseManager(self.test_dir.name, mention="@a")
+        self.addAsyncCleanup(db_manager.close)
+        await db_manager.get_new_messages()
+
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("INSERT INTO handle (id, name) VALUES (1, 'test_handle');")
+            for text, blob in [
+                ("@a plain", None),
+                ("no mention", None),
+                (None, make_attributed_body("@a from the blob")),
+                (None, make_attributed_body("just chatting")),
+            ]:
+                conn.execute(
+                    "INSERT INTO message (handle_id, text, attributedBody, date, is_from_me) VALUES (?, ?, ?, ?, ?);",
+                    (1, text, blob, 1, 0),
+                )
+            conn.commit()
+
+        messages, _ = await db_manager.get_new_messages()
+        self.assertEqual([m.mentions for m in messages], [True, False, True, False])
+        self.assertEqual([m.text for m in messages[2:]], [None, None])
+
+        # only what's asked for is decoded, and off the loop
+        self.assertEqual(await db_manager.decode([messages[2]]), 1)
+        self.assertEqual(messages[2].text, "@a from the blob")
+        self.assertIsNone(messages[2].attributed_body)
+        self.assertIsNotNone(messages[3].attributed_body)
+        self.assertEqual(await db_manager.decode(messages), 1)
+        self.assertEqual(messages[3].text, "just chatting")
+
+
+class TestGeneratedChatDb(unittest.IsolatedAsyncioTestCase):
+    """DatabaseManager against a chat.db with the real Messages schema"""
+
+    async def asyncSetUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.writer = build_chat_db(
+            os.path.join(self.test_dir.name, "chat.db"), 500, handles=20, chats=15
+        )
+
+    async def asyncTearDown(self):
+        self.writer.close()
+        self.test_dir.cleanup()
+
+    async def test_reads_live_messages(self):
+        db_manager = DatabaseManager(self.test_dir.name)
+        self.addAsyncCleanup(db_manager.close)
+        _, high_water = await db_manager.get_new_messages()
+        self.assertEqual(high_water, 500)
+        await db_manager.advance_cursor(high_water)
+
+        chat = next(chat for chat in self.writer.chats if len(chat[2]) == 1)
+        handle = self.writer.handles[chat[2][0] - 1]
+        self.writer.send(chat, "@a plain", attributed=False)
+        self.writer.send(chat, "@a from the blob")
+
+        messages, high_water = await db_manager.get_new_messages()
+        self.assertEqual([m.text for m in messages], ["@a plain", "@a from the blob"])
+        self.assertEqual({m.handle_id for m in messages}, {handle})
+        self.assertEqual(high_water, 502)
+
+        self.assertEqual({m.chat_guid for m in messages}, {chat[1]})
+
+        history = await db_manager.get_latest_messages_for_chat(5, chat[0])
+        self.assertEqual(history[0].text, "@a from the blob")
+        self.assertTrue(all(m.text for m in history))
+
+    async def test_group_chat_is_one_thread(self):
+        db_manager = DatabaseManager(self.test_dir.name)
+        self.addAsyncCleanup(db_manager.close)
+        await db_manager.advance_cursor((await db_manager.get_new_messages())[1])
+
+        chat = next(c for c in self.writer.chats if len(c[2]) > 1)
+        chat_id, chat_guid, members = chat
+        self.writer.send(chat, "who's in", sender=members[0])
+        self.writer.send(chat, "me", sender=members[1])
+        self.writer.send(chat, "@a you?", sender=members[0])
+
+        messages, _ = await db_manager.get_new_messages()
+        self.assertEqual(
+            {(m.chat_id, m.chat_guid) for m in messages}, {(chat_id, chat_guid)}
+        )
+        self.assertEqual(
+            [m.handle_id for m in messages],
+            [self.writer.handles[members[i] - 1] for i in (0, 1, 0)],
+        )
+
+        history = await db_manager.get_latest_messages_for_chat(3, chat_id)
+        self.assertEqual([m.text for m in history], ["@a you?", "me", "who's in"])
 
 
 if __name__ == "__main__":
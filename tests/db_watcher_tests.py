@@ -0,0 +1,82 @@
+""" chat.db watcher tests """
+
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+
+# Add the src directory to the sys.path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from db_watcher import create_watcher, InotifyWatcher  # type: ignore
+
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "inotify is Linux only")
+class TestInotifyWatcher(unittest.IsolatedAsyncioTestCase):
+    """Test class for the inotify backend"""
+
+    async def asyncSetUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.test_dir.name, "chat.db")
+        self.wal_path = os.path.join(self.test_dir.name, "chat.db-wal")
+        for path in (self.db_path, self.wal_path):
+            with open(path, "wb") as f:
+                f.write(b"\0" * 32)
+        self.watcher = create_watcher([self.db_path, self.wal_path])
+
+    async def asyncTearDown(self):
+        self.watcher.close()
+        self.test_dir.cleanup()
+
+    def _append(self, path):
+        with open(path, "ab") as f:
+            f.write(b"frame")
+
+    async def test_wakes_on_wal_append(self):
+        self.assertIsInstance(self.watcher, InotifyWatcher)
+        loop = asyncio.get_running_loop()
+        written_at = []
+
+        def write():
+            written_at.append(time.perf_counter())
+            self._append(self.wal_path)
+
+        loop.call_later(0.2, write)
+        changed = await self.watcher.wait(5)
+        woke_at = time.perf_counter()
+
+        self.assertTrue(changed)
+        latency = woke_at - written_at[0]
+        print(f"time to wakeup: {latency * 1000:.2f} ms")
+        self.assertLess(latency, 0.5)
+
+    async def test_times_out_when_idle(self):
+        start = time.perf_counter()
+        self.assertFalse(await self.watcher.wait(0.1))
+        self.assertLess(time.perf_counter() - start, 1)
+
+    async def test_ignores_unrelated_files(self):
+        loop = asyncio.get_running_loop()
+        other = os.path.join(self.test_dir.name, "unrelated.db")
+        loop.call_later(0.05, self._append, other)
+        self.assertFalse(await self.watcher.wait(0.3))
+
+    async def test_sees_recreated_wal(self):
+        os.remove(self.wal_path)
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.05, self._append, self.wal_path)
+        self.assertTrue(await self.watcher.wait(5))
+
+
+class TestCreateWatcher(unittest.TestCase):
+    """Test class for backend selection"""
+
+    def test_stat_backend_means_polling(self):
+        self.assertIsNone(create_watcher(["/tmp/chat.db"], backend="stat"))
+
+
+if __name__ == "__main__":
+    unittest.main()
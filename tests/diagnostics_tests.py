@@ -0,0 +1,76 @@
+""" Diagnostics tests """
+
+import asyncio
+import sys
+import time
+import tracemalloc
+import unittest
+from pathlib import Path
+
+# Add the src directory to the sys.path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from config import config  # type: ignore
+from diagnostics import Diagnostics  # type: ignore
+
+
+def block_the_loop(seconds):
+    time.sleep(seconds)
+
+
+def spin(seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+
+
+class TestDiagnostics(unittest.IsolatedAsyncioTestCase):
+    """Test class for Diagnostics"""
+
+    async def _start(self, **overrides):
+        diagnostics = Diagnostics(dict(config, **overrides))
+        self.addAsyncCleanup(diagnostics.close)
+        return diagnostics, await diagnostics.start()
+
+    async def _command(self, port, line):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"{line}\n".encode())
+        await writer.drain()
+        reply = await reader.read()
+        writer.close()
+        return reply.decode()
+
+    async def test_off_by_default(self):
+        diagnostics, port = await self._start()
+        self.assertFalse(diagnostics.enabled)
+        self.assertIsNone(port)
+        self.assertIsNone(diagnostics.watchdog)
+        self.assertFalse(tracemalloc.is_tracing())
+
+    async def test_watchdog_reports_what_blocked_the_loop(self):
+        diagnostics, _ = await self._start(diagnostics_port=0, slow_callback_ms=50)
+        await asyncio.sleep(0.05)
+        block_the_loop(0.3)
+        await asyncio.sleep(0.05)
+        self.assertEqual(len(diagnostics.watchdog.stalls), 1)
+        self.assertIn("block_the_loop", diagnostics.watchdog.stalls[0])
+
+    async def test_profile_samples_the_loop_thread(self):
+        diagnostics, _ = await self._start(diagnostics_port=0, slow_callback_ms=0)
+        profile = asyncio.create_task(diagnostics.profile(0.5))
+        await asyncio.sleep(0.1)
+        spin(0.2)
+        samples = dict(line.rsplit(" ", 1) for line in (await profile).splitlines())
+        spinning = [int(n) for stack, n in samples.items() if stack.endswith("diagnostics_tests.py:spin")]
+        self.assertGreater(sum(spinning), 10)
+
+    async def test_commands(self):
+        _, port = await self._start(diagnostics_port=0, tracemalloc_interval=3600)
+        self.assertIn("selectors.py:select", await self._command(port, "profile 0.05"))
+        self.assertIn("MainThread", await self._command(port, "stacks"))
+        self.assertIn("top:", await self._command(port, "memory"))
+        self.assertIn("commands:", await self._command(port, "help"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,333 @@
+"""
+Stand-in for the Ollama server, speaks enough of the HTTP API (/api/chat
+streaming and not, /api/ps) for OllamaClient, with no model behind it.
+
+Latency is scripted: a load delay on the first request, time to first token
+plus a per-token charge for prompt tokens past the cached prefix (each slot
+keeps its last prompt like Ollama's KV cache), then tokens_per_second for
+the reply. Requests beyond max_concurrency queue, like OLLAMA_NUM_PARALLEL.
+Every request is recorded so tests can assert on prompt sizes and cache use.
+
+    python tests/fake_ollama.py --port 11434 --ttft 0.3 --tokens-per-second 30
+    OLLAMA_HOST=http://127.0.0.1:11434 python src/main.py
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import datetime, timezone
+
+
+def tokenize(messages):
+    """role markers plus whitespace separated words, close enough for cache maths"""
+    tokens = []
+    for message in messages:
+        tokens.append(f"<{message.get('role')}>")
+        tokens.extend((message.get("content") or "").split())
+    return tokens
+
+
+def shared_prefix(a, b):
+    shared = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        shared += 1
+    return shared
+
+
+class FakeOllama:
+    """FakeOllama"""
+
+    def __init__(
+        self,
+        reply="sounds good to me",
+        ttft=0.0,
+        tokens_per_second=None,
+        prompt_seconds_per_token=0.0,
+        load_seconds=0.0,
+        max_concurrency=1,
+        max_queue=None,
+        fail_rate=0.0,
+        seed=0,
+    ):
+        self.reply = reply
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.prompt_seconds_per_token = prompt_seconds_per_token
+        self.load_seconds = load_seconds
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.fail_rate = fail_rate
+        self._rng = random.Random(seed)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # one cached prompt per parallel slot
+        self._slots = [[] for _ in range(max_concurrency)]
+        self._free_slots = set(range(max_concurrency))
+        self._failures = []
+        self._server = None
+        self._connections = set()
+        self.loaded_model = None
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.queued = 0
+
+    def fail_next(self, count=1, status=500, error="injected failure", mid_stream=False):
+        """
+        make the next count chat requests fail with an HTTP error, or with
+        mid_stream, drop the connection halfway through a streamed reply
+        """
+        self._failures.extend([(status, error, mid_stream)] * count)
+
+    async def start(self, host="127.0.0.1", port=0):
+        """start listening, returns the base URL"""
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        port = self._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            # keep-alive connections would otherwise sit in readline forever
+            for task in self._connections:
+                task.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+
+    def stats(self):
+        """request counts and prompt token totals"""
+        chats = [r for r in self.requests if r["path"] == "/api/chat" and r["messages"]]
+        prompt_tokens = sum(r["prompt_tokens"] for r in chats)
+        cached_tokens = sum(r["cached_tokens"] for r in chats)
+        return {
+            "requests": len(self.requests),
+            "chats": len(chats),
+            "failed": sum(r["status"] != 200 for r in self.requests),
+            "max_in_flight": self.max_in_flight,
+            "prompt_tokens": prompt_tokens,
+            "evaluated_tokens": prompt_tokens - cached_tokens,
+            "cache_hit_rate": cached_tokens / prompt_tokens if prompt_tokens else 0.0,
+        }
+
+    async def _handle_connection(self, reader, writer):
+        """HTTP/1.1 with keep-alive, one request at a time per connection"""
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                if not await self._route(method, path, body, writer):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _route(self, method, path, body, writer):
+        """answer one request, returns False if the connection should close"""
+        if method == "POST" and path == "/api/chat":
+            return await self._chat(json.loads(body or b"{}"), writer)
+        if path == "/api/ps":
+            models = []
+            if self.loaded_model:
+                models.append({"name": self.loaded_model, "model": self.loaded_model})
+            await self._respond(writer, 200, {"models": models})
+            return True
+        await self._respond(writer, 404, {"error": f"{path} not found"})
+        return True
+
+    async def _respond(self, writer, status, payload):
+        body = json.dumps(payload).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+
+    @staticmethod
+    def _write_chunk(writer, payload):
+        data = (json.dumps(payload) + "\n").encode()
+        writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+    def _part(self, model, content, done=False, **extra):
+        return {
+            "model": model,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "message": {"role": "assistant", "content": content},
+            "done": done,
+            **extra,
+        }
+
+    async def _chat(self, request, writer):
+        model = request.get("model")
+        messages = request.get("messages") or []
+        stream = request.get("stream", True)
+        tokens = tokenize(messages)
+        record = {
+            "path": "/api/chat",
+            "model": model,
+            "messages": messages,
+            "stream": stream,
+            "options": request.get("options"),
+            "keep_alive": request.get("keep_alive"),
+            "prompt_chars": sum(len(m.get("content") or "") for m in messages),
+            "prompt_tokens": len(tokens),
+            "cached_tokens": 0,
+            "queued_seconds": 0.0,
+            "status": 200,
+        }
+        self.requests.append(record)
+
+        if self._failures:
+            status, error, mid_stream = self._failures.pop(0)
+        elif self.fail_rate and self._rng.random() < self.fail_rate:
+            status, error, mid_stream = 500, "injected failure", False
+        else:
+            status = None
+        if status is not None and not (mid_stream and stream):
+            record["status"] = status
+            await self._respond(writer, status, {"error": error})
+            return True
+        if self.max_queue is not None and self.queued >= self.max_queue:
+            record["status"] = 503
+            await self._respond(writer, 503, {"error": "server busy, please try again"})
+            return True
+
+        start = time.perf_counter()
+        self.queued += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+        record["queued_seconds"] = time.perf_counter() - start
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        # the free slot whose cached prompt shares the most with this one
+        slot = max(self._free_slots, key=lambda s: shared_prefix(self._slots[s], tokens))
+        self._free_slots.remove(slot)
+        try:
+            load_seconds = 0.0
+            if self.loaded_model != model:
+                load_seconds = self.load_seconds
+                await asyncio.sleep(load_seconds)
+                self.loaded_model = model
+                self._slots = [[] for _ in self._slots]
+            if not messages:
+                # an empty chat just loads the model
+                await self._respond(
+                    writer,
+                    200,
+                    self._part(model, "", True, done_reason="load",
+                               load_duration=int(load_seconds * 1e9)),
+                )
+                return True
+
+            cached = shared_prefix(self._slots[slot], tokens)
+            self._slots[slot] = tokens
+            record["cached_tokens"] = cached
+            evaluated = len(tokens) - cached
+            prompt_seconds = evaluated * self.prompt_seconds_per_token
+            await asyncio.sleep(self.ttft + prompt_seconds)
+
+            words = self.reply.split(" ")
+            pieces = [w + " " for w in words[:-1]] + [words[-1]]
+            per_token = 1 / self.tokens_per_second if self.tokens_per_second else 0.0
+            stats = {
+                "done_reason": "stop",
+                "load_duration": int(load_seconds * 1e9),
+                "prompt_eval_count": evaluated,
+                "prompt_eval_duration": int(prompt_seconds * 1e9),
+                "eval_count": len(pieces),
+                "eval_duration": int(len(pieces) * per_token * 1e9),
+            }
+            if not stream:
+                await asyncio.sleep(per_token * len(pieces))
+                stats["total_duration"] = int((time.perf_counter() - start) * 1e9)
+                await self._respond(writer, 200, self._part(model, self.reply, True, **stats))
+                return True
+
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: application/x-ndjson\r\n"
+                b"Transfer-Encoding: chunked\r\n\r\n"
+            )
+            for i, piece in enumerate(pieces):
+                if status is not None and i == len(pieces) // 2:
+                    # mid_stream failure, the connection just goes away
+                    record["status"] = status
+                    await writer.drain()
+                    return False
+                self._write_chunk(writer, self._part(model, piece))
+                await writer.drain()
+                await asyncio.sleep(per_token)
+            stats["total_duration"] = int((time.perf_counter() - start) * 1e9)
+            self._write_chunk(writer, self._part(model, "", True, **stats))
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+            return True
+        finally:
+            self._free_slots.add(slot)
+            self.in_flight -= 1
+            self._semaphore.release()
+
+
+async def serve(args):
+    server = FakeOllama(
+        reply=args.reply,
+        ttft=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+        prompt_seconds_per_token=args.prompt_seconds_per_token,
+        load_seconds=args.load_seconds,
+        max_concurrency=args.max_concurrency,
+        max_queue=args.max_queue,
+        fail_rate=args.fail_rate,
+    )
+    print(f"fake ollama on {await server.start(args.host, args.port)}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        print(json.dumps(server.stats()))
+        await server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--reply", default="sounds good to me")
+    parser.add_argument("--ttft", type=float, default=0.0, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=None)
+    parser.add_argument("--prompt-seconds-per-token", type=float, default=0.0,
+                        help="charge for prompt tokens not in the cache")
+    parser.add_argument("--load-seconds", type=float, default=0.0)
+    parser.add_argument("--max-concurrency", type=int, default=1)
+    parser.add_argument("--max-queue", type=int, default=None, help="queued requests before 503s")
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
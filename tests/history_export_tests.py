@@ -0,0 +1,88 @@
+""" History export tests """
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+# Add the src directory to the sys.path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from history_export import export_history  # type: ignore
+from chat_db_factory import build_chat_db
+
+
+class TestHistoryExport(unittest.TestCase):
+    """Test class for export_history"""
+
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.test_dir.name, "chat.db")
+        self.writer = build_chat_db(self.db_path, 500, chats=5, seed=3)
+        self.out = os.path.join(self.test_dir.name, "export", "messages.jsonl")
+        os.makedirs(os.path.dirname(self.out))
+
+    def tearDown(self):
+        self.writer.close()
+        self.test_dir.cleanup()
+
+    def _export(self, **kwargs):
+        return export_history(self.db_path, self.out, batch_size=64, workers=2, **kwargs)
+
+    def _read(self):
+        with open(self.out, encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    def test_exports_every_message_in_order(self):
+        stats = self._export()
+        records = self._read()
+        self.assertEqual(stats["messages"], 500)
+        self.assertEqual([r["rowid"] for r in records], list(range(1, 501)))
+        # archived bodies come out as text, the way the agent reads them
+        self.assertGreater(stats["decoded"], 0)
+        expected = dict(
+            self.writer.conn.execute(
+                "SELECT ROWID, text FROM message WHERE text IS NOT NULL;"
+            ).fetchall()
+        )
+        for record in records:
+            self.assertIsNotNone(record["text"])
+            if record["rowid"] in expected:
+                self.assertEqual(record["text"], expected[record["rowid"]])
+
+    def test_resumes_from_the_checkpoint(self):
+        self._export()
+        # interrupted after the checkpoint: a torn line past it is dropped
+        with open(self.out, "a", encoding="utf-8") as f:
+            f.write('{"rowid": 501, "te')
+        chat = self.writer.chats[0]
+        self.writer.send(chat, "@a newer")
+        self.writer.send(chat, "newest", attributed=False)
+
+        stats = self._export()
+        records = self._read()
+        self.assertEqual(stats["messages"], 2)
+        self.assertEqual([r["text"] for r in records[-2:]], ["@a newer", "newest"])
+        self.assertEqual(len(records), 502)
+
+        stats = self._export(restart=True)
+        self.assertEqual(stats["messages"], 502)
+        self.assertEqual(len(self._read()), 502)
+
+    def test_output_shorter_than_the_checkpoint_starts_over(self):
+        self._export()
+        with open(self.out, "r+b") as f:
+            f.truncate(100)
+
+        with self.assertLogs(level="WARNING"):
+            stats = self._export()
+        self.assertEqual(stats["messages"], 500)
+        with open(self.out, "rb") as f:
+            self.assertNotIn(b"\0", f.read())
+        self.assertEqual(len(self._read()), 500)
+
+
+if __name__ == "__main__":
+    unittest.main()
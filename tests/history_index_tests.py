@@ -0,0 +1,79 @@
+""" History index tests """
+
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+# Add the src directory to the sys.path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from db_manager import DatabaseManager  # type: ignore
+from history_index import HistoryIndex, match_query  # type: ignore
+from message import Message  # type: ignore
+from chat_db_factory import build_chat_db
+
+
+def message(rowid, text, chat_id=1, is_from_me=0):
+    return Message(rowid, f"MSG-{rowid}", chat_id, f"chat{chat_id}", "+15550001", text, is_from_me)
+
+
+class TestHistoryIndex(unittest.IsolatedAsyncioTestCase):
+    """Test class for HistoryIndex"""
+
+    async def asyncSetUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.index = HistoryIndex(os.path.join(self.test_dir.name, "state", "history.db"))
+        self.addAsyncCleanup(self.index.close)
+
+    async def asyncTearDown(self):
+        self.test_dir.cleanup()
+
+    def test_match_query_drops_stopwords(self):
+        self.assertEqual(match_query("What's the wifi password?"), '"wifi" OR "password"')
+        self.assertIsNone(match_query("is it?"))
+
+    async def test_search_ranks_within_a_chat(self):
+        await self.index.add(
+            [
+                message(1, "the wifi password is hunter2"),
+                message(2, "dinner at seven"),
+                message(3, "wifi is down again", chat_id=2),
+                message(4, "no attachment text", is_from_me=1),
+                message(5, None),
+            ]
+        )
+        results = await self.index.search(1, "what was the wifi password", k=3)
+        self.assertEqual([r["rowid"] for r in results], [1])
+        self.assertEqual(results[0]["snippet"], "the wifi password is hunter2")
+
+    async def test_search_leaves_out_the_context(self):
+        await self.index.add([message(1, "pizza place on main"), message(9, "pizza tonight?")])
+        results = await self.index.search(1, "pizza", before_rowid=9)
+        self.assertEqual([r["rowid"] for r in results], [1])
+
+    async def test_reindexing_a_row_is_harmless(self):
+        await self.index.add([message(1, "running late")])
+        await self.index.add([message(1, "running late")])
+        self.assertEqual(len(await self.index.search(1, "running")), 1)
+
+    async def test_build_streams_chat_db_and_resumes(self):
+        writer = build_chat_db(os.path.join(self.test_dir.name, "chat.db"), 300, handles=10, chats=5)
+        self.addCleanup(writer.close)
+        db_manager = DatabaseManager(self.test_dir.name)
+        self.addAsyncCleanup(db_manager.close)
+
+        self.assertEqual(await self.index.build(db_manager, batch_size=64), 300)
+        chat = writer.chats[0]
+        writer.send(chat, "the zeppelin tickets are booked")
+        # only what's new since the last build
+        self.assertEqual(await self.index.build(db_manager, batch_size=64), 1)
+
+        results = await self.index.search(chat[0], "zeppelin tickets")
+        # decoded from attributedBody, chat.db has no text for it
+        self.assertEqual(results[0]["text"], "the zeppelin tickets are booked")
+
+
+if __name__ == "__main__":
+    unittest.main()
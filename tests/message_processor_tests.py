@@ -0,0 +1,373 @@
+""" Message processor tests """
+
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import AsyncMock
+
+# Add the src directory to the sys.path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from config import config  # type: ignore
+from message import Message  # type: ignore
+from metrics import metrics  # type: ignore
+from message_processor import MessageProcessor  # type: ignore
+from state_store import StateStore  # type: ignore
+
+
+class FakeDatabaseManager:
+    """hands out scripted batches of new rows"""
+
+    def __init__(self, history=None):
+        self.batches = []
+        self.history = history or {}
+        self.history_queries = 0
+        # get_latest_messages_for_chat fails like a chat.db error does
+        self.fail_history = False
+        self.decoded = []
+        self.cursor = 0
+
+    async def get_new_messages(self):
+        if not self.batches:
+            return [], self.cursor
+        batch = self.batches.pop(0)
+        return batch, max([m.rowid for m in batch], default=self.cursor)
+
+    async def advance_cursor(self, rowid):
+        self.cursor = rowid
+
+    async def wait_for_change(self, timeout):
+        await asyncio.sleep(timeout)
+        return False
+
+    async def get_latest_messages_for_chat(self, k, chat_id):
+        self.history_queries += 1
+        if self.fail_history:
+            return None
+        return list(reversed(self.history.get(chat_id, [])))[:k]
+
+    async def decode(self, messages):
+        for message in messages:
+            message.text, message.attributed_body = message.attributed_body.decode(), None
+            self.decoded.append(message.rowid)
+        return len(messages)
+
+
+def row(rowid, text, handle_id="+15550001", is_from_me=0, chat_id=1, chat_guid=None):
+    return Message(
+        rowid=rowid,
+        guid=f"MSG-{rowid}",
+        chat_id=chat_id,
+        chat_guid=chat_guid or f"iMessage;-;{handle_id}",
+        handle_id=handle_id,
+        text=text,
+        is_from_me=is_from_me,
+    )
+
+
+class TestMessageProcessor(unittest.IsolatedAsyncioTestCase):
+    """Test class for MessageProcessor"""
+
+    async def asyncSetUp(self):
+        self.db = FakeDatabaseManager()
+        self.client = AsyncMock()
+        self.client.get_msg.return_value = "on it"
+        self.processor = MessageProcessor(
+            self.db, self.client, dict(config, debounce_seconds=0)
+        )
+        self.processor._as_utils = AsyncMock()
+        self.processor._as_utils.send_message_via_applescript.side_effect = (
+            lambda recipient, message: message
+        )
+
+    async def _ingest(self, *rows):
+        """rows land in chat.db and one poll picks them up"""
+        for message in rows:
+            self.db.history.setdefault(message.chat_id, []).append(message)
+        self.db.batches.append(list(rows))
+        await self.processor._process_new_messages()
+
+    async def _poll(self, *rows):
+        await self._ingest(*rows)
+        await self.processor._scheduler.join()
+
+    async def test_replies_to_mentions(self):
+        await self._poll(row(1, "@a what's up"))
+        self.processor._as_utils.send_message_via_applescript.assert_awaited_once_with(
+            "iMessage;-;+15550001", "on it"
+        )
+        self.assertEqual(self.db.cursor, 1)
+
+    async def test_failed_cold_load_still_answers_the_mention(self):
+        self.db.fail_history = True
+        await self._poll(row(1, "earlier"), row(2, "@a you there?"))
+        context = self.client.get_msg.await_args.args[0]
+        self.assertEqual([e["content"] for e in context], ["earlier", "you there?"])
+        self.assertEqual(self.db.cursor, 2)
+
+    async def test_cursor_stays_put_when_a_batch_fails(self):
+        self.processor._decode_needed = AsyncMock(side_effect=RuntimeError("boom"))
+        with self.assertRaises(RuntimeError):
+            await self._poll(row(1, "@a hi"))
+        self.assertEqual(self.db.cursor, 0)
+
+        # the rows come round again and are answered
+        del self.processor._decode_needed
+        self.db.batches.append([row(1, "@a hi")])
+        await self.processor._process_new_messages()
+        await self.processor._scheduler.join()
+        self.processor._as_utils.send_message_via_applescript.assert_awaited_once()
+        self.assertEqual(self.db.cursor, 1)
+
+    async def test_a_batch_that_always_fails_is_skipped(self):
+        decode_needed = self.processor._decode_needed
+
+        async def fail_on_row_1(messages):
+            if any(m.rowid == 1 for m in messages):
+                raise RuntimeError("boom")
+            await decode_needed(messages)
+
+        self.processor._decode_needed = fail_on_row_1
+        retries = config["max_batch_retries"]
+        for _ in range(retries):
+            with self.assertRaises(RuntimeError):
+                await self._poll(row(1, "@a hi"))
+            self.assertEqual(self.db.cursor, 0)
+
+        # one more failure and the row is given up on
+        await self._poll(row(1, "@a hi"))
+        self.assertEqual(self.db.cursor, 1)
+        self.processor._as_utils.send_message_via_applescript.assert_not_awaited()
+
+        # and later messages are answered
+        await self._poll(row(2, "@a still there?"))
+        self.processor._as_utils.send_message_via_applescript.assert_awaited_once()
+        self.assertEqual(self.db.cursor, 2)
+
+    async def test_group_chat_is_answered_once(self):
+        group = {"chat_id": 7, "chat_guid": "iMessage;+;chat42"}
+        await self._poll(
+            row(1, "@a pizza or tacos?", handle_id="+15550001", **group),
+            row(2, "tacos obviously", handle_id="+15550002", **group),
+            row(3, "@a settle it", handle_id="+15550003", **group),
+        )
+        self.client.get_msg.assert_awaited_once()
+        self.processor._as_utils.send_message_via_applescript.assert_awaited_once_with(
+            "iMessage;+;chat42", "on it"
+        )
+        context = self.client.get_msg.await_args.args[0]
+        self.assertEqual(
+            [e["content"] for e in context], ["pizza or tacos?", "tacos obviously", "settle it"]
+        )
+        self.assertEqual(self.db.history_queries, 1)
+
+    async def test_mention_to_send_is_measured(self):
+        metrics.reset()
+        await self._poll(row(1, "hello"), row(2, "@a hi"))
+        self.assertEqual(metrics.histograms["mention_to_send_seconds"].count, 1)
+        self.assertEqual(metrics.histograms["queue_wait_seconds"].count, 1)
+        self.assertEqual(metrics.counters["replies_total"], 1)
+        self.assertEqual(self.processor._traces, {})
+
+    async def test_mention_mid_message_is_traced(self):
+        metrics.reset()
+        await self._poll(row(1, "so @a what do you think"))
+        # traced like the query's instr prefilter matches it, wherever it is
+        self.assertEqual(metrics.histograms["detect_seconds"].count, 1)
+        self.assertEqual(metrics.histograms["queue_wait_seconds"].count, 1)
+        self.assertEqual(self.processor._traces, {})
+
+    async def test_ignores_messages_without_mention(self):
+        await self._poll(row(1, "just chatting"))
+        self.client.get_msg.assert_not_awaited()
+
+    async def test_history_is_only_queried_on_cold_start(self):
+        await self._poll(row(1, "hello"))
+        await self._poll(row(2, "@a hi"))
+        # the agent's own reply shows up in chat.db too
+        await self._poll(row(3, "on it", is_from_me=1))
+        await self._poll(row(4, "@a thanks"))
+
+        self.assertEqual(self.db.history_queries, 1)
+        context = self.client.get_msg.await_args.args[0]
+        self.assertEqual(
+            [(e["role"], e["content"]) for e in context],
+            [("user", "hello"), ("user", "hi"), ("assistant", "on it"), ("user", "thanks")],
+        )
+
+    async def test_only_needed_bodies_are_decoded(self):
+        metrics.reset()
+
+        def archived(rowid, text, mentions, chat_id):
+            message = row(rowid, None, chat_id=chat_id)
+            message.attributed_body, message.mentions = text.encode(), mentions
+            return message
+
+        await self._poll(
+            archived(1, "just chatting", False, chat_id=1),
+            archived(2, "@a hi", True, chat_id=2),
+        )
+        # chat 1 has nothing for the agent, so it's neither decoded nor loaded
+        self.assertEqual(self.db.decoded, [2])
+        self.assertEqual(self.db.history_queries, 1)
+        self.assertEqual(metrics.counters["bodies_skipped_total"], 1)
+        self.assertEqual(self.client.get_msg.await_args.args[0][-1]["content"], "hi")
+
+        # chat 2 is held now, so everything in it gets read
+        await self._poll(archived(3, "thanks", False, chat_id=2))
+        self.assertEqual(self.db.decoded, [2, 3])
+
+    async def test_mention_with_follow_up_is_one_question(self):
+        await self._poll(row(1, "@a what's the weather"), row(2, "in Paris"))
+        self.client.get_msg.assert_awaited_once()
+        context = self.client.get_msg.await_args.args[0]
+        self.assertEqual(context[-1]["content"], "in Paris")
+
+    async def test_burst_is_coalesced(self):
+        self.processor._scheduler._debounce = 0.05
+        for rowid, text in enumerate(["@a quick q", "@a actually", "@a never mind, this"], 1):
+            await self._ingest(row(rowid, text))
+        await self.processor._scheduler.join()
+
+        self.client.get_msg.assert_awaited_once()
+        context = self.client.get_msg.await_args.args[0]
+        self.assertEqual(context[-1]["content"], "never mind, this")
+        self.assertEqual(self.processor._scheduler.stats()["coalesced"], 2)
+
+    async def test_new_message_supersedes_generation(self):
+        metrics.reset()
+        started = asyncio.Event()
+
+        async def slow_reply(context, recalled=(), summary=None, chat_id=None):
+            started.set()
+            await asyncio.sleep(10 if len(context) == 1 else 0)
+            return "on it"
+
+        self.client.get_msg.side_effect = slow_reply
+        await self._ingest(row(1, "@a book a table"))
+        await started.wait()
+        await self._poll(row(2, "for four people"))
+
+        self.assertEqual(self.client.get_msg.await_count, 2)
+        self.processor._as_utils.send_message_via_applescript.assert_awaited_once()
+        self.assertEqual(metrics.counters["generations_superseded_total"], 1)
+
+    async def test_chatter_cant_supersede_a_reply_forever(self):
+        metrics.reset()
+
+        async def slow_reply(context, recalled=(), summary=None, chat_id=None):
+            await asyncio.sleep(0.2)
+            return "on it"
+
+        self.client.get_msg.side_effect = slow_reply
+        await self._ingest(row(1, "@a book a table"))
+        # a busy group chat talking over the generation, never mentioning us
+        for rowid in range(2, 12):
+            await asyncio.sleep(0.05)
+            await self._ingest(row(rowid, f"chatter {rowid}", handle_id="+15550002"))
+        await self.processor._scheduler.join()
+
+        self.assertEqual(metrics.counters["generations_superseded_total"], config["max_supersedes"])
+        self.assertEqual(self.client.get_msg.await_count, config["max_supersedes"] + 1)
+        self.processor._as_utils.send_message_via_applescript.assert_awaited_once()
+
+    async def test_echo_is_claimed_by_row_not_text(self):
+        await self._poll(row(1, "@a hi"))
+        # our reply's own row, then someone else saying the same thing
+        await self._poll(row(2, "on it", is_from_me=1), row(3, "on it"))
+
+        context = self.processor._context.get(1)
+        self.assertEqual(
+            [(e["role"], e["content"]) for e in context],
+            [("user", "hi"), ("assistant", "on it"), ("user", "on it")],
+        )
+        self.assertEqual(self.processor._echoes, {})
+
+    async def test_recalls_older_history_for_a_mention(self):
+        history = AsyncMock()
+        history.search.return_value = [{"rowid": 1, "text": "gate code 4512", "is_from_me": 0}]
+        self.processor._history = history
+        await self._poll(row(40, "@a what's the gate code"))
+
+        history.add.assert_awaited_once()
+        history.search.assert_awaited_once_with(1, "what's the gate code", 3, before_rowid=40)
+        self.assertEqual(self.client.get_msg.await_args.args[1], history.search.return_value)
+
+    async def test_run_catches_up_before_waiting(self):
+        missed = row(1, "@a sent while you were off")
+        self.db.history[1] = [missed]
+        self.db.batches.append([missed])
+        task = asyncio.create_task(self.processor.run())
+        self.addCleanup(task.cancel)
+        await asyncio.wait_for(self.processor.ready.wait(), 1)
+        await self.processor._scheduler.join()
+
+        self.processor._as_utils.send_message_via_applescript.assert_awaited_once()
+        self.assertEqual(self.db.cursor, 1)
+
+    async def test_long_conversation_is_summarized(self):
+        self.client.summarize.return_value = "they're planning a trip"
+        as_utils = self.processor._as_utils
+        self.processor = MessageProcessor(
+            self.db,
+            self.client,
+            dict(config, debounce_seconds=0, max_chat_items=4, summarize=True),
+        )
+        self.processor._as_utils = as_utils
+        await self._poll(*[row(rowid, f"m{rowid}") for rowid in range(1, 4)], row(4, "@a hi"))
+        await self._poll(row(6, "m6"), row(7, "@a so?"))
+        self.assertEqual(self.processor._context.needs_summary(), [1])
+
+        await self.processor._summarizer.summarize(1)
+        await self._poll(row(9, "@a and?"))
+        self.assertEqual(self.client.get_msg.await_args.kwargs["summary"], "they're planning a trip")
+        self.assertEqual(len(self.client.get_msg.await_args.args[0]), 3)
+
+    async def _restart(self, path, history):
+        """a new processor on the same state, the cursor never having been saved"""
+        state = await StateStore(path).open()
+        self.addAsyncCleanup(state.close)
+        self.db = FakeDatabaseManager(history)
+        self.processor = MessageProcessor(
+            self.db, self.client, dict(config, debounce_seconds=0), state=state
+        )
+        self.processor._as_utils = AsyncMock()
+        self.processor._as_utils.send_message_via_applescript.side_effect = (
+            lambda recipient, message: message
+        )
+        return state
+
+    async def test_restart_is_warm_and_answers_once(self):
+        test_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(test_dir.cleanup)
+        path = os.path.join(test_dir.name, "state.db")
+        # chat.db, shared by every restart
+        history = {1: []}
+        state = await self._restart(path, history)
+        await self._poll(row(1, "@a hi"))
+        await state.close()
+
+        # the mention comes round again, then our reply's row lands
+        await self._restart(path, history)
+        self.db.batches.append([row(1, "@a hi")])
+        await self.processor._process_new_messages()
+        await self._poll(row(2, "on it", is_from_me=1))
+        self.processor._as_utils.send_message_via_applescript.assert_not_awaited()
+        self.assertEqual(self.processor._echoes, {})
+
+        # a cold load knows the reply was ours by its guid
+        await self._restart(path, history)
+        await self._poll(row(3, "@a thanks"))
+        context = self.client.get_msg.await_args.args[0]
+        self.assertEqual(
+            [(e["role"], e["content"]) for e in context],
+            [("user", "hi"), ("assistant", "on it"), ("user", "thanks")],
+        )
+        self.assertEqual(self.client.get_msg.await_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
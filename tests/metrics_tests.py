@@ -0,0 +1,82 @@
+""" Metrics tests """
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+# Add the src directory to the sys.path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from config import config  # type: ignore
+from metrics import Histogram, Metrics, MetricsExporter  # type: ignore
+
+
+class TestMetrics(unittest.TestCase):
+    """Test class for Metrics"""
+
+    def test_histogram_quantiles(self):
+        histogram = Histogram(buckets=(0.1, 1.0, 10.0))
+        for value in [0.05] * 90 + [0.5] * 9 + [5.0]:
+            histogram.observe(value)
+        self.assertEqual(histogram.quantile(0.5), 0.1)
+        self.assertEqual(histogram.quantile(0.95), 1.0)
+        self.assertEqual(histogram.quantile(1.0), 10.0)
+        self.assertAlmostEqual(histogram.sum, 4.5 + 4.5 + 5.0)
+
+    def test_prometheus_text(self):
+        registry = Metrics()
+        registry.inc("polls_total")
+        registry.inc("polls_total")
+        registry.set("conversations_cached", 3)
+        with registry.span("generate"):
+            pass
+
+        text = registry.render()
+        self.assertIn("# TYPE aim_polls_total counter\naim_polls_total 2\n", text)
+        self.assertIn("aim_conversations_cached 3", text)
+        self.assertIn('aim_generate_seconds_bucket{le="+Inf"} 1', text)
+        self.assertIn("aim_generate_seconds_count 1", text)
+
+
+class TestMetricsExporter(unittest.IsolatedAsyncioTestCase):
+    """Test class for MetricsExporter"""
+
+    async def asyncSetUp(self):
+        self.registry = Metrics()
+        self.registry.inc("replies_total")
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.test_dir.cleanup)
+
+    async def test_disabled_by_default(self):
+        exporter = MetricsExporter(config, self.registry)
+        self.assertFalse(exporter.enabled)
+        await exporter.start()
+        await exporter.run()
+        await exporter.close()
+
+    async def test_json_snapshot(self):
+        path = os.path.join(self.test_dir.name, "metrics.json")
+        exporter = MetricsExporter(dict(config, metrics_path=path), self.registry)
+        await exporter.close()
+        with open(path, encoding="utf-8") as f:
+            self.assertEqual(json.load(f)["counters"], {"replies_total": 1})
+
+    async def test_http_endpoint(self):
+        exporter = MetricsExporter(dict(config, metrics_port=0), self.registry)
+        port = await exporter.start()
+        self.addAsyncCleanup(exporter.close)
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        response = await reader.read()
+        writer.close()
+        self.assertTrue(response.startswith(b"HTTP/1.1 200 OK"))
+        self.assertIn(b"aim_replies_total 1", response)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,257 @@
+""" Model client tests """
+
+import asyncio
+import sys
+import unittest
+from pathlib import Path
+from unittest.mock import AsyncMock
+
+# Add the src directory to the sys.path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from ollama import ResponseError  # type: ignore
+
+from config import config  # type: ignore
+from model_client import OllamaClient, ReplyChunker  # type: ignore
+from prompt_builder import PromptBuilder  # type: ignore
+from fake_ollama import FakeOllama
+
+
+def stream_of(*pieces):
+    """what AsyncClient.chat(stream=True) resolves to"""
+
+    async def parts():
+        for piece in pieces:
+            yield {"message": {"role": "assistant", "content": piece}}
+
+    return parts()
+
+
+class TestReplyChunker(unittest.TestCase):
+    """Test class for ReplyChunker"""
+
+    def test_sentence_boundaries(self):
+        chunker = ReplyChunker("sentence")
+        self.assertEqual(chunker.feed("Hey there! How are"), ["Hey there!"])
+        self.assertEqual(chunker.feed(" you? I'm"), ["How are you?"])
+        self.assertEqual(chunker.flush(), "I'm")
+
+    def test_list_markers_are_not_sentences(self):
+        chunker = ReplyChunker("sentence")
+        self.assertEqual(chunker.feed("Steps:\n1. Mix it.\n2. Bake"), ["Steps:\n1. Mix it."])
+        self.assertEqual(chunker.flush(), "2. Bake")
+
+    def test_paragraph_boundaries(self):
+        chunker = ReplyChunker("paragraph")
+        self.assertEqual(chunker.feed("One. Two.\n\nThree"), ["One. Two."])
+        self.assertEqual(chunker.flush(), "Three")
+
+    def test_short_chunks_are_joined(self):
+        chunker = ReplyChunker("sentence", min_chars=10)
+        self.assertEqual(chunker.feed("Hi. Yes. That works fine. "), ["Hi. Yes. That works fine."])
+
+
+class TestPromptBuilder(unittest.TestCase):
+    """Test class for PromptBuilder"""
+
+    def test_history_is_a_stable_message_sequence(self):
+        builder = PromptBuilder("be cool", token_budget=1000)
+        context = [
+            {"role": "user", "content": "hi"},
+            {"role": "assistant", "content": "hey"},
+        ]
+        first = builder.build(context)
+        context.append({"role": "user", "content": "what's new"})
+        second = builder.build(context)
+
+        self.assertEqual(first[0], {"role": "system", "content": "be cool"})
+        # the previous request is an exact prefix of the next one
+        self.assertEqual(second[: len(first)], first)
+
+    def test_drops_oldest_past_the_budget(self):
+        builder = PromptBuilder("be cool", token_budget=30)
+        context = [{"role": "user", "content": "x" * 40} for _ in range(4)]
+        context.append({"role": "user", "content": "y" * 400})
+        messages = builder.build(context)
+        # the message being answered always goes in
+        self.assertEqual([m["content"] for m in messages[1:]], ["y" * 400])
+
+    def test_recalled_messages_go_before_the_newest(self):
+        builder = PromptBuilder("be cool", token_budget=1000)
+        context = [
+            {"role": "user", "content": "hi"},
+            {"role": "assistant", "content": "hey"},
+        ]
+        first = builder.build(context)
+        context.append({"role": "user", "content": "what was the wifi password"})
+        second = builder.build(
+            context, [{"text": "it's hunter2", "snippet": "it's hunter2", "is_from_me": 0}]
+        )
+
+        self.assertEqual(second[: len(first)], first)
+        self.assertEqual(second[-2]["role"], "system")
+        self.assertIn("them: it's hunter2", second[-2]["content"])
+        self.assertEqual(second[-1]["content"], "what was the wifi password")
+
+    def test_summary_follows_the_system_prompt(self):
+        builder = PromptBuilder("be cool", token_budget=1000)
+        context = [{"role": "user", "content": "so, Friday?"}]
+        messages = builder.build(context, summary="They're planning dinner.")
+
+        self.assertEqual(messages[0], {"role": "system", "content": "be cool"})
+        self.assertEqual(messages[1]["role"], "system")
+        self.assertIn("They're planning dinner.", messages[1]["content"])
+        self.assertEqual(messages[2:], context)
+
+class TestOllamaClientStreaming(unittest.IsolatedAsyncioTestCase):
+    """Test class for OllamaClient.stream_msg"""
+
+    async def test_stream_msg_yields_sentences(self):
+        client = OllamaClient({**config, "stream_min_chars": 0})
+        client._client = AsyncMock()
+        client._client.chat.return_value = stream_of("Sure", " thing. ", "Here", " it is.")
+
+        timings = {}
+        context = [
+            {"role": "user", "content": "hello"},
+            {"role": "user", "content": "can you help"},
+        ]
+        chunks = [c async for c in client.stream_msg(context, timings)]
+
+        self.assertEqual(chunks, ["Sure thing.", "Here it is."])
+        kwargs = client._client.chat.call_args.kwargs
+        self.assertTrue(kwargs["stream"])
+        self.assertEqual(kwargs["options"], {"num_ctx": config["num_ctx"]})
+        self.assertEqual(kwargs["keep_alive"], config["keep_alive"])
+        self.assertIn("time_to_first_token", timings)
+        self.assertGreaterEqual(timings["total"], timings["time_to_first_token"])
+
+
+class TestOllamaClientSummarize(unittest.IsolatedAsyncioTestCase):
+    """Test class for OllamaClient.summarize"""
+
+    async def test_extends_the_previous_summary(self):
+        client = OllamaClient(config)
+        client._client = AsyncMock()
+        client._client.chat.return_value = {"message": {"content": " Dinner Friday at 8. "}}
+
+        summary = await client.summarize(
+            "They're planning dinner.",
+            [{"role": "user", "content": "Friday at 8?"}, {"role": "assistant", "content": "works"}],
+        )
+
+        self.assertEqual(summary, "Dinner Friday at 8.")
+        kwargs = client._client.chat.call_args.kwargs
+        prompt = kwargs["messages"][-1]["content"]
+        self.assertIn("They're planning dinner.", prompt)
+        self.assertIn("them: Friday at 8?\nyou: works", prompt)
+        self.assertEqual(kwargs["options"]["num_predict"], config["summary_tokens"])
+        self.assertEqual(kwargs["options"]["num_ctx"], config["num_ctx"])
+
+
+class TestOllamaClientWarmUp(unittest.IsolatedAsyncioTestCase):
+    """Test class for OllamaClient.warm_up and health"""
+
+    async def test_warm_up_loads_with_request_options(self):
+        client = OllamaClient(config)
+        client._client = AsyncMock()
+        client._client.chat.return_value = {"load_duration": 2500000000}
+        client._client.ps.return_value = {"models": [{"model": f"{config['model']}:latest"}]}
+
+        health = await client.warm_up()
+
+        kwargs = client._client.chat.call_args.kwargs
+        self.assertEqual(kwargs["messages"], [])
+        self.assertEqual(kwargs["options"], {"num_ctx": config["num_ctx"]})
+        self.assertTrue(health["loaded"])
+        self.assertEqual(health["load_seconds"], 2.5)
+        self.assertTrue((await client.health())["loaded"])
+
+    async def test_health_reports_unloaded_model(self):
+        client = OllamaClient(config)
+        client._client = AsyncMock()
+        client._client.chat.side_effect = ConnectionError("ollama isn't running")
+        client._client.ps.return_value = {"models": []}
+
+        self.assertFalse((await client.warm_up())["loaded"])
+        self.assertFalse((await client.health())["loaded"])
+
+
+def entry(role, content):
+    return {"role": role, "content": content}
+
+
+class TestOllamaClientAgainstServer(unittest.IsolatedAsyncioTestCase):
+    """OllamaClient over HTTP against the fake Ollama server"""
+
+    async def _start(self, **kwargs):
+        self.server = FakeOllama(**kwargs)
+        self.addAsyncCleanup(self.server.close)
+        url = await self.server.start()
+        return OllamaClient(dict(config, ollama_host=url))
+
+    async def test_get_msg(self):
+        client = await self._start(reply="on my way")
+        self.assertEqual(await client.get_msg([entry("user", "where are you")]), "on my way")
+
+        request = self.server.requests[0]
+        self.assertFalse(request["stream"])
+        self.assertEqual(request["options"], {"num_ctx": config["num_ctx"]})
+        self.assertEqual(request["keep_alive"], config["keep_alive"])
+        self.assertEqual(request["messages"][-1], entry("user", "where are you"))
+
+    async def test_stream_msg(self):
+        client = await self._start(
+            reply="The first sentence is long enough to go alone. Then another one follows.",
+            ttft=0.02,
+            tokens_per_second=200,
+        )
+        timings = {}
+        chunks = [c async for c in client.stream_msg([entry("user", "hi")], timings)]
+        self.assertEqual(
+            chunks,
+            ["The first sentence is long enough to go alone.", "Then another one follows."],
+        )
+        self.assertGreaterEqual(timings["time_to_first_token"], 0.02)
+
+    async def test_conversation_reuses_the_cached_prefix(self):
+        client = await self._start()
+        context = [entry("user", "dinner tonight?")]
+        await client.get_msg(context)
+        context += [entry("assistant", "sounds good to me"), entry("user", "7pm?")]
+        await client.get_msg(context)
+
+        first, second = self.server.requests
+        self.assertEqual(second["cached_tokens"], first["prompt_tokens"])
+        self.assertEqual(self.server.stats()["evaluated_tokens"], second["prompt_tokens"])
+
+    async def test_requests_queue_past_the_concurrency_limit(self):
+        client = await self._start(ttft=0.05, max_concurrency=1)
+        await asyncio.gather(*(client.get_msg([entry("user", str(i))]) for i in range(3)))
+
+        self.assertEqual(self.server.max_in_flight, 1)
+        self.assertGreater(max(r["queued_seconds"] for r in self.server.requests), 0.05)
+
+    async def test_injected_failures(self):
+        client = await self._start()
+        self.server.fail_next(status=500, error="out of memory")
+        with self.assertRaises(ResponseError):
+            await client.get_msg([entry("user", "hi")])
+        self.assertEqual(await client.get_msg([entry("user", "hi")]), "sounds good to me")
+
+        self.server.fail_next(mid_stream=True)
+        with self.assertRaises(Exception):
+            async for _ in client.stream_msg([entry("user", "hi")]):
+                pass
+        self.assertEqual(self.server.stats()["failed"], 2)
+
+    async def test_warm_up_and_health(self):
+        client = await self._start(load_seconds=0.01)
+        self.assertFalse((await client.health())["loaded"])
+        health = await client.warm_up()
+        self.assertGreaterEqual(health["load_seconds"], 0.01)
+        self.assertTrue((await client.health())["loaded"])
+
+
+if __name__ == "__main__":
+    unittest.main()
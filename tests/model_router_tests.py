@@ -0,0 +1,168 @@
+""" Model router tests """
+
+import asyncio
+import sys
+import unittest
+from pathlib import Path
+
+# Add the src directory to the sys.path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from ollama import ResponseError  # type: ignore
+
+from config import config  # type: ignore
+from metrics import metrics  # type: ignore
+from model_client import OllamaClient  # type: ignore
+from model_router import Backend, ModelRouter  # type: ignore
+from fake_ollama import FakeOllama
+
+
+def user(content):
+    return [{"role": "user", "content": content}]
+
+
+class TestModelRouter(unittest.IsolatedAsyncioTestCase):
+    """Test class for ModelRouter against several fake servers"""
+
+    async def _servers(self, *servers):
+        urls = []
+        for server in servers:
+            urls.append(await server.start())
+            self.addAsyncCleanup(server.close)
+        return urls
+
+    def _router(self, backends, **kwargs):
+        router = ModelRouter(backends, **kwargs)
+        self.addAsyncCleanup(router.close)
+        return router
+
+    async def test_least_loaded_spreads_requests(self):
+        servers = [FakeOllama(ttft=0.05), FakeOllama(ttft=0.05)]
+        urls = await self._servers(*servers)
+        router = self._router([Backend(url, "llama3", max_connections=2) for url in urls])
+
+        await asyncio.gather(*(router.chat(messages=user(f"hi {i}")) for i in range(4)))
+
+        self.assertEqual([len(s.requests) for s in servers], [2, 2])
+        self.assertEqual([b.in_flight for b in router.backends], [0, 0])
+        self.assertTrue(all(b.latency > 0 for b in router.backends))
+
+    async def test_size_policy_sends_short_messages_to_the_small_model(self):
+        small, large = FakeOllama(reply="k"), FakeOllama(reply="a long answer")
+        small_url, large_url = await self._servers(small, large)
+        router = self._router(
+            [Backend(large_url, "llama3:70b", "large"), Backend(small_url, "llama3.2:1b", "small")],
+            policy="size",
+            small_message_chars=20,
+        )
+
+        short = await router.chat(model="ignored", messages=user("thanks!"))
+        long = await router.chat(messages=user("what should I cook for eight people tonight?"))
+
+        self.assertEqual(short["message"]["content"], "k")
+        self.assertEqual(long["message"]["content"], "a long answer")
+        self.assertEqual([r["model"] for r in small.requests], ["llama3.2:1b"])
+        self.assertEqual([r["model"] for r in large.requests], ["llama3:70b"])
+
+    async def test_timeout_fails_over_and_cools_down(self):
+        metrics.reset()
+        slow, fast = FakeOllama(ttft=5), FakeOllama(reply="made it")
+        urls = await self._servers(slow, fast)
+        router = self._router(
+            [Backend(url, "llama3") for url in urls], timeout=0.2, cooldown=60
+        )
+
+        response = await router.chat(messages=user("hello"))
+        self.assertEqual(response["message"]["content"], "made it")
+        self.assertEqual(metrics.counters["backend_failovers_total"], 1)
+
+        # the slow one sits out its cooldown
+        await router.chat(messages=user("again"))
+        self.assertEqual((len(slow.requests), len(fast.requests)), (1, 2))
+        self.assertTrue(router.stats()[0]["down"])
+
+    async def test_server_error_fails_over(self):
+        broken, healthy = FakeOllama(), FakeOllama(reply="fine")
+        urls = await self._servers(broken, healthy)
+        broken.fail_next(status=500)
+        router = self._router([Backend(url, "llama3") for url in urls])
+
+        response = await router.chat(messages=user("hello"))
+        self.assertEqual(response["message"]["content"], "fine")
+        self.assertEqual(router.stats()[0]["failures"], 1)
+
+    async def test_every_backend_failing_raises(self):
+        servers = [FakeOllama(), FakeOllama()]
+        urls = await self._servers(*servers)
+        for server in servers:
+            server.fail_next(status=503)
+        router = self._router([Backend(url, "llama3") for url in urls])
+
+        with self.assertRaises(ResponseError):
+            await router.chat(messages=user("hello"))
+
+    async def test_no_backends_raises(self):
+        router = self._router([])
+        with self.assertRaisesRegex(RuntimeError, "no model backend"):
+            await router.chat(messages=user("hello"))
+        with self.assertRaisesRegex(RuntimeError, "no model backend"):
+            await anext(await router.chat(messages=user("hello"), stream=True))
+        with self.assertRaisesRegex(RuntimeError, "no model backend"):
+            await router.chat(messages=[])
+
+    async def test_older_ollama_without_ps_or_close(self):
+        class OldAsyncClient:
+            """AsyncClient as ollama 0.2.0 has it: chat, but no ps() or close()"""
+
+            def __init__(self, client):
+                self._client = client._client
+                self.chat = client.chat
+
+        server = FakeOllama(reply="hi")
+        urls = await self._servers(server)
+        client = OllamaClient(dict(config, backends=[{"host": urls[0], "model": "llama3"}]))
+        router = client._get_client()
+        backend = router.backends[0]
+        backend.client = OldAsyncClient(backend.client)
+
+        self.assertIsNone(await router.ps())
+        await client.warm_up()
+        self.assertTrue((await client.health())["loaded"])
+        await client.close()
+        self.assertTrue(backend.client._client.is_closed)
+
+    async def test_stream_fails_over_before_the_first_part(self):
+        broken, healthy = FakeOllama(), FakeOllama(reply="streamed to you")
+        urls = await self._servers(broken, healthy)
+        broken.fail_next(status=500)
+        router = self._router([Backend(url, "llama3") for url in urls])
+
+        stream = await router.chat(messages=user("hello"), stream=True)
+        text = "".join([part["message"]["content"] async for part in stream])
+
+        self.assertEqual(text, "streamed to you")
+        self.assertEqual([b.in_flight for b in router.backends], [0, 0])
+
+    async def test_ollama_client_warms_every_backend(self):
+        servers = [FakeOllama(reply="hey"), FakeOllama(reply="hey")]
+        urls = await self._servers(*servers)
+        client = OllamaClient(
+            dict(
+                config,
+                backends=[{"host": urls[0], "model": "llama3"}, {"host": urls[1], "model": "qwen2"}],
+            )
+        )
+        self.addAsyncCleanup(client.close)
+
+        await client.warm_up()
+        health = await client.health()
+        reply = await client.get_msg([{"role": "user", "content": "hi"}])
+
+        self.assertEqual([s.loaded_model for s in servers], ["llama3", "qwen2"])
+        self.assertTrue(health["loaded"])
+        self.assertEqual(len(health["backends"]), 2)
+        self.assertEqual(reply, "hey")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+""" Model warmer tests """
+
+import sys
+import asyncio
+import unittest
+from pathlib import Path
+from unittest.mock import AsyncMock
+
+# Add the src directory to the sys.path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from config import config  # type: ignore
+from model_warmer import ModelWarmer  # type: ignore
+
+
+class TestModelWarmer(unittest.IsolatedAsyncioTestCase):
+    """Test class for ModelWarmer"""
+
+    async def asyncSetUp(self):
+        self.client = AsyncMock()
+        self.client.warm_up.return_value = {"loaded": True}
+
+    async def _run_briefly(self, warmer):
+        task = asyncio.create_task(warmer.run())
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+    async def test_activity_after_quiet_spell_warms_immediately(self):
+        warmer = ModelWarmer(self.client, {**config, "keep_warm_interval": 600})
+        await warmer.warm_up()
+        self.client.warm_up.reset_mock()
+
+        # pretend the last ping was long ago
+        warmer._last_warm -= 3600
+        warmer.record_activity()
+        await self._run_briefly(warmer)
+        self.client.warm_up.assert_awaited_once()
+
+    async def test_recent_ping_is_not_repeated(self):
+        warmer = ModelWarmer(self.client, {**config, "keep_warm_interval": 600})
+        await warmer.warm_up()
+        self.client.warm_up.reset_mock()
+
+        warmer.record_activity()
+        await self._run_briefly(warmer)
+        self.client.warm_up.assert_not_awaited()
+
+    async def test_pings_stop_once_chats_go_quiet(self):
+        warmer = ModelWarmer(
+            self.client,
+            {**config, "keep_warm_interval": 0.01, "keep_warm_seconds": 60},
+        )
+        warmer._last_activity -= 3600
+        await self._run_briefly(warmer)
+        self.client.warm_up.assert_not_awaited()
+
+        warmer.record_activity()
+        await self._run_briefly(warmer)
+        self.client.warm_up.assert_awaited()
+
+
+if __name__ == "__main__":
+    unittest.main()
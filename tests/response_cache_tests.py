@@ -0,0 +1,139 @@
+""" Response cache tests """
+
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+# Add the src directory to the sys.path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from config import config  # type: ignore
+from model_client import OllamaClient  # type: ignore
+from response_cache import ResponseCache  # type: ignore
+from fake_ollama import FakeOllama
+
+
+def entry(role, content):
+    return {"role": role, "content": content}
+
+
+class TestResponseCache(unittest.IsolatedAsyncioTestCase):
+    """Test class for ResponseCache"""
+
+    async def asyncSetUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.test_dir.cleanup)
+        self.path = os.path.join(self.test_dir.name, "responses.db")
+
+    def _cache(self, **kwargs):
+        cache = ResponseCache(self.path, **kwargs)
+        self.addAsyncCleanup(cache.close)
+        return cache
+
+    async def test_key_ignores_case_and_punctuation(self):
+        cache = self._cache(context_messages=2)
+        base = [entry("user", "hey"), entry("assistant", "yo")]
+        self.assertEqual(
+            cache.key(base + [entry("user", "What's the weather like?")]),
+            cache.key(base + [entry("user", "whats the  weather like")]),
+        )
+        # the same words after a different message are a different question
+        self.assertNotEqual(
+            cache.key(base + [entry("user", "yes")]),
+            cache.key([entry("assistant", "want pizza?"), entry("user", "yes")]),
+        )
+        # only the last context_messages count
+        self.assertEqual(
+            cache.key([entry("user", "earlier")] * 10 + base + [entry("user", "yes")]),
+            cache.key(base + [entry("user", "yes")]),
+        )
+        # and never across scopes, e.g. chats
+        self.assertNotEqual(
+            cache.key(base + [entry("user", "yes")], "chat 1"),
+            cache.key(base + [entry("user", "yes")], "chat 2"),
+        )
+
+    async def test_hit_miss_and_persistence(self):
+        cache = self._cache()
+        key = cache.key([entry("user", "hi")])
+        self.assertIsNone(await cache.get(key))
+        await cache.put(key, "hey")
+        self.assertEqual(await cache.get(key), "hey")
+        self.assertEqual(cache.stats()["hit_rate"], 0.5)
+        await cache.close()
+
+        reopened = self._cache()
+        self.assertEqual(await reopened.get(key), "hey")
+
+    async def test_ttl(self):
+        cache = self._cache(ttl_seconds=0.05)
+        await cache.put("k", "v")
+        await asyncio.sleep(0.1)
+        self.assertIsNone(await cache.get("k"))
+
+    async def test_lru_eviction(self):
+        cache = self._cache(max_entries=2)
+        await cache.put("a", "1")
+        await cache.put("b", "2")
+        await cache.get("a")
+        await cache.put("c", "3")
+        self.assertIsNone(await cache.get("b"))
+        self.assertEqual(await cache.get("a"), "1")
+        self.assertEqual(await cache.get("c"), "3")
+        self.assertEqual(cache.stats()["size"], 2)
+
+    async def _client(self, server):
+        client = OllamaClient(
+            dict(
+                config,
+                ollama_host=await server.start(),
+                state_path=self.test_dir.name,
+                response_cache=True,
+            )
+        )
+        self.addAsyncCleanup(client.close)
+        return client
+
+    async def test_behind_get_msg(self):
+        server = FakeOllama(reply="sunny")
+        self.addAsyncCleanup(server.close)
+        client = await self._client(server)
+
+        for question in ["what's the weather?", "Whats the weather", "what's the time?"]:
+            await client.get_msg([entry("user", question)], chat_id=1)
+        # nothing is cached without a chat to scope it to
+        await client.get_msg([entry("user", "what's the time?")])
+
+        self.assertEqual(len(server.requests), 3)
+        self.assertEqual(client.response_cache_stats()["hits"], 1)
+
+    async def test_repeat_question_in_a_long_chat_hits(self):
+        server = FakeOllama(reply="sorry to hear about Bob's surgery")
+        self.addAsyncCleanup(server.close)
+        client = await self._client(server)
+
+        history = [
+            entry("user" if i % 2 else "assistant", f"catching up, message {i}") for i in range(12)
+        ]
+        tail = [entry("user", "hmm"), entry("user", "ok"), entry("user", "what do you think?")]
+        context = [entry("user", "Bob has surgery friday")] + history + tail
+        await client.get_msg(context, chat_id=1)
+        # asked again later in the same thread, after more history
+        reply = await client.get_msg(context + history[:4] + tail, chat_id=1)
+
+        self.assertEqual(reply, "sorry to hear about Bob's surgery")
+        self.assertEqual(len(server.requests), 1)
+        self.assertEqual(client.response_cache_stats()["hits"], 1)
+
+        # the same tail in another chat isn't served Bob's answer
+        server.reply = "pizza sounds great"
+        reply = await client.get_msg([entry("user", "pizza tonight?")] + history + tail, chat_id=2)
+        self.assertEqual(reply, "pizza sounds great")
+        self.assertEqual(len(server.requests), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+""" Startup profile tests """
+
+import sys
+import unittest
+from pathlib import Path
+
+# Add the src directory to the sys.path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from startup import StartupProfile  # type: ignore
+
+
+class TestStartupProfile(unittest.TestCase):
+    """Test class for StartupProfile"""
+
+    def test_times_imports_while_enabled(self):
+        sys.modules.pop("colorsys", None)
+        profile = StartupProfile(enabled=True)
+        self.addCleanup(profile.stop)
+        import colorsys  # noqa: F401
+
+        self.assertIn("colorsys", profile.imports)
+        profile.stop()
+        sys.modules.pop("wave", None)
+        import wave  # noqa: F401
+
+        self.assertNotIn("wave", profile.imports)
+
+    def test_marks_are_measured_from_creation(self):
+        profile = StartupProfile(enabled=False)
+        first = profile.mark("imports")
+        second = profile.mark("first poll")
+        self.assertLessEqual(first, second)
+        self.assertEqual([name for name, _ in profile.marks], ["imports", "first poll"])
+        self.assertEqual(profile.imports, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
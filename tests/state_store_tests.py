@@ -0,0 +1,106 @@
+""" State store tests """
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+# Add the src directory to the sys.path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from state_store import StateStore  # type: ignore
+
+
+class TestStateStore(unittest.IsolatedAsyncioTestCase):
+    """Test class for StateStore"""
+
+    async def asyncSetUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.test_dir.name, "state", "state.db")
+
+    async def asyncTearDown(self):
+        self.test_dir.cleanup()
+
+    async def _open(self, **kwargs):
+        store = await StateStore(self.path, **kwargs).open()
+        self.addAsyncCleanup(store.close)
+        return store
+
+    async def test_state_survives_a_restart(self):
+        store = await self._open()
+        store.set("cursor", 41)
+        store.record_reply(7, "iMessage;-;+15550001", "on it", 40)
+        store.record_reply(7, "iMessage;-;+15550001", "and this", 40)
+        store.claim_echo(7, "on it", "MSG-42", 42)
+        store.add_decoded(40, "@a from the blob")
+        store.set_summary(7, "planning a trip", 30)
+        store.set_summary(7, "planning a trip to Lisbon", 38)
+        await store.close()
+
+        restarted = await self._open()
+        self.assertEqual(restarted.get("cursor"), 41)
+        self.assertEqual(restarted.echoes(), [(7, "and this")])
+        self.assertEqual(restarted.sent_guids, {"MSG-42"})
+        self.assertEqual(restarted.chat(7)["answered_rowid"], 40)
+        self.assertEqual(restarted.chat(7)["replies"], 2)
+        self.assertEqual(restarted.decoded(), [(40, "@a from the blob")])
+        self.assertEqual(restarted.summary(7), ("planning a trip to Lisbon", 38))
+        self.assertEqual(restarted.summary(8), (None, 0))
+
+    async def test_writes_are_batched_and_coalesced(self):
+        store = await self._open()
+        for rowid in range(1, 101):
+            store.set("cursor", rowid)
+        self.assertEqual(store.get("cursor"), 100)
+        self.assertEqual(await store.flush(), 1)
+        self.assertEqual(await store.flush(), 0)
+        self.assertEqual(store.stats(), {"writes": 100, "rows_written": 1, "flushes": 1, "pending": 0})
+
+    async def test_reply_is_flushed_straight_away(self):
+        store = await self._open(flush_interval=60)
+        task = asyncio.create_task(store.run())
+        self.addCleanup(task.cancel)
+        store.set("cursor", 1)
+        await asyncio.sleep(0.05)
+        self.assertEqual(store.stats()["flushes"], 0)
+
+        store.record_reply(7, "iMessage;-;+15550001", "on it", 1)
+        for _ in range(100):
+            if store.stats()["flushes"]:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(store.stats()["pending"], 0)
+
+    async def test_old_entries_are_trimmed(self):
+        store = await self._open(max_decoded=2)
+        for rowid in range(1, 5):
+            store.add_decoded(rowid, f"body {rowid}")
+        await store.close()
+        restarted = await self._open(max_decoded=2)
+        self.assertEqual(restarted.decoded(), [(4, "body 4"), (3, "body 3")])
+
+    async def test_unclaimed_echoes_expire(self):
+        store = await self._open(echo_ttl=60, max_echoes=3)
+        store.record_reply(7, "iMessage;-;+15550001", "ok", 1)
+        # sent long ago, its row never turned up
+        store._echoes[0] = (7, "ok", time.time() - 120)
+        await store.flush()
+        await store._conn.execute(
+            "UPDATE echoes SET sent_at = ? WHERE text = 'ok';", (time.time() - 120,)
+        )
+        for i in range(4):
+            store.record_reply(7, "iMessage;-;+15550001", f"reply {i}", 1)
+        self.assertEqual(store.echoes(), [(7, "reply 1"), (7, "reply 2"), (7, "reply 3")])
+        await store.close()
+
+        restarted = await self._open(echo_ttl=60, max_echoes=3)
+        self.assertEqual(restarted.echoes(), [(7, "reply 1"), (7, "reply 2"), (7, "reply 3")])
+        rows = await restarted._conn.execute_fetchall("SELECT text FROM echoes ORDER BY rowid;")
+        self.assertEqual([r[0] for r in rows], ["reply 1", "reply 2", "reply 3"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+"""
+Stand-in for the osascript send helper, speaks the same JSON lines protocol.
+
+    python tests/stub_send_helper.py [--delay SECONDS] [--log PATH] [--fail-first N] [--stall]
+"""
+
+import argparse
+import json
+import sys
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds per send")
+    parser.add_argument("--log", help="append each request here as a JSON line")
+    parser.add_argument("--fail-first", type=int, default=0, help="fail this many sends")
+    parser.add_argument("--stall", action="store_true", help="log requests but never answer")
+    parser.add_argument("--once", action="store_true", help="exit after one request")
+    args = parser.parse_args()
+
+    failures = args.fail_first
+    for line in sys.stdin:
+        request = json.loads(line)
+        time.sleep(args.delay)
+        if args.stall:
+            if args.log:
+                with open(args.log, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(request) + "\n")
+            # as if Messages hung mid send
+            time.sleep(3600)
+        if failures > 0:
+            failures -= 1
+            reply = {"ok": False, "error": "injected failure"}
+        else:
+            if args.log:
+                with open(args.log, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(request) + "\n")
+            reply = {"ok": True}
+        sys.stdout.write(json.dumps(reply) + "\n")
+        sys.stdout.flush()
+        if args.once:
+            break
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+""" Conversation summarizer tests """
+
+import asyncio
+import sys
+import unittest
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock
+
+# Add the src directory to the sys.path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from config import config  # type: ignore
+from context_cache import ConversationContextCache  # type: ignore
+from message import Message  # type: ignore
+from summarizer import ConversationSummarizer  # type: ignore
+
+
+def row(rowid, text):
+    return Message(rowid, f"MSG-{rowid}", 1, "iMessage;-;+15550001", "+15550001", text, 0)
+
+
+class TestConversationSummarizer(unittest.IsolatedAsyncioTestCase):
+    """Test class for ConversationSummarizer"""
+
+    async def asyncSetUp(self):
+        self.context = ConversationContextCache(4, "@a", keep_trimmed=True)
+        self.context.load(1, [])
+        self.client = AsyncMock()
+        self.client.summarize.side_effect = lambda summary, entries: " ".join(
+            ([summary] if summary else []) + [e["content"] for e in entries]
+        )
+        self.state = MagicMock()
+
+    def _say(self, *rowids):
+        for rowid in rowids:
+            self.context.append(1, row(rowid, f"m{rowid}"))
+
+    def _summarizer(self, idle=0.01, busy=None):
+        return ConversationSummarizer(
+            self.client,
+            self.context,
+            {**config, "summary_idle_seconds": idle},
+            state=self.state,
+            busy=busy,
+        )
+
+    async def _run_briefly(self, summarizer, seconds=0.1):
+        task = asyncio.create_task(summarizer.run())
+        await asyncio.sleep(seconds)
+        task.cancel()
+
+    async def test_summary_is_extended_not_rewritten(self):
+        summarizer = self._summarizer()
+        self._say(1, 2, 3, 4, 5)
+        await self._run_briefly(summarizer)
+        self.assertEqual(self.context.summary(1), "m1 m2 m3")
+
+        self._say(6, 7, 8)
+        await self._run_briefly(summarizer)
+        # only the newly trimmed messages went to the model
+        summary, entries = self.client.summarize.await_args.args
+        self.assertEqual(summary, "m1 m2 m3")
+        self.assertEqual([e["content"] for e in entries], ["m4", "m5", "m6"])
+        self.assertEqual(self.context.summary(1), "m1 m2 m3 m4 m5 m6")
+        self.state.set_summary.assert_called_with(1, "m1 m2 m3 m4 m5 m6", 6)
+        self.assertEqual(self.context.needs_summary(), [])
+
+    async def test_waits_for_a_quiet_spell(self):
+        summarizer = self._summarizer(idle=60)
+        self._say(1, 2, 3, 4, 5)
+        await self._run_briefly(summarizer)
+        self.client.summarize.assert_not_awaited()
+
+        busy = True
+        summarizer = self._summarizer(busy=lambda: busy)
+        await self._run_briefly(summarizer)
+        self.client.summarize.assert_not_awaited()
+        busy = False
+        await self._run_briefly(summarizer, 1.2)
+        self.client.summarize.assert_awaited_once()
+
+    async def test_activity_cancels_a_summary_in_flight(self):
+        started = asyncio.Event()
+
+        async def slow_summary(summary, entries):
+            started.set()
+            await asyncio.sleep(10)
+
+        self.client.summarize.side_effect = slow_summary
+        summarizer = self._summarizer(idle=0.01)
+        self._say(1, 2, 3, 4, 5)
+        task = asyncio.create_task(summarizer.run())
+        self.addCleanup(task.cancel)
+        await asyncio.wait_for(started.wait(), 1)
+        summarizer.record_activity()
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+        # the loop carries on and the messages are still waiting
+        self.assertFalse(task.done())
+        self.assertIsNone(self.context.summary(1))
+        self.assertEqual(len(self.context.pending_summary(1)[1]), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()